@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+""" Benchmark harness measuring the overhead of grit itself.
+
+Generates synthetic projects (multi-layer configs with deep profile inheritance) with 100, 1000, 10000, ...
+repositories, backed by local bare repositories accessed via file:// URLs, and measures each phase of typical
+grit usage: init, loading the active manifest, selecting target repositories, clone, status, status --changed-only
+(with no and with all work trees changed since they were found clean), foreach and snapshot. For each phase, the
+wall time, the peak RSS of the grit process and the number of spawned git/bash processes (counted via PATH shims)
+are reported.
+
+The results can be saved (--save) and compared against a saved baseline (--compare), e.g. to detect performance
+regressions, or to compare two versions of grit.py (--grit).
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import statistics
+import subprocess
+
+
+BENCH_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_GRIT_PATH = os.path.join(os.path.dirname(BENCH_DIRECTORY), "grit.py")
+DEFAULT_WORK_DIRECTORY = "/tmp/grit_bench"
+PHASES = ["init", "load", "load-json", "targets", "clone", "status", "changed-none", "changed-all", "foreach",
+          "snapshot"]
+SPAWN_SHIMS = ["git", "bash"]   # Programs whose spawns are counted.
+SPAWN_LOG_ENV = "GRIT_BENCH_SPAWN_LOG"
+TARGET_GROUPS = "g1,g2"   # Group selection used by the targets phase (plain groups work with any grit version).
+
+# Executed in a separate python process (like grit itself), so the import and the RSS are measured as in practice.
+# Arguments: grit file path, "cache" or "json", group expression. Prints the timings as JSON.
+LOAD_SNIPPET = """
+import sys, time, json, inspect, importlib.util
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("grit", sys.argv[1])
+grit = importlib.util.module_from_spec(spec)
+sys.modules["grit"] = grit
+spec.loader.exec_module(grit)
+imported = time.perf_counter()
+manifest = grit.Manifest()
+if sys.argv[2] == "json" and len(inspect.signature(manifest.load_active_manifest).parameters) > 0:
+    manifest.load_active_manifest(False)
+else:
+    manifest.load_active_manifest()
+loaded = time.perf_counter()
+repos = manifest.get_target_repos(sys.argv[3])
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "load": loaded - imported, "targets": done - loaded,
+                  "repos": len(repos)}))
+"""
+
+
+class BenchProject(object):
+    """ A synthetic grit project with a given number of repositories, and the bare repositories it refers to.
+    The bare repositories are shared by all project sizes (and kept between runs, since they are expensive to
+    create), while the project itself is regenerated for each run.
+    """
+
+    def __init__(self, work_directory: str, size: int, layers: int, inherit_depth: int):
+        self.work_directory = work_directory
+        self.size = size
+        self.layers = max(layers, 1)
+        self.inherit_depth = max(inherit_depth, 1)
+        self.remotes_directory = os.path.join(work_directory, "remotes")
+        self.project_directory = os.path.join(work_directory, "project_" + str(size))
+
+    @staticmethod
+    def get_repo_name(index: int):
+        return "bench/r" + str(index).zfill(5)
+
+    def create_remotes(self):
+        """ Create any missing bare repositories. Each one is a copy of a template repository with one commit. """
+        template_path = os.path.join(self.remotes_directory, "_template.git")
+        if not os.path.exists(template_path):
+            work_tree = os.path.join(self.work_directory, "_template")
+            shutil.rmtree(work_tree, ignore_errors=True)
+            git_env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@localhost",
+                           GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@localhost")
+            subprocess.run(["git", "init", "-q", "-b", "master", work_tree], check=True, env=git_env)
+            with open(os.path.join(work_tree, "README"), "w") as file_stream:
+                file_stream.write("grit benchmark repository\n")
+            subprocess.run(["git", "add", "README"], cwd=work_tree, check=True, env=git_env)
+            subprocess.run(["git", "commit", "-q", "-m", "Initial commit"], cwd=work_tree, check=True, env=git_env)
+            os.makedirs(self.remotes_directory, exist_ok=True)
+            subprocess.run(["git", "clone", "-q", "--bare", work_tree, template_path + ".tmp"], check=True,
+                           env=git_env)
+            os.rename(template_path + ".tmp", template_path)
+            shutil.rmtree(work_tree)
+        for index in range(self.size):
+            remote_path = os.path.join(self.remotes_directory, *(self.get_repo_name(index) + ".git").split("/"))
+            if not os.path.exists(remote_path):
+                shutil.copytree(template_path, remote_path + ".tmp")
+                os.rename(remote_path + ".tmp", remote_path)
+
+    def create_project(self):
+        """ (Re)create the project directory with the manifest layers and config file. """
+        shutil.rmtree(self.project_directory, ignore_errors=True)
+        manifest_directory = os.path.join(self.project_directory, ".grit", "m")
+        os.makedirs(manifest_directory)
+        # Base layer: a chain of inheriting profiles and all repositories.
+        profiles = [{"profile": "p0", "remote-url": "file://" + os.path.abspath(self.remotes_directory),
+                     "branch": "master"}]
+        for level in range(1, self.inherit_depth):
+            profiles.append({"profile": "p" + str(level), "inherit": "p" + str(level - 1)})
+        repos = []
+        for index in range(self.size):
+            repos.append({"repository": self.get_repo_name(index),
+                          "directory": "repos/r" + str(index).zfill(5),
+                          "groups": ["g" + str(index % 10), "h" + str(index % 7)]})
+        layers = {"base": {"profiles": profiles,
+                           "default-profile": "p" + str(self.inherit_depth - 1),
+                           "repositories": repos}}
+        # Upper layers: override settings of the profiles and some of the repositories.
+        for layer in range(1, self.layers):
+            overlay_profiles = [{"profile": "p0", "depth": "1"}] if layer == 1 else []
+            overlay_profiles.append({"profile": "p" + str(layer % self.inherit_depth), "single-branch": "yes"})
+            overlay_repos = [{"repository": self.get_repo_name(index),
+                              "groups": ["g" + str(index % 10), "h" + str(index % 7), "layer" + str(layer)]}
+                             for index in range(layer, self.size, layer + 2)]
+            layers["layer" + str(layer)] = {"profiles": overlay_profiles, "repositories": overlay_repos}
+        for name, manifest in layers.items():
+            with open(os.path.join(manifest_directory, name + ".json"), "w") as file_stream:
+                json.dump(manifest, file_stream, indent=1)
+        with open(os.path.join(manifest_directory, "config.json"), "w") as file_stream:
+            json.dump({"manifest-layers": list(layers)}, file_stream, indent=1)
+
+    def remove_clones(self):
+        shutil.rmtree(os.path.join(self.project_directory, "repos"), ignore_errors=True)
+
+    def touch_clones(self):
+        """ Change the modification time of a tracked file in each clone, which changes the work tree but not its
+        git status.
+        """
+        for index in range(self.size):
+            os.utime(os.path.join(self.project_directory, "repos", "r" + str(index).zfill(5), "README"))
+
+
+class BenchRunner(object):
+    """ Runs the phases of the benchmark and collects the results. """
+
+    def __init__(self, args):
+        self.args = args
+        self.grit_path = os.path.abspath(args.grit)
+        self.shim_directory = os.path.join(os.path.abspath(args.work_directory), "_shims")
+        self.spawn_log_path = os.path.join(os.path.abspath(args.work_directory), "_spawns.log")
+        self.env = dict(os.environ)
+        self.env.pop(SPAWN_LOG_ENV, None)
+        if args.count_spawns:
+            self.create_shims()
+            self.env["PATH"] = self.shim_directory + os.pathsep + self.env.get("PATH", "")
+            self.env[SPAWN_LOG_ENV] = self.spawn_log_path
+
+    def create_shims(self):
+        """ Create shims (in front of PATH) logging each spawn of the programs before executing the real one. """
+        os.makedirs(self.shim_directory, exist_ok=True)
+        for program in SPAWN_SHIMS:
+            program_path = shutil.which(program)
+            if program_path is None:
+                raise ValueError("Program " + program + " not found!")
+            shim_path = os.path.join(self.shim_directory, program)
+            with open(shim_path, "w") as file_stream:
+                file_stream.write("#!/bin/sh\necho " + program + " >> \"$" + SPAWN_LOG_ENV + "\"\nexec "
+                                  + program_path + " \"$@\"\n")
+            os.chmod(shim_path, 0o755)
+
+    def read_spawn_counts(self):
+        """ Returns the number of spawns per program since last call, and clears the log. """
+        counts = {program: 0 for program in SPAWN_SHIMS}
+        try:
+            with open(self.spawn_log_path, "r") as file_stream:
+                for line in file_stream:
+                    counts[line.strip()] = counts.get(line.strip(), 0) + 1
+            os.remove(self.spawn_log_path)
+        except FileNotFoundError:
+            pass
+        return counts
+
+    def run_measured(self, command_args: list, cwd: str):
+        """ Run a command and return its wall time (seconds), peak RSS (KiB) and output. The peak RSS is of the
+        command process only, not of its children (e.g. git).
+        """
+        start = time.perf_counter()
+        process = subprocess.Popen(command_args, cwd=cwd, env=self.env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        output = process.stdout.read()   # Read until EOF first; waiting with a full pipe would dead-lock.
+        process.stdout.close()
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        if process.returncode != 0:
+            raise RuntimeError("Failed to run " + " ".join(command_args) + ":\n" + output.decode(errors="replace"))
+        return elapsed, rusage.ru_maxrss, output
+
+    def run_grit(self, project: BenchProject, grit_args: list):
+        return self.run_measured([sys.executable, self.grit_path, "--no-log"] + grit_args, project.project_directory)
+
+    def run_phase(self, project: BenchProject, phase: str):
+        """ Run one phase once. Returns a dict with the results. """
+        if phase in ("load", "load-json", "targets"):
+            elapsed, rss, output = self.run_measured([sys.executable, "-c", LOAD_SNIPPET, self.grit_path,
+                                                      "json" if phase == "load-json" else "cache", TARGET_GROUPS],
+                                                     project.project_directory)
+            timings = json.loads(output.decode().strip().splitlines()[-1])
+            # Report the time of the operation itself, excluding the interpreter startup.
+            elapsed = timings["targets"] if phase == "targets" else timings["load"]
+        elif phase == "init":
+            elapsed, rss, _ = self.run_grit(project, ["init", "-c", "m/config"])
+        elif phase == "clone":
+            project.remove_clones()
+            elapsed, rss, _ = self.run_grit(project, ["-j", str(self.args.jobs), "clone"])
+        elif phase == "status":
+            elapsed, rss, _ = self.run_grit(project, ["-j", str(self.args.jobs), "status", "-s"])
+        elif phase in ("changed-none", "changed-all"):
+            # First record all repos as clean (not measured), then change all work trees (if so specified) without
+            # making them dirty, i.e. the worst case for --changed-only.
+            self.run_grit(project, ["-j", str(self.args.jobs), "status", "--changed-only", "-s"])
+            if phase == "changed-all":
+                project.touch_clones()
+            self.read_spawn_counts()
+            elapsed, rss, _ = self.run_grit(project, ["-j", str(self.args.jobs), "status", "--changed-only", "-s"])
+        elif phase == "foreach":
+            elapsed, rss, _ = self.run_grit(project, ["-j", str(self.args.jobs), "foreach", "true"])
+        elif phase == "snapshot":
+            elapsed, rss, _ = self.run_grit(project, ["-j", str(self.args.jobs), "snapshot", "bench_snapshot"])
+        else:
+            raise ValueError("Unknown phase " + phase)
+        result = {"seconds": elapsed, "rss-kib": rss}
+        spawns = self.read_spawn_counts()
+        if self.args.count_spawns:
+            result["spawns"] = spawns
+        return result
+
+    def run(self):
+        """ Run all phases for all sizes. Returns the results: {size: {phase: result}}. """
+        results = {}
+        for size in self.args.sizes:
+            project = BenchProject(self.args.work_directory, size, self.args.layers, self.args.inherit_depth)
+            print("Preparing " + str(size) + " repositories...", file=sys.stderr)
+            project.create_remotes()
+            project.create_project()
+            results[str(size)] = {}
+            for phase in PHASES:   # Always in this order, since later phases depend on earlier ones.
+                if phase not in self.args.phases:
+                    self.prepare_phase(project, phase)
+                    continue
+                try:
+                    runs = [self.run_phase(project, phase) for _ in range(self.args.repeat)]
+                except RuntimeError as err:
+                    # E.g. a grit version not supporting a phase. Continue with the next phase.
+                    print("  " + phase + ": " + str(err), file=sys.stderr)
+                    results[str(size)][phase] = {"error": str(err).splitlines()[0]}
+                    self.read_spawn_counts()
+                    continue
+                # Use the median time of the runs; RSS and spawns are the same (or close enough) for each run.
+                result = dict(runs[-1])
+                result["seconds"] = statistics.median(run["seconds"] for run in runs)
+                results[str(size)][phase] = result
+                print("  " + phase + ": {:.3f} s".format(result["seconds"]), file=sys.stderr)
+        return results
+
+    def prepare_phase(self, project: BenchProject, phase: str):
+        """ Perform (without measuring) a phase that is not selected, if needed by the selected phases. """
+        if phase == "init":
+            self.run_grit(project, ["init", "-c", "m/config"])
+        elif phase == "clone" and any(phase in self.args.phases for phase in ("status", "changed-none", "changed-all",
+                                                                         "foreach", "snapshot")):
+            self.run_grit(project, ["-j", str(self.args.jobs), "clone"])
+        self.read_spawn_counts()
+
+
+def format_spawns(result: dict):
+    if "spawns" not in result:
+        return "-"
+    return "/".join(str(result["spawns"].get(program, 0)) for program in SPAWN_SHIMS)
+
+
+def print_results(results: dict, baseline: dict=None, threshold: float=10.0, min_delta: float=0.01):
+    """ Print the results as a table, with the change compared to the baseline (if any).
+    Returns the number of regressions, i.e. phases being more than threshold percent (and min_delta seconds)
+    slower than the baseline.
+    """
+    regressions = 0
+    header = "{:>7}  {:<12} {:>10} {:>10} {:>14}".format("repos", "phase", "time [s]", "RSS [MB]",
+                                                         "spawns " + "/".join(SPAWN_SHIMS))
+    if baseline is not None:
+        header += "  {:>12} {:>10}".format("baseline [s]", "change")
+    print(header)
+    for size, phases in results.items():
+        for phase, result in phases.items():
+            if "error" in result:
+                print("{:>7}  {:<12} {:>10}".format(size, phase, "failed"))
+                continue
+            line = "{:>7}  {:<12} {:>10.3f} {:>10.1f} {:>14}".format(size, phase, result["seconds"],
+                                                                     result["rss-kib"] / 1024, format_spawns(result))
+            baseline_result = baseline.get(size, {}).get(phase) if baseline is not None else None
+            if baseline_result is not None and "error" not in baseline_result:
+                change = 100.0 * (result["seconds"] - baseline_result["seconds"]) / max(baseline_result["seconds"],
+                                                                                        1e-9)
+                line += "  {:>12.3f} {:>+9.1f}%".format(baseline_result["seconds"], change)
+                if change > threshold and result["seconds"] - baseline_result["seconds"] > min_delta:
+                    line += "  REGRESSION"
+                    regressions += 1
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of grit using synthetic projects.")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[100, 1000],
+                        help="comma-separated number of repositories of the projects. Default is 100,1000.")
+    parser.add_argument("--phases", type=lambda value: value.split(","), default=PHASES,
+                        help="comma-separated phases to run. Default is all: " + ",".join(PHASES) + ".")
+    parser.add_argument("--jobs", "-j", type=int, default=8, help="parallel jobs (grit -j). Default is 8.")
+    parser.add_argument("--layers", type=int, default=3, help="number of manifest layers. Default is 3.")
+    parser.add_argument("--inherit-depth", type=int, default=10, dest="inherit_depth",
+                        help="depth of the profile inheritance chain. Default is 10.")
+    parser.add_argument("--repeat", type=int, default=1, help="number of runs per phase (median is used).")
+    parser.add_argument("--grit", default=DEFAULT_GRIT_PATH, help="the grit.py to benchmark.")
+    parser.add_argument("--work-directory", default=DEFAULT_WORK_DIRECTORY, dest="work_directory",
+                        help="directory for the generated repositories and projects. Default is "
+                             + DEFAULT_WORK_DIRECTORY + ".")
+    parser.add_argument("--no-spawn-count", action="store_false", dest="count_spawns",
+                        help="do not count spawned processes (the shims add a small overhead to each spawn).")
+    parser.add_argument("--save", default=None, help="save the results to the file (JSON).")
+    parser.add_argument("--compare", default=None, help="compare the results with saved results (JSON).")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent slower than the baseline to report as regression. Default is 10.")
+    parser.add_argument("--min-delta", type=float, default=0.01, dest="min_delta",
+                        help="min seconds slower than the baseline to report as regression (avoids reporting noise"
+                             " of very short phases). Default is 0.01.")
+    args = parser.parse_args()
+    for phase in args.phases:
+        if phase not in PHASES:
+            parser.error("unknown phase " + phase)
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r") as file_stream:
+            baseline = json.load(file_stream)["results"]
+    results = BenchRunner(args).run()
+    regressions = print_results(results, baseline, args.threshold, args.min_delta)
+    if args.save is not None:
+        with open(args.save, "w") as file_stream:
+            json.dump({"grit": os.path.abspath(args.grit), "jobs": args.jobs, "layers": args.layers,
+                       "inherit-depth": args.inherit_depth, "count-spawns": args.count_spawns,
+                       "time": time.strftime("%Y%m%d %H:%M:%S"), "results": results}, file_stream, indent=1)
+    if regressions > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
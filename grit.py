@@ -1,25 +1,151 @@
 #!/usr/bin/env python3
+# NOTE: To keep the startup time short, only modules that are always needed are imported here. Other modules are
+# imported where they are used (importing e.g. asyncio takes longer than executing a simple git command).
 import os
 import sys
+import io
 import time
-import json
-import argparse
-import subprocess
-import threading
-import queue
-import logging
 
-logger = logging.getLogger(__name__)
+STARTUP_CPU_TIME = time.process_time()   # Python startup and compilation of this file (used by --timing).
+STARTUP_TIME = time.perf_counter()       # Start of this module (used by --timing).
 
+
+class Logger(object):
+    """ Wrapper of a logging.Logger, which imports the logging module only when needed (it's not needed to execute
+    a command, unless debug mode is enabled). Until then, debug messages are dropped, since no handlers can have
+    been configured. If the logging module has already been imported (e.g. by an application importing grit), the
+    logger is used as usual.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.logger = None    # The logging.Logger, when needed.
+        self.handler = None   # The handler added by enable_debug, if any.
+
+    def get_logger(self):
+        if self.logger is None:
+            import logging
+            self.logger = logging.getLogger(self.name)
+        return self.logger
+
+    def enable_debug(self):
+        """ Log debug messages on stderr. Same as logging.basicConfig(level=logging.DEBUG), unless logging is
+        already configured.
+        """
+        import logging
+        root_logger = logging.getLogger()
+        if self.handler is None and not root_logger.hasHandlers():
+            self.handler = logging.StreamHandler()
+            self.handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+            root_logger.addHandler(self.handler)
+        if self.handler is not None:
+            # A grit daemon redirects sys.stderr for each request.
+            self.handler.setStream(sys.stderr)
+        self.get_logger().setLevel(logging.DEBUG)
+
+    def disable_debug(self):
+        """ Undo enable_debug. Used by a grit daemon for each request. """
+        if self.logger is not None:
+            import logging
+            self.logger.setLevel(logging.NOTSET)
+
+    def debug(self, message: str):
+        if self.logger is None:
+            if "logging" not in sys.modules:
+                return   # Nothing can be configured to handle the message.
+            self.get_logger()
+        self.logger.debug(message)
+
+
+logger = Logger(__name__)
+
+
+class Timing(object):
+    """ Records the time of the startup phases etc., printed by the --timing option. """
+
+    def __init__(self):
+        self.enabled = False
+        self.startup_cpu_time = STARTUP_CPU_TIME
+        self.marks = [("module loaded", STARTUP_TIME)]
+
+    def reset(self, label: str):
+        """ Start over from now, with the label as start mark. Used by a grit daemon for each request. """
+        self.enabled = False
+        self.startup_cpu_time = None
+        self.marks = [(label, time.perf_counter())]
+
+    def mark(self, label: str, once: bool=False):
+        """ Record the time of the label (end of a phase). If once, only the first time is recorded. """
+        if once and any(mark_label == label for mark_label, _ in self.marks):
+            return
+        self.marks.append((label, time.perf_counter()))
+
+    def print_report(self):
+        """ Print the recorded times on stderr. """
+        if self.startup_cpu_time is not None:
+            print("Python startup and compilation (CPU time): {:8.1f} ms".format(self.startup_cpu_time * 1000),
+                  file=sys.stderr)
+        start_time = previous_time = self.marks[0][1]
+        for label, mark_time in self.marks[1:]:
+            print("{:<42} {:8.1f} ms  (total {:8.1f} ms)".format(label + ":", (mark_time - previous_time) * 1000,
+                                                                 (mark_time - start_time) * 1000),
+                  file=sys.stderr)
+            previous_time = mark_time
+
+
+timing = Timing()
+root_paths = {}   # Project root path per working directory; see Manifest.get_root_path.
+
+VERSION = "1.0"
 GRIT_DIRECTORY = ".grit"
 LOG_FILE_NAME = "_commands.log"
+JSONL_LOG_FILE_NAME = "_commands.jsonl"   # Structured command log (--log-format jsonl), one JSON record per line.
 ACTIVE_MANIFEST_FILE = "_active_manifest"   # .json is added automatically
+ACTIVE_MANIFEST_CACHE_FILE = "_active_manifest.cache"   # Precompiled active manifest (pickle format).
+# Must be increased whenever the precompiled active manifest content is changed in an incompatible way.
+ACTIVE_MANIFEST_CACHE_VERSION = 1
+ACTIVE_MANIFEST_STAMP_FILE = "_active_manifest.stamp"   # What the active manifest was generated from (JSON format).
+ACTIVE_MANIFEST_STAMP_VERSION = 1   # Increase if the generation of the active manifest is changed.
 GRIT_ALIASES_FILE = ".gritaliases"
+# Commands implemented by grit itself. Aliases are not loaded for these (see Grit.substitute_aliases).
+BUILTIN_COMMANDS = ["init", "clone", "foreach", "snapshot", "cache", "stats", "daemon", "dirty"]
 ACTIVE_CONFIG_FILE = "_config"   # Contains the current active config (file path to config file except .json)
-# Command queue extra size in addition to the number of parallel jobs. This is used to make sure the
-# queue is always full (in practise).
-COMMAND_QUEUE_EXTRA_SIZE = 2
-JOB_QUEUE_TIMEOUT = 0.1   # 100ms
+OUTPUT_CHUNK_SIZE = 65536   # Max number of bytes (or characters) to read/write command output at a time.
+# Default max number of bytes of command output to keep in memory (per command). Any output above
+# this limit is stored in a temporary file instead.
+OUTPUT_MEMORY_LIMIT = 1024 * 1024
+JOB_STATS_FILE = "_stats.json"   # Recorded job durations per command and repo.
+JOB_STATS_HISTORY = 5   # Number of recorded durations (latest ones) per command and repo.
+JOB_LIMIT_CONTROL_INTERVAL = 1.0   # Seconds between the checks of the job limit controller (--dynamic-jobs).
+JOB_LIMIT_HOLD_TIME = 5.0   # Min seconds between job limit changes, for the effect of a change to be observed.
+JOB_SLOWDOWN_LIMIT = 2.0    # Jobs taking this many times longer than recorded indicate overload.
+DEFAULT_MAX_MEMORY_USE = 90.0   # Default --max-mem (percent).
+MANIFEST_JOBS = 16   # Max number of parallel jobs when fetching or updating manifest gits (init).
+DIRTY_STATE_FILE = "_dirty_state.json"   # Work tree fingerprints and dirty flags, see Manifest.check_dirty.
+DAEMON_SOCKET_FILE = "_daemon.sock"   # Unix domain socket of a running grit daemon.
+DAEMON_ENV_VARIABLE = "GRIT_DAEMON"   # If set (non-empty), commands are executed by a running grit daemon.
+JOURNAL_FILE = "_journal.jsonl"   # State of each job of the last run, one JSON record per line (see --resume).
+DEFAULT_RETRY_DELAY = 1.0   # Default --retry-delay (seconds); doubled for each retry.
+TIMEOUT_EXIT_CODE = 124   # Exit code of a command killed due to --timeout (same as the timeout program).
+# Seconds from terminating (SIGTERM) the running commands until they are killed, on SIGINT/SIGTERM.
+KILL_GRACE_TIME = 0.5
+STRAGGLER_FACTOR = 3.0   # Default --straggler-factor.
+STRAGGLER_MIN_EXCESS = 10.0   # Min seconds a job must exceed its estimated duration to be reported as straggler.
+MIRROR_PARTIAL_SUFFIX = ".partial"   # Added to the path of a mirror while it is cloned (see Manifest.do_cache).
+OUTPUT_TAIL_SIZE = 4096   # Bytes at the end of the output kept to detect transient errors (see Command).
+# Output (in lower case) of git indicating a transient network error, i.e. the command may succeed if retried.
+TRANSIENT_ERRORS = ["could not resolve host", "temporary failure in name resolution", "timed out",
+                    "connection reset", "connection refused", "connection closed", "failed to connect",
+                    "remote end hung up unexpectedly", "early eof", "rpc failed", "unexpected disconnect",
+                    "the requested url returned error: 50"]
+# Git commands accessing the remote host, which are limited by the jobs-per-host setting.
+REMOTE_GIT_COMMANDS = ["clone", "fetch", "pull", "push"]
+# Arguments of git status (with --changed-only) selecting an output format that the dirty check can produce too, so
+# that the check is also the status of a changed repo (see Manifest.check_dirty). At least one of the first five.
+CHECK_DIRTY_STATUS_ARGS = ["-s", "--short", "--porcelain", "--porcelain=v1", "-z", "-b", "--branch"]
+# Git commands that neither change the repo nor access a remote host; not recorded in the journal (see --resume).
+READ_ONLY_GIT_COMMANDS = ["status", "diff", "log", "show", "shortlog", "describe", "blame", "grep", "ls-files",
+                          "ls-tree", "rev-parse", "show-ref", "cat-file"]
 
 
 def json_manifest_object_hook(dct):
@@ -40,6 +166,30 @@ def json_manifest_encoder(obj):
     return obj.todict()
 
 
+def restore_settings(cls, settings: dict, *init_args):
+    """ Restores a pickled Settings instance, see Settings.__reduce__. """
+    obj = cls(*init_args)
+    obj.settings = settings
+    return obj
+
+
+def load_manifest_cache(file_stream):
+    """ Unpickle the precompiled active manifest. The grit classes are always taken from this module, regardless
+    of the module name when pickled ("__main__" when grit is executed as a script, else "grit"). Nothing else can be
+    loaded.
+    """
+    import pickle
+    allowed_names = ["Profile", "Repository", "restore_settings"]
+
+    class ManifestCacheUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            if name not in allowed_names:
+                raise pickle.UnpicklingError("Unexpected " + module + "." + name)
+            return globals()[name]
+
+    return ManifestCacheUnpickler(file_stream).load()
+
+
 class JSONDecodeError(Exception):
     """ JSON Decode exception. """
     pass
@@ -53,6 +203,26 @@ class Settings(object):
     def __init__(self, valid_keys: list):
         self.valid_keys = valid_keys
         self.settings = {}
+        self.change_handler = None   # Called (without arguments) whenever a setting is changed.
+
+    def set_change_handler(self, change_handler):
+        """ Set the handler to call whenever a setting is changed, e.g. to invalidate cached data in the owner. """
+        self.change_handler = change_handler
+
+    def notify_change(self):
+        """ Notify the change handler (if any) that one or more settings have changed. """
+        if self.change_handler is not None:
+            self.change_handler()
+
+    def __reduce__(self):
+        """ Pickle support. Kept compact, since the precompiled active manifest contains many instances.
+        The change handler belongs to the owner, so it is not pickled.
+        """
+        return restore_settings, (type(self), self.settings) + self.get_init_args()
+
+    def get_init_args(self):
+        """ Returns a tuple of the arguments to the constructor (excluding valid_keys). Used when pickling. """
+        return ()
 
     def get_settings(self):
         """ Get all settings, as a dict. NOTE: Do not modify returned dict! """
@@ -71,6 +241,7 @@ class Settings(object):
                 logger.debug("Found extension key " + key + ", ignoring silently.")
             else:
                 raise ValueError("Invalid settings key " + key + "!")
+        self.notify_change()
 
     def get_optional_setting(self, key: str, default=None):
         """ Get an optional setting. If setting key is missing, the default value is returned. """
@@ -85,10 +256,12 @@ class Settings(object):
 
     def set_setting(self, key: str, value):
         self.settings[key] = value
+        self.notify_change()
 
     def remove_setting(self, key):
         if key in self.settings:
             del self.settings[key]
+            self.notify_change()
 
     def overlay(self, overlay_settings):
         """ Overlays the provided Settings object on top of existing one.
@@ -96,17 +269,22 @@ class Settings(object):
         To remove a setting, set its value to None (maps to "null" in JSON format).
         """
         self.settings.update(overlay_settings.get_settings())
+        self.notify_change()
 
 
 class Profile(Settings):
     """ Stores all settings related to a profile. """
     valid_keys = ["inherit", "remote-name", "remote-url", "remote-push-url",
-                  "branch", "remote-branch", "single-branch", "depth"]
+                  "branch", "remote-branch", "single-branch", "depth", "filter", "sparse-paths", "jobs-per-host",
+                  "timeout"]
 
     def __init__(self, profile_name: str):
         super().__init__(Profile.valid_keys)
         self.profile_name = profile_name
 
+    def get_init_args(self):
+        return self.profile_name,
+
     def get_profile_name(self):
         return self.profile_name
 
@@ -134,6 +312,9 @@ class Repository(Settings):
         super().__init__(Repository.valid_keys)
         self.repo = repo
 
+    def get_init_args(self):
+        return self.repo,
+
     def get_repo(self):
         return self.repo
 
@@ -160,32 +341,548 @@ class Repository(Settings):
         return dct
 
 
+def decode_output(output: bytes):
+    """ Decode command output to a string, the same way as universal newlines mode of subprocess does. """
+    import locale
+    output = output.decode(locale.getpreferredencoding(False), errors="replace")
+    return output.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def parse_size(size: str):
+    """ Parse a size in bytes, optionally with a k, M or G suffix (powers of 1024). Used as argparse type. """
+    multipliers = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    multiplier = multipliers.get(size[-1:].lower(), 1)
+    if multiplier > 1:
+        size = size[:-1]
+    try:
+        return int(size) * multiplier
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError("invalid size " + size)
+
+
+def parse_jobs(jobs: str):
+    """ Parse a number of parallel jobs, or "auto". Used as argparse type. """
+    if jobs == "auto":
+        return jobs
+    try:
+        return int(jobs)
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError("invalid number of jobs " + jobs + " (expected a number or auto)")
+
+
+def parse_groups(groups: str):
+    """ Check that a group expression (see GroupExpression) is valid. Used as argparse type. """
+    try:
+        GroupExpression(groups)
+    except ValueError as err:
+        import argparse
+        raise argparse.ArgumentTypeError(str(err))
+    return groups
+
+
+def parse_percent(percent: str):
+    """ Parse a percentage, optionally with a % suffix. Used as argparse type. """
+    try:
+        return float(percent[:-1] if percent.endswith("%") else percent)
+    except ValueError:
+        import argparse
+        raise argparse.ArgumentTypeError("invalid percentage " + percent)
+
+
+def get_memory_use():
+    """ Returns the memory in use (not available for new processes), in percent of the total memory.
+    Returns None if unknown (only supported on Linux).
+    """
+    memory_info = {}
+    try:
+        with open("/proc/meminfo", "r") as file_stream:
+            for line in file_stream:
+                key, _, value = line.partition(":")
+                memory_info[key] = int(value.split()[0])
+        return 100.0 * (1.0 - memory_info["MemAvailable"] / memory_info["MemTotal"])
+    except (OSError, KeyError, ValueError, IndexError, ZeroDivisionError):
+        return None
+
+
+def get_git_dir(work_tree: str):
+    """ Returns the path to the git directory of a work tree, or None if not found.
+    Handles both a regular ".git" directory and a ".git" file (gitfile) as used by worktrees and submodules.
+    """
+    git_path = os.path.join(work_tree, ".git")
+    if os.path.isdir(git_path):
+        return git_path
+    try:
+        with open(git_path, "r") as file_stream:
+            content = file_stream.read().strip()
+    except OSError:
+        return None
+    if not content.startswith("gitdir:"):
+        return None
+    # The path is relative the work tree, unless absolute.
+    return os.path.normpath(os.path.join(work_tree, content[len("gitdir:"):].strip()))
+
+
+def is_object_name(value: str):
+    """ Returns True if the value is a full object name (SHA-1 or SHA-256, in hex). """
+    return len(value) in (40, 64) and all(char in "0123456789abcdef" for char in value)
+
+
+def read_git_ref(git_dir: str, ref_name: str):
+    """ Resolves a ref (e.g. "HEAD" or "refs/heads/master") to an object name, by reading the files in the git
+    directory directly: loose refs (following symbolic refs) and packed-refs. For worktrees, shared refs are read
+    from the common git directory. Returns None if the ref cannot be resolved this way (e.g. unborn branch or
+    unknown ref storage format).
+    """
+    common_dir = git_dir
+    try:
+        with open(os.path.join(git_dir, "commondir"), "r") as file_stream:
+            common_dir = os.path.normpath(os.path.join(git_dir, file_stream.read().strip()))
+    except OSError:
+        pass   # Not a worktree.
+    for _ in range(5):   # Max depth of symbolic refs, same as git.
+        if ref_name == "HEAD" or not ref_name.startswith("refs/") or ref_name.startswith(("refs/worktree/",
+                                                                                            "refs/bisect/",
+                                                                                            "refs/rewritten/")):
+            ref_dir = git_dir      # Per-worktree ref.
+        else:
+            ref_dir = common_dir   # Shared ref.
+        try:
+            with open(os.path.join(ref_dir, *ref_name.split("/")), "r") as file_stream:
+                content = file_stream.read().strip()
+        except OSError:
+            # Not a loose ref (or not a file at all); look in packed-refs instead.
+            return read_packed_git_ref(common_dir, ref_name)
+        if content.startswith("ref:"):
+            ref_name = content[len("ref:"):].strip()   # Symbolic ref; follow it.
+        else:
+            return content if is_object_name(content) else None
+    return None
+
+
+def read_packed_git_ref(common_dir: str, ref_name: str):
+    """ Resolves a ref by looking it up in the packed-refs file. Returns None if not found. """
+    try:
+        with open(os.path.join(common_dir, "packed-refs"), "r") as file_stream:
+            for line in file_stream:
+                # Skip the header ("#") and peeled tag ("^") lines.
+                if not line.startswith(("#", "^")):
+                    parts = line.split()
+                    if len(parts) == 2 and parts[1] == ref_name:
+                        return parts[0] if is_object_name(parts[0]) else None
+    except OSError:
+        pass
+    return None
+
+
+def read_head_commit(work_tree: str):
+    """ Returns the object name (SHA-1) of HEAD of the work tree, without starting any git process.
+    Returns None if it cannot be resolved this way; use "git rev-parse HEAD" instead.
+    """
+    git_dir = get_git_dir(work_tree)
+    if git_dir is None:
+        return None
+    return read_git_ref(git_dir, "HEAD")
+
+
+def read_head_branch(work_tree: str):
+    """ Returns the name of the branch checked out in the work tree (without "refs/heads/"), without starting any
+    git process. Returns None if HEAD is detached (e.g. a tag or commit is checked out) or cannot be read.
+    """
+    git_dir = get_git_dir(work_tree)
+    if git_dir is None:
+        return None
+    try:
+        with open(os.path.join(git_dir, "HEAD"), "r") as file_stream:
+            content = file_stream.read().strip()
+    except OSError:
+        return None
+    if content.startswith("ref: refs/heads/"):
+        return content[len("ref: refs/heads/"):]
+    return None
+
+
+def get_worktree_fingerprint(work_tree: str, ignored_directories: list=()):
+    """ Returns a fingerprint of the state of a work tree, without starting any git process: HEAD, the modification
+    time and size of the index and of .git/info/exclude and the number, total size and total modification time of
+    all files and directories (except .git, nested repositories and the ignored directories). If the fingerprint is
+    unchanged, so is the result of git status (unless a file was changed without changing its modification time or
+    size, which git status wouldn't detect either).
+    The ignored directories (paths relative to the work tree, as listed by git status) must match an ignore pattern
+    (so anything in them is ignored, except tracked files, which change the index when added). Changing a pattern
+    changes a .gitignore file or .git/info/exclude, except for the global excludes file (core.excludesFile).
+    The fingerprint is a list (to be comparable with one loaded from JSON). Returns None if not a git work tree.
+    """
+    git_dir = get_git_dir(work_tree)
+    if git_dir is None:
+        return None
+    file_states = []
+    for file_path in (os.path.join(git_dir, "index"), os.path.join(git_dir, "info", "exclude")):
+        try:
+            file_stat = os.stat(file_path)
+            file_states.append([file_stat.st_mtime_ns, file_stat.st_size])
+        except OSError:
+            file_states.append(None)   # E.g. no index yet.
+    skipped_paths = set(os.path.join(work_tree, *path.rstrip("/").split("/")) for path in ignored_directories)
+    count = 0
+    total_size = 0
+    total_mtime = 0
+    directories = [work_tree]
+    while len(directories) > 0:
+        directory = directories.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue   # E.g. removed while walking. Any change is still detected by its parent directory.
+        with entries:
+            for entry in entries:
+                if entry.name == ".git":
+                    continue
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path in skipped_paths:
+                            continue   # Not even its modification time, which changes e.g. on every build.
+                        if os.path.lexists(os.path.join(entry.path, ".git")):
+                            continue   # A nested repository has its own status.
+                        directories.append(entry.path)
+                except OSError:
+                    continue
+                count += 1
+                total_size += stat.st_size
+                total_mtime += stat.st_mtime_ns
+    return [read_git_ref(git_dir, "HEAD")] + file_states + [count, total_size, total_mtime]
+
+
+def get_url_host(url: str):
+    """ Returns the host name of a git remote URL, in lower case. Both URLs ("ssh://user@host:port/path") and
+    scp-like syntax ("user@host:path") are supported. Local paths (incl. file:// URLs) return an empty string.
+    """
+    import re
+    import urllib.parse
+    if "://" in url:
+        return urllib.parse.urlsplit(url).hostname or ""
+    match = re.match(r"(?:[^@/]+@)?([^:/]+):", url)
+    if match is not None:
+        return match.group(1).lower()
+    return ""
+
+
+def get_mirror_path(cache_directory: str, remote_url: str, repo_name: str):
+    """ Returns the path of the bare mirror of a remote repository in a mirror cache directory.
+    The path is based on the remote host and path (e.g. "<cache_directory>/github.com/org/repo.git"), so the
+    same cache can be shared by different projects and remotes.
+    """
+    import re
+    import urllib.parse
+    if "://" in remote_url:
+        split_url = urllib.parse.urlsplit(remote_url)
+        url_path = (split_url.hostname or "") + "/" + split_url.path
+    else:
+        match = re.match(r"(?:[^@/]+@)?([^:/]+):(.*)", remote_url)   # scp-like syntax.
+        url_path = match.group(1).lower() + "/" + match.group(2) if match is not None else remote_url
+    path_parts = [part for part in (url_path + "/" + repo_name + ".git").split("/") if part not in ("", ".", "..")]
+    return os.path.join(cache_directory, *path_parts)
+
+
+class CommandOutput(object):
+    """ Stores the (combined stdout and stderr) output of a command.
+    The output is kept in memory up to memory_limit bytes. If the output grows above that, all of it is moved
+    to an anonymous temporary file in spill_directory (None means the default temporary directory), so the
+    memory usage is bounded regardless of the amount of output. The output is read back as text, in chunks.
+    """
+
+    def __init__(self, memory_limit: int=OUTPUT_MEMORY_LIMIT, spill_directory: str=None):
+        self.memory_limit = memory_limit
+        self.spill_directory = spill_directory
+        self.buffer = bytearray()
+        self.spill_file = None
+        self.size = 0   # Total number of bytes written.
+
+    def write(self, data: bytes):
+        """ Append output data. """
+        self.size += len(data)
+        if self.spill_file is None and len(self.buffer) + len(data) > self.memory_limit:
+            logger.debug("Spilling command output to a temporary file.")
+            import tempfile
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_directory, prefix="_output_")
+            self.spill_file.write(self.buffer)
+            self.buffer = bytearray()
+        if self.spill_file is None:
+            self.buffer += data
+        else:
+            self.spill_file.write(data)
+
+    def read_chunks(self):
+        """ Generator returning the output as text chunks, decoded the same way as universal newlines mode of
+        subprocess does.
+        """
+        if self.spill_file is None:
+            stream = io.BytesIO(self.buffer)
+        else:
+            self.spill_file.seek(0)
+            stream = self.spill_file
+        import locale
+        text_stream = io.TextIOWrapper(stream, encoding=locale.getpreferredencoding(False), errors="replace",
+                                       newline=None)
+        try:
+            chunk = text_stream.read(OUTPUT_CHUNK_SIZE)
+            while chunk != "":
+                yield chunk
+                chunk = text_stream.read(OUTPUT_CHUNK_SIZE)
+        finally:
+            text_stream.detach()   # Don't let the text stream close the spill file.
+            if self.spill_file is not None:
+                self.spill_file.seek(0, io.SEEK_END)   # Further writes are appended.
+
+    def write_to(self, text_stream):
+        """ Write the output to a text stream (e.g. sys.stdout or a log file), chunk by chunk. """
+        for chunk in self.read_chunks():
+            text_stream.write(chunk)
+
+    def getvalue(self):
+        """ Returns all output as a single string. Only to be used when the output is known to be small. """
+        return "".join(self.read_chunks())
+
+    def close(self):
+        """ Release the stored output. """
+        self.buffer = bytearray()
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+
 class Command(object):
     """ Class to hold a command request and result data.
     No getters/setters or properties, fields are accessed directly.
+    The command is executed directly (no shell), so command_args are passed as is to the program, i.e. no quoting
+    is needed. Use ["bash", "-c", ...] to execute a shell command line.
     """
 
-    def __init__(self, command_line: str, init_display_line: str=None, done_display_line: str=None,
-                 print_errors=True, verbose=0, result_handler=None, client_data=None):
+    def __init__(self, command_args: list, init_display_line: str=None, done_display_line: str=None,
+                 print_errors=True, verbose=0, result_handler=None, client_data=None, cwd: str=None, env: dict=None):
         self.init_display_line = init_display_line  # Display line before starting command.
         self.done_display_line = done_display_line  # Display line after command completed.
-        self.command_line = command_line   # The shell command line to execute.
+        self.command_args = command_args   # The program and its arguments to execute.
+        self.cwd = cwd   # The working directory of the command. None means current working directory.
+        self.env = env   # Additional environment variables for the command (dict), if any.
+        # The equivalent shell command line; used for printing and logging only.
+        import shlex
+        self.command_line = shlex.join(command_args)
+        if cwd is not None:
+            self.command_line = "cd " + shlex.quote(cwd) + " && " + self.command_line
         self.print_errors = print_errors   # Print output if command exited with error.
         self.verbose = verbose   # The verbose level.
         self.result_code = -1    # The status code returned by the command. -1 means command not executed.
-        self.result_output = None   # The combined output of stdout and stderr by the command (in string)
+        self.result_output = None   # The combined output of stdout and stderr by the command (CommandOutput).
         self.result_handler = result_handler   # The result handler method to be called on the client side.
         self.client_data = client_data   # Arbitrary data set by the client.
+        # If set, each output line is passed to the output handler (together with the command) as soon as it is
+        # available, instead of being stored in result_output. Only supported by execute_async.
+        self.output_handler = None
+        self.output_prefix = None   # Arbitrary prefix (e.g. local path) for the output handler to use.
+        self.start_time = None   # Time (time.time()) when the command was started.
+        self.end_time = None     # Time (time.time()) when the command was completed.
+        self.output_size = 0     # Number of bytes of output (also if streamed).
+        self.output_tail = b""   # The last (up to OUTPUT_TAIL_SIZE) bytes of output, see is_transient_failure.
+        self.attempts = 0        # Number of times the command has been executed (more than one if retried).
+        # If set, the command (incl. all processes started by it) is killed if not completed within this many seconds.
+        self.timeout = None
+        self.timed_out = False   # Set if the command was killed due to the timeout.
+        self.process = None   # The process, while running.
+        self.new_session = False   # Set if the process runs in a new session (process group) of its own.
+
+    def get_env(self):
+        """ Returns the complete environment for the command, or None to inherit the environment as is. """
+        if self.env is None:
+            return None
+        env = dict(os.environ)
+        env.update(self.env)
+        return env
 
-    def execute(self):
-        """ Execute the command and store the result. """
+    def report_start_error(self, err: OSError, result_output: CommandOutput):
+        """ Report that the command could not be started at all, e.g. due to a missing program or working
+        directory. Reported as exit code 127, same as a shell does for a missing program.
+        """
+        output = str(err) + "\n"
+        self.output_size = len(output)
+        if self.output_handler is not None:
+            self.output_handler(self, output)
+            result_output = None
+        else:
+            result_output.write(output.encode())
+        self.report_result(127, result_output)
+
+    def execute(self, output_memory_limit: int=OUTPUT_MEMORY_LIMIT, spill_directory: str=None):
+        """ Execute the command and store the result. Blocks until the command is completed.
+        This is the synchronous counterpart of execute_async, used when only one job is executed at a time
+        (which avoids the cost of importing and setting up asyncio).
+        """
+        import subprocess
+        self.report_start()
+        # When attached to a terminal, the process is kept in the session of grit, so it can prompt for e.g.
+        # credentials, and Ctrl-C is sent to it by the terminal.
+        self.new_session = self.timeout is not None or sys.stdin is None or not sys.stdin.isatty()
+        try:
+            process = subprocess.Popen(self.command_args, cwd=self.cwd, env=self.get_env(), stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, start_new_session=self.new_session)
+        except OSError as err:
+            self.report_start_error(err, CommandOutput())
+            return
+        self.process = process
+        timer = None
+        if self.timeout is not None:
+            import threading
+            timer = threading.Timer(self.timeout, self.kill_on_timeout)
+            timer.start()
+        try:
+            result_output = self.read_output(process, output_memory_limit, spill_directory)
+        finally:
+            self.process = None
+            if timer is not None:
+                timer.cancel()
+        self.report_result(process.returncode, result_output)
+
+    def read_output(self, process: "subprocess.Popen", output_memory_limit: int, spill_directory: str):
+        """ Read the output of the process until it has exited (see execute). Returns the result output. """
+        with process:
+            if self.output_handler is None:
+                result_output = CommandOutput(output_memory_limit, spill_directory)
+                data = process.stdout.read1(OUTPUT_CHUNK_SIZE)
+                while data != b"":
+                    self.store_output_data(result_output, data)
+                    data = process.stdout.read1(OUTPUT_CHUNK_SIZE)
+            else:
+                result_output = None
+                pending = b""
+                data = process.stdout.read1(OUTPUT_CHUNK_SIZE)
+                while data != b"":
+                    pending = self.handle_output_data(pending, data)
+                    data = process.stdout.read1(OUTPUT_CHUNK_SIZE)
+                self.handle_output_end(pending)
+        return result_output
+
+    async def execute_async(self, output_memory_limit: int=OUTPUT_MEMORY_LIMIT, spill_directory: str=None):
+        """ Execute the command in the running asyncio event loop and store the result.
+        See CommandOutput regarding output_memory_limit and spill_directory.
+        """
+        self.report_start()
+        # Always a process group of its own, so all processes started by the command can be signalled (a terminal
+        # is of little use when executing commands in parallel anyway).
+        self.new_session = True
+        try:
+            import asyncio
+            process = await asyncio.create_subprocess_exec(*self.command_args, cwd=self.cwd, env=self.get_env(),
+                                                           stdout=asyncio.subprocess.PIPE,
+                                                           stderr=asyncio.subprocess.STDOUT,
+                                                           start_new_session=self.new_session)
+        except OSError as err:
+            self.report_start_error(err, CommandOutput())
+            return
+        self.process = process
+        timer = None
+        if self.timeout is not None:
+            timer = asyncio.get_running_loop().call_later(self.timeout, self.kill_on_timeout)
+        try:
+            result_output = await self.read_output_async(process, output_memory_limit, spill_directory)
+        finally:
+            self.process = None
+            if timer is not None:
+                timer.cancel()
+        self.report_result(process.returncode, result_output)
+
+    async def read_output_async(self, process: "asyncio.subprocess.Process", output_memory_limit: int,
+                                spill_directory: str):
+        """ Read the output of the process until it has exited (see execute_async). Returns the result output. """
+        if self.output_handler is None:
+            result_output = CommandOutput(output_memory_limit, spill_directory)
+            data = await process.stdout.read(OUTPUT_CHUNK_SIZE)
+            while data != b"":
+                self.store_output_data(result_output, data)
+                data = await process.stdout.read(OUTPUT_CHUNK_SIZE)
+        else:
+            result_output = None
+            await self.stream_output(process.stdout)
+        await process.wait()
+        return result_output
+
+    async def stream_output(self, stream: "asyncio.StreamReader"):
+        """ Read the output incrementally and pass each line to the output handler as soon as it is available. """
+        pending = b""   # Incomplete last line.
+        data = await stream.read(OUTPUT_CHUNK_SIZE)
+        while data != b"":
+            pending = self.handle_output_data(pending, data)
+            data = await stream.read(OUTPUT_CHUNK_SIZE)
+        self.handle_output_end(pending)
+
+    def store_output_data(self, result_output: CommandOutput, data: bytes):
+        """ Store output data in the result output. """
+        result_output.write(data)
+        self.output_size += len(data)
+        self.output_tail = (self.output_tail + data)[-OUTPUT_TAIL_SIZE:]
+
+    def handle_output_data(self, pending: bytes, data: bytes):
+        """ Pass the complete lines of pending + data to the output handler. Returns the new pending data. """
+        self.output_size += len(data)
+        self.output_tail = (self.output_tail + data)[-OUTPUT_TAIL_SIZE:]
+        lines = (pending + data).splitlines(keepends=True)
+        # Keep an incomplete line until more data is available. This includes a line ending with CR,
+        # which may be the first part of a CR+LF line ending. Very long lines are passed on in parts.
+        if not lines[-1].endswith(b"\n") and len(lines[-1]) < OUTPUT_CHUNK_SIZE:
+            pending = lines.pop()
+        else:
+            pending = b""
+        for line in lines:
+            self.output_handler(self, decode_output(line))
+        return pending
+
+    def handle_output_end(self, pending: bytes):
+        """ Pass the remaining pending data (if any) to the output handler, at end of output. """
+        if pending != b"":
+            line = decode_output(pending)
+            self.output_handler(self, line if line.endswith("\n") else line + "\n")
+
+    def send_signal(self, signal_number: int):
+        """ Send the signal to the process of the command, if running. If the process runs in a new session, the
+        signal is sent to its process group, i.e. to all processes started by it as well (e.g. a remote helper or ssh
+        started by git). Otherwise, they may keep the output pipe open, i.e. the command would still not complete.
+        """
+        process = self.process
+        if process is None:
+            return
+        try:
+            if self.new_session:
+                os.killpg(process.pid, signal_number)
+            else:
+                os.kill(process.pid, signal_number)
+        except ProcessLookupError:
+            pass   # Already exited.
+
+    def kill_on_timeout(self):
+        """ Kill the process of the command due to the timeout. Always a new session (see execute). """
+        import signal
+        logger.debug("Killing " + self.command_line + " due to timeout.")
+        self.timed_out = True
+        self.send_signal(signal.SIGKILL)
+
+    def report_start(self):
+        """ Report that the command is started. """
+        self.start_time = time.time()
+        self.attempts += 1
+        timing.mark("first command started", once=True)
         if self.init_display_line is not None:
             print(self.init_display_line)
-        # NOTE: universal_newlines makes output to be a string instead of bytes.
         logger.debug("Started to run " + self.command_line)
-        result = subprocess.run(self.command_line, shell=True, stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT, universal_newlines=True)
-        if result.returncode == 0:
+
+    def report_result(self, result_code: int, result_output: CommandOutput):
+        """ Report and store the result of the executed command. """
+        self.end_time = time.time()
+        if self.timed_out:
+            # Always reported, since the output (if any) rarely tells why.
+            result_code = TIMEOUT_EXIT_CODE
+            print("Timed out after " + str(self.timeout) + " s: " + self.command_line)
+        if result_code == 0:
             # Successfully executed command.
             logger.debug("Successful execution of " + self.command_line)
             if self.done_display_line is not None:
@@ -194,51 +891,663 @@ class Command(object):
             # If an error occurred, always print the details.
             logger.debug("Failed to execute " + self.command_line)
             if self.print_errors:
-                output = "-" * 80 + "\n" + self.command_line + "\n"
-                if result.stdout is not None:
-                    output += result.stdout
-                print(output, end="")    # Since multiple threads are printing, print all in single call.
-        self.result_code = result.returncode
-        self.result_output = result.stdout
+                print("-" * 80 + "\n" + self.command_line)
+                if result_output is not None:
+                    result_output.write_to(sys.stdout)
+        self.result_code = result_code
+        self.result_output = result_output
+
+    def is_transient_failure(self):
+        """ Returns True if the command failed due to a transient (network) error, based on the end of its output
+        (see TRANSIENT_ERRORS), i.e. the command may succeed if retried.
+        """
+        if self.result_code == 0:
+            return False
+        if self.timed_out:
+            return True   # E.g. a hung connection.
+        output_tail = decode_output(self.output_tail).lower()
+        return any(transient_error in output_tail for transient_error in TRANSIENT_ERRORS)
+
+    def prepare_retry(self, retry_delay: float):
+        """ Prepare to execute the failed command again, after a delay which is doubled for each retry.
+        Returns the delay (seconds).
+        """
+        delay = retry_delay * 2 ** (self.attempts - 1)
+        print("Retrying " + self.command_line + " in " + str(delay) + " s (attempt " + str(self.attempts + 1)
+              + ").")
+        self.release_output()
+        self.result_output = None
+        self.output_size = 0
+        self.output_tail = b""
+        self.timed_out = False
+        return delay
+
+    def get_name(self):
+        """ Returns a short name of the command, e.g. "git fetch" or "bash". """
+        name = os.path.basename(self.command_args[0])
+        if name == "git":
+            # Add the git command (the first non-option argument, e.g. after "-C <path>").
+            args = iter(self.command_args[1:])
+            for arg in args:
+                if arg in ("-C", "-c"):
+                    next(args, None)
+                elif not arg.startswith("-"):
+                    return name + " " + arg
+        return name
 
+    def todict(self):
+        """ Returns a dict with the command details (used for structured logging). """
+        return {"command": self.get_name(),
+                "command-line": self.command_line,
+                "start": round(self.start_time, 3) if self.start_time is not None else None,
+                "end": round(self.end_time, 3) if self.end_time is not None else None,
+                "duration": round(self.end_time - self.start_time, 3) if self.end_time is not None else None,
+                "exit-code": self.result_code,
+                "output-bytes": self.output_size,
+                "attempts": self.attempts,
+                "timed-out": self.timed_out}
+
+    def release_output(self):
+        """ Release the stored output. Called when the result has been handled. """
+        if self.result_output is not None:
+            self.result_output.close()
+
+
+def use_pidfd_child_watcher():
+    """ Make asyncio wait for child processes using pid file descriptors (Linux 5.3+), if available.
+    Must be called from within the running event loop. Before Python 3.12, the default child watcher
+    uses one thread per child process; since 3.12, pid file descriptors are used by default (if available).
+    """
+    import asyncio
+    if sys.version_info >= (3, 12) or not hasattr(asyncio, "PidfdChildWatcher"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        logger.debug("Pid file descriptors not supported; using default child watcher.")
+        return
+    child_watcher = asyncio.PidfdChildWatcher()
+    child_watcher.attach_loop(asyncio.get_running_loop())
+    asyncio.set_child_watcher(child_watcher)
+
+
+class Job(object):
+    """ A sequence (list) of commands, which are executed in order (for dependency reasons).
+    If the job accesses a remote host, and the number of concurrent jobs per host is limited, host and
+    max_jobs_per_host are set.
+    No getters/setters or properties, fields are accessed directly.
+    """
 
-class CommandExecutor(threading.Thread):
-    """ Executes shell jobs in a separate thread.
-    Each job consists of a sequence (list) of commands, which are executed in order (for dependency reasons).
-    Each command contains all data related to it, such as the shell command line, but also the output
-    printed on stdout and stderr. The result is processed by the caller, not by the executor.
-    If an error occurs when executing a command, the job is aborted, i.e. no further commands inside the job
-    are executed. However, this will not stop other jobs from being executed. This is up to the caller to handle.
+    def __init__(self, host: str=None, max_jobs_per_host: int=None):
+        self.commands = []   # Command instances.
+        self.host = host
+        self.max_jobs_per_host = max_jobs_per_host
+        self.name = None        # The name of the job (typically the repo name), if any.
+        self.stats_key = None   # If set, the duration is recorded under this key (typically the command name).
+        self.queued_time = None  # Time (time.time()) when the job was queued.
+        self.start_time = None  # Time (time.time()) when the job was started; None if never started.
+        self.end_time = None    # Time (time.time()) when the job was completed.
+        self.slot = None        # The job slot (0..max_jobs-1) of the command engine that executed the job.
+        self.handler_start_time = None   # Time (time.time()) when the job result handler was called, if called.
+        self.handler_end_time = None     # Time (time.time()) when the job result handler returned.
+        self.estimated_duration = None   # Expected duration (seconds) based on previous runs, if known.
+        self.timeout = None   # Timeout (seconds) of each command (see Command.timeout), if any.
+        self.straggler_time = None   # Duration (seconds) after which the job is reported as a straggler, if any.
+        # Path created by the first command of the job (e.g. a clone), which is removed if interrupted or timed
+        # out, and before the command is retried (see remove_partial_path).
+        self.partial_path = None
+        self.interrupted = False   # Set if the job was running when the execution was cancelled (see CommandEngine).
+        self.retries = 0   # Max number of times a command failing with a transient error is retried.
+        self.retry_delay = DEFAULT_RETRY_DELAY   # Delay (seconds) before the first retry; doubled for each retry.
+        # If set, called with the job when it is started, before its commands are executed (in a worker thread when
+        # executing jobs in parallel, so slow preparations run in parallel too). It may change the commands.
+        self.prepare = None
+
+    def is_successful(self):
+        """ Returns True if the job was executed and all its commands were successful. """
+        return self.start_time is not None and all(command.result_code == 0 for command in self.commands)
+
+    def is_timed_out(self):
+        """ Returns True if a command of the job was killed due to its timeout. """
+        return any(command.timed_out for command in self.commands)
+
+    def remove_partial_path(self, reason: str):
+        """ Remove the partial path (if any and not completed), e.g. a clone killed before it could clean up. """
+        import shutil
+        if self.partial_path is not None and not self.is_successful() and os.path.lexists(self.partial_path):
+            print("Removing " + self.partial_path + " (" + reason + ").")
+            shutil.rmtree(self.partial_path, ignore_errors=True)
+
+    def prepare_retry(self, command):
+        """ Prepare to execute the failed command of the job again, see Command.prepare_retry. Returns the delay
+        (seconds). If the command creates the partial path, what it left is removed, so it can be created again.
+        """
+        if command is self.commands[0]:
+            self.remove_partial_path("retrying")
+        return command.prepare_retry(self.retry_delay)
+
+    def report_straggler(self):
+        """ Warn that the job takes much longer than its estimated duration. Called after straggler_time. """
+        print("Warning: " + str(self.name) + " is still running after " + str(round(time.time() - self.start_time))
+              + " s (estimated: " + str(round(self.estimated_duration, 1)) + " s).")
+
+
+class JobLimiter(object):
+    """ Limits the number of concurrently executed jobs, like asyncio.Semaphore (incl. starting waiting jobs in
+    order), except that the limit can be changed at any time, see set_limit.
     """
 
-    def __init__(self, request_queue: queue.Queue, result_queue: queue.Queue):
-        super().__init__()
-        self.request_queue = request_queue   # Each item is a list of Command instances (=a job).
-        self.result_queue = result_queue     # Once processed, the command item is moved to the result queue.
-        self.stop_signal = threading.Event()
+    def __init__(self, limit: int):
+        import collections
+        self.limit = limit
+        self.running = 0
+        self.waiters = collections.deque()   # Futures of the waiting jobs, in order.
+
+    async def __aenter__(self):
+        if self.running < self.limit and len(self.waiters) == 0:
+            self.running += 1
+            return
+        import asyncio
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        await waiter   # Counted as running when woken up, see wake_up_waiters.
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.running -= 1
+        self.wake_up_waiters()
+
+    def set_limit(self, limit: int):
+        """ Change the limit. If lowered, running jobs are not affected, but no more are started until the number
+        of running jobs is below the new limit.
+        """
+        self.limit = limit
+        self.wake_up_waiters()
+
+    def wake_up_waiters(self):
+        while self.running < self.limit and len(self.waiters) > 0:
+            self.running += 1
+            self.waiters.popleft().set_result(None)
+
+
+class JobLimitController(object):
+    """ Adjusts the number of parallel jobs at runtime (--dynamic-jobs), between 1 and max_limit:
+    The limit is lowered if the load average is above max_load, if the memory use (percent) is above
+    max_memory_use, or if the jobs take much longer than recorded (see JOB_SLOWDOWN_LIMIT); typically because of
+    disk or network contention. Otherwise, the limit is raised while there are jobs waiting to be started.
+    At most one change is made per JOB_LIMIT_HOLD_TIME, since the effect of a change (in particular on the load
+    average) takes time to observe. Each change is passed to the change handler, with the reason.
+    """
 
-    def signal_stop(self):
-        """ Stop the thread. Note that this only sets a flag that is checked in the run loop, so it may take
-        a while until it is really stopped.
+    def __init__(self, limit: int, max_limit: int, max_load: float, max_memory_use: float, change_handler=None):
+        self.limit = max(min(limit, max_limit), 1)
+        self.max_limit = max_limit
+        self.max_load = max_load
+        self.max_memory_use = max_memory_use
+        self.change_handler = change_handler   # Called with the old limit, the new limit and the reason.
+        self.change_time = time.time()   # Time of the last change (or start).
+
+    def update(self, waiting_jobs: int, completed_jobs: list):
+        """ Check the system and update the limit if needed. waiting_jobs is the number of jobs waiting to be
+        started and completed_jobs the jobs completed since the last update. Returns the (new) limit.
         """
-        self.stop_signal.set()
+        now = time.time()
+        if now - self.change_time < JOB_LIMIT_HOLD_TIME:
+            return self.limit
+        try:
+            load = os.getloadavg()[0]
+        except OSError:
+            load = None
+        memory_use = get_memory_use()
+        slowdowns = [(job.end_time - job.start_time) / job.estimated_duration for job in completed_jobs
+                     if job.estimated_duration is not None and job.estimated_duration > 0 and job.is_successful()]
+        slowdown = None
+        if len(slowdowns) > 0:
+            import statistics
+            slowdown = statistics.median(slowdowns)
+        if load is not None and load > self.max_load:
+            self.change_limit(self.limit - 1, "load average {:.1f} > {:.1f}".format(load, self.max_load))
+        elif memory_use is not None and memory_use > self.max_memory_use:
+            self.change_limit(self.limit - 1, "memory use {:.0f}% > {:.0f}%".format(memory_use,
+                                                                                   self.max_memory_use))
+        elif slowdown is not None and slowdown > JOB_SLOWDOWN_LIMIT:
+            self.change_limit(self.limit - 1, "jobs take {:.1f} times longer than recorded".format(slowdown))
+        elif waiting_jobs > 0 and (load is None or load + 1.0 <= self.max_load):
+            self.change_limit(self.limit + 1, "{} jobs waiting, load average {}, memory use {}".format(
+                waiting_jobs, "unknown" if load is None else "{:.1f}".format(load),
+                "unknown" if memory_use is None else "{:.0f}%".format(memory_use)))
+        return self.limit
+
+    def change_limit(self, limit: int, reason: str):
+        limit = max(min(limit, self.max_limit), 1)
+        if limit == self.limit:
+            return
+        logger.debug("Changing the job limit from " + str(self.limit) + " to " + str(limit) + ": " + reason)
+        if self.change_handler is not None:
+            self.change_handler(self.limit, limit, reason)
+        self.limit = limit
+        self.change_time = time.time()
+
+
+class CommandEngine(object):
+    """ Executes jobs concurrently, using asyncio subprocesses in a single thread.
+    Each job consists of a sequence (list) of commands, which are executed in order (for dependency reasons).
+    Each command contains all data related to it, such as the command arguments, but also the output
+    printed on stdout and stderr. At most max_jobs jobs are executed at the same time, and at most
+    max_jobs_per_host jobs of the same remote host (if set for the job).
+    If an error occurs when executing a command, the job is aborted, i.e. no further commands inside the job
+    are executed. However, this will not stop other jobs from being executed. This is up to the caller to handle:
+    each completed job is passed to the job result handler as soon as it is completed. If the handler returns
+    False, no further jobs are started (already started jobs are completed, but not handled).
+    If a job limit controller is provided, max_jobs is adjusted by it at runtime (up to the provided max_jobs).
+    If a job completion handler is provided, each executed job is passed to it as well, also if stopped (e.g. to
+    record it in a journal).
+    A command failing with a transient error (see Command.is_transient_failure) is retried up to job.retries times.
+    A job still running after its straggler time (if set) is reported, see Job.report_straggler.
+    On SIGINT or SIGTERM, the execution is cancelled, see cancel. The signal number is then stored in cancelled.
+    """
+    event_loop = None   # If set, jobs are executed in this event loop (running in another thread), see GritDaemon.
+    cancel_lock = None   # Set by a grit daemon; guards current and cancel_requested (see cancel_current).
+    current = None   # The engine executing jobs, if any (only tracked in a grit daemon).
+    cancel_requested = None   # Signal number of the cancel requested by cancel_current, if any.
+
+    def __init__(self, max_jobs: int, job_result_handler, output_memory_limit: int=OUTPUT_MEMORY_LIMIT,
+                 spill_directory: str=None, job_limit_controller: JobLimitController=None,
+                 job_completion_handler=None):
+        self.max_jobs = max(max_jobs, 1)
+        self.job_result_handler = job_result_handler
+        self.job_completion_handler = job_completion_handler
+        self.output_memory_limit = output_memory_limit   # See CommandOutput.
+        self.spill_directory = spill_directory           # See CommandOutput.
+        self.job_limit_controller = job_limit_controller
+        self.stopped = False
+        self.free_slots = []   # Heap of free job slot numbers; the lowest one is used first.
+        self.completed_jobs = []   # Jobs completed since the last job limit update.
+        self.control_handle = None   # Timer of the next job limit update.
+        self.cancelled = None   # The signal number, if the execution was cancelled by a signal.
+        self.running_jobs = set()
+        self.loop = None   # The event loop, if executing jobs concurrently.
+        self.kill_timer = None   # Timer to kill the running commands, when cancelled.
+
+    def run(self, jobs: list):
+        """ Execute all jobs. Blocks until all (started) jobs are completed. """
+        logger.debug("Running " + str(len(jobs)) + " jobs, at most " + str(self.max_jobs) + " in parallel.")
+        concurrent = self.max_jobs > 1 and len(jobs) > 1
+        if CommandEngine.cancel_lock is not None:
+            with CommandEngine.cancel_lock:
+                if CommandEngine.cancel_requested is not None:
+                    # Cancelled before any job was started; no job is started.
+                    self.cancelled = CommandEngine.cancel_requested
+                    self.stopped = True
+                if concurrent:
+                    self.loop = CommandEngine.event_loop   # Used by cancel_current at once.
+                CommandEngine.current = self
+        try:
+            if not concurrent:
+                # Nothing to execute concurrently, so skip the (startup) cost of asyncio.
+                self.run_jobs_sequentially(jobs)
+                return
+            import asyncio
+            if CommandEngine.event_loop is not None:
+                asyncio.run_coroutine_threadsafe(self.run_jobs(jobs), CommandEngine.event_loop).result()
+            else:
+                asyncio.run(self.run_jobs(jobs))
+        finally:
+            if CommandEngine.cancel_lock is not None:
+                with CommandEngine.cancel_lock:
+                    CommandEngine.current = None
 
-    def run(self):
-        while not self.stop_signal.isSet():
+    @staticmethod
+    def cancel_current(signal_number: int):
+        """ Cancel the execution of the current engine (see cancel) from another thread, like the signal would when
+        received by grit. Used by a grit daemon when its client is interrupted. Any engine started after this (by
+        the same command) is cancelled as soon as it's started, until cancel_requested is reset.
+        """
+        with CommandEngine.cancel_lock:
+            CommandEngine.cancel_requested = signal_number
+            engine = CommandEngine.current
+            if engine is None:
+                return
+            if engine.loop is not None:
+                engine.loop.call_soon_threadsafe(engine.cancel, signal_number)
+            else:
+                engine.cancel(signal_number)   # Like the kill timer, it may be called from another thread.
+
+    def run_jobs_sequentially(self, jobs: list):
+        """ Execute the jobs one at a time in the calling thread, with the same semantics as run_jobs. """
+        import signal
+        import threading
+        self.free_slots = [0]
+        previous_handlers = {}
+        if threading.current_thread() is threading.main_thread():   # Else e.g. in a grit daemon.
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                previous_handlers[signal_number] = signal.signal(signal_number, self.handle_signal)
+        try:
+            self.run_jobs_in_order(jobs)
+        finally:
+            for signal_number, handler in previous_handlers.items():
+                signal.signal(signal_number, handler)
+            if self.kill_timer is not None:
+                self.kill_timer.cancel()
+
+    def run_jobs_in_order(self, jobs: list):
+        """ See run_jobs_sequentially. """
+        for job in jobs:
+            if self.stopped:
+                break
+            job.slot = 0
+            job.start_time = time.time()
+            straggler_timer = None
+            if job.straggler_time is not None:
+                import threading
+                straggler_timer = threading.Timer(job.straggler_time, job.report_straggler)
+                straggler_timer.daemon = True
+                straggler_timer.start()
+            self.running_jobs.add(job)
             try:
-                # Must have a timeout to enable checking stop request event even when queue is empty.
-                job = self.request_queue.get(block=True, timeout=JOB_QUEUE_TIMEOUT)
-                for command in job:
-                    command.execute()
+                if job.prepare is not None:
+                    job.prepare(job)
+                for command in job.commands:
+                    command.execute(self.output_memory_limit, self.spill_directory)
+                    while not self.stopped and command.attempts <= job.retries and command.is_transient_failure():
+                        time.sleep(job.prepare_retry(command))
+                        command.execute(self.output_memory_limit, self.spill_directory)
                     if command.result_code != 0:
-                        # If an error occurred, no point to continue within the job (next commands likely depend on
-                        # previous ones).
                         break
-                # Moved the entire command jobs list to the result queue.
-                self.result_queue.put(job, block=True)  # Never blocks since this queue is unlimited.
-            except queue.Empty:
-                # Queue get timeout, just check stop request event and try again.
-                pass
+            finally:
+                job.end_time = time.time()
+                self.running_jobs.discard(job)
+                if straggler_timer is not None:
+                    straggler_timer.cancel()
+            self.handle_job_result(job)
+
+    def handle_job_result(self, job: Job):
+        """ Pass the completed job to the job result handler (unless stopped) and release its output. """
+        try:
+            if job.is_timed_out():
+                job.remove_partial_path("timed out")
+            if self.job_completion_handler is not None and job.start_time is not None:
+                self.job_completion_handler(job)
+            if not self.stopped:
+                job.handler_start_time = time.time()
+                if not self.job_result_handler(job):
+                    logger.debug("Stopping command execution.")
+                    self.stopped = True
+        except BaseException:
+            self.stopped = True
+            raise
+        finally:
+            if job.handler_start_time is not None:
+                job.handler_end_time = time.time()
+            # The result is handled (or ignored), so the output is no longer needed. This keeps the memory usage
+            # bounded by the number of running jobs.
+            for command in job.commands:
+                command.release_output()
+
+    def handle_signal(self, signal_number: int, frame):
+        """ Signal handler when executing jobs sequentially. """
+        self.cancel(signal_number)
+
+    def cancel(self, signal_number: int):
+        """ Cancel the execution due to the signal (SIGINT or SIGTERM): no further jobs are started, and the running
+        commands are terminated (SIGTERM), and killed (SIGKILL) unless exited within KILL_GRACE_TIME. On a second
+        signal, they are killed at once. Tasks are never cancelled; each job is completed as soon as its command has
+        exited (but not handled by the job result handler).
+        """
+        import signal
+        if self.cancelled is not None:
+            self.kill_running_commands()
+            return
+        logger.debug("Cancelling command execution due to signal " + str(signal_number) + ".")
+        self.cancelled = signal_number
+        self.stopped = True
+        for job in list(self.running_jobs):
+            job.interrupted = True
+            for command in job.commands:
+                command.print_errors = False   # The error is due to the signal.
+                command.send_signal(signal.SIGTERM)
+        if self.loop is not None:
+            self.kill_timer = self.loop.call_later(KILL_GRACE_TIME, self.kill_running_commands)
+        else:
+            import threading
+            self.kill_timer = threading.Timer(KILL_GRACE_TIME, self.kill_running_commands)
+            self.kill_timer.daemon = True
+            self.kill_timer.start()
+
+    def kill_running_commands(self):
+        """ Kill (SIGKILL) the commands still running after being cancelled. """
+        import signal
+        for job in list(self.running_jobs):
+            for command in job.commands:
+                command.send_signal(signal.SIGKILL)
+
+    async def run_jobs(self, jobs: list):
+        import asyncio
+        import signal
+        self.loop = asyncio.get_running_loop()
+        if CommandEngine.event_loop is None:
+            use_pidfd_child_watcher()
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(signal_number, self.cancel, signal_number)
+        try:
+            await self.run_all_jobs(jobs)
+        finally:
+            if CommandEngine.event_loop is None:
+                for signal_number in (signal.SIGINT, signal.SIGTERM):
+                    self.loop.remove_signal_handler(signal_number)
+            if self.kill_timer is not None:
+                self.kill_timer.cancel()
+
+    async def run_all_jobs(self, jobs: list):
+        """ See run_jobs. """
+        import asyncio
+        if self.job_limit_controller is not None:
+            job_slots = JobLimiter(self.job_limit_controller.limit)
+        else:
+            job_slots = JobLimiter(self.max_jobs)
+        self.free_slots = list(range(self.max_jobs))
+        # If several jobs of the same host specify different limits, the lowest one is used.
+        host_limits = {}
+        for job in jobs:
+            if job.max_jobs_per_host is not None:
+                host_limits[job.host] = min(host_limits.get(job.host, job.max_jobs_per_host), job.max_jobs_per_host)
+        host_job_slots = {}
+        for host, max_jobs_per_host in host_limits.items():
+            logger.debug("At most " + str(max_jobs_per_host) + " jobs in parallel for host '" + host + "'.")
+            host_job_slots[host] = asyncio.Semaphore(max(max_jobs_per_host, 1))
+        # Waiters are woken up in order, so jobs are started in the same order as provided (except that jobs
+        # waiting for their host don't block jobs of other hosts).
+        # Tasks are never cancelled (cancelling a task while its subprocess is being created may hang).
+        # Instead, if a job fails unexpectedly, no further jobs are started and the error is raised once the
+        # already started jobs are completed.
+        if self.job_limit_controller is not None:
+            self.control_handle = asyncio.get_running_loop().call_later(JOB_LIMIT_CONTROL_INTERVAL,
+                                                                        self.control_job_limit, job_slots)
+        results = await asyncio.gather(*[self.run_job(job, job_slots, host_job_slots.get(job.host))
+                                         for job in jobs], return_exceptions=True)
+        if self.control_handle is not None:
+            self.control_handle.cancel()   # A timer, not a task.
+            self.control_handle = None
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def control_job_limit(self, job_slots: JobLimiter):
+        """ Let the job limit controller update the limit, and schedule the next update. """
+        import asyncio
+        if not self.stopped:
+            job_slots.set_limit(self.job_limit_controller.update(len(job_slots.waiters), self.completed_jobs))
+        self.completed_jobs = []
+        self.control_handle = asyncio.get_running_loop().call_later(JOB_LIMIT_CONTROL_INTERVAL,
+                                                                    self.control_job_limit, job_slots)
+
+    async def run_job(self, job: Job, job_slots: JobLimiter, host_job_slots: "asyncio.Semaphore"=None):
+        if host_job_slots is None or job.max_jobs_per_host is None:
+            async with job_slots:
+                await self.execute_job(job)
+        else:
+            # The host slot is acquired first, so a job waiting for its host doesn't occupy a job slot.
+            async with host_job_slots:
+                async with job_slots:
+                    await self.execute_job(job)
+        self.handle_job_result(job)
+
+    async def execute_job(self, job: Job):
+        """ Execute the commands of the job in order, until one fails. """
+        if self.stopped:
+            return
+        import heapq
+        import asyncio
+        job.slot = heapq.heappop(self.free_slots)
+        job.start_time = time.time()
+        straggler_timer = None
+        if job.straggler_time is not None:
+            straggler_timer = asyncio.get_running_loop().call_later(job.straggler_time, job.report_straggler)
+        self.running_jobs.add(job)
+        try:
+            if job.prepare is not None:
+                await asyncio.get_running_loop().run_in_executor(None, job.prepare, job)
+            for command in job.commands:
+                await command.execute_async(self.output_memory_limit, self.spill_directory)
+                while not self.stopped and command.attempts <= job.retries and command.is_transient_failure():
+                    # The job slot is kept while waiting, so the retry doesn't add to any overload.
+                    await asyncio.sleep(job.prepare_retry(command))
+                    await command.execute_async(self.output_memory_limit, self.spill_directory)
+                if command.result_code != 0:
+                    # If an error occurred, no point to continue within the job (next commands likely depend on
+                    # previous ones).
+                    break
+        finally:
+            job.end_time = time.time()
+            self.running_jobs.discard(job)
+            if straggler_timer is not None:
+                straggler_timer.cancel()
+            heapq.heappush(self.free_slots, job.slot)
+            self.completed_jobs.append(job)
+
+
+class GroupExpression(object):
+    """ A parsed group expression, as specified by the --groups option.
+    The expression is evaluated as set operations on the names of the repos belonging to each group:
+    "," or "|" is union, "&" is intersection and "!" is exclusion (highest priority first: !, &, then , and |).
+    Parentheses can be used for grouping. A group name with any of the wildcards *, ? or [...] is a glob pattern
+    that matches all groups with a matching name. Example: "platform&!legacy,tools*".
+    """
+    OPERATOR_CHARS = ",|&!()"
+    WILDCARD_CHARS = "*?["
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = self.tokenize(expression)
+        self.position = 0
+        self.tree = self.parse_union()   # Each node is a tuple: (operator, operand(s)).
+        if self.position < len(self.tokens):
+            self.raise_error()
+
+    def raise_error(self):
+        raise ValueError("Invalid group expression '" + self.expression + "'!")
+
+    @staticmethod
+    def tokenize(expression: str):
+        """ Split the expression into operators and (stripped) group names/patterns. """
+        tokens = []
+        name = ""
+        for char in expression:
+            if char in GroupExpression.OPERATOR_CHARS:
+                if name.strip() != "":
+                    tokens.append(name.strip())
+                name = ""
+                tokens.append(char)
+            else:
+                name += char
+        if name.strip() != "":
+            tokens.append(name.strip())
+        return tokens
+
+    def next_token(self):
+        """ Returns the next token without consuming it, or None if all tokens are consumed. """
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def parse_union(self):
+        operands = [self.parse_union_operand()]
+        while self.next_token() in (",", "|"):
+            self.position += 1
+            operands.append(self.parse_union_operand())
+        operands = [operand for operand in operands if operand is not None]
+        return operands[0] if len(operands) == 1 else ("union", operands)
+
+    def parse_union_operand(self):
+        """ Returns None for an empty operand, e.g. in "g1," or "g1,,g2", which is ignored (as when the groups option
+        was a plain comma-separated list).
+        """
+        if self.next_token() in (",", "|", ")", None):
+            return None
+        return self.parse_intersection()
+
+    def parse_intersection(self):
+        operands = [self.parse_factor()]
+        while self.next_token() == "&":
+            self.position += 1
+            operands.append(self.parse_factor())
+        return operands[0] if len(operands) == 1 else ("intersection", operands)
+
+    def parse_factor(self):
+        token = self.next_token()
+        if token is None:
+            self.raise_error()
+        self.position += 1
+        if token == "!":
+            return "exclusion", self.parse_factor()
+        elif token == "(":
+            node = self.parse_union()
+            if self.next_token() != ")":
+                self.raise_error()
+            self.position += 1
+            return node
+        elif token in GroupExpression.OPERATOR_CHARS:
+            self.raise_error()
+        elif any(char in token for char in GroupExpression.WILDCARD_CHARS):
+            return "pattern", token
+        else:
+            return "group", token
+
+    def evaluate(self, group_index: dict, all_repo_names):
+        """ Evaluate the expression. group_index is a dict, where each key is a group name and the value is the set
+        of names of all repos belonging to that group. all_repo_names is only used for plain exclusions.
+        Returns the set of names of all matching repos.
+        """
+        return self.evaluate_node(self.tree, group_index, all_repo_names)
+
+    def evaluate_node(self, node, group_index: dict, all_repo_names):
+        operator, operand = node
+        if operator == "group":
+            return group_index.get(operand, set())
+        elif operator == "pattern":
+            repo_names = set()
+            import fnmatch
+            for group in fnmatch.filter(group_index.keys(), operand):
+                repo_names |= group_index[group]
+            return repo_names
+        elif operator == "union":
+            repo_names = set()
+            for child in operand:
+                repo_names |= self.evaluate_node(child, group_index, all_repo_names)
+            return repo_names
+        elif operator == "intersection":
+            # Exclusions are subtracted from the intersection of the other operands, so "a&!b" only costs
+            # the size of the involved groups (not the total number of repos).
+            included = [self.evaluate_node(child, group_index, all_repo_names)
+                        for child in operand if child[0] != "exclusion"]
+            if len(included) > 0:
+                included.sort(key=len)
+                repo_names = set(included[0]).intersection(*included[1:])
+            else:
+                repo_names = set(all_repo_names)
+            for child in operand:
+                if child[0] == "exclusion":
+                    repo_names -= self.evaluate_node(child[1], group_index, all_repo_names)
+            return repo_names
+        else:   # exclusion
+            return set(all_repo_names) - self.evaluate_node(operand, group_index, all_repo_names)
 
 
 class Manifest(object):
@@ -247,12 +1556,20 @@ class Manifest(object):
     def __init__(self):
         self.manifest = None
         self.manifest_path = None
-        self.request_queue = None
-        self.result_queue = None
-        self.pending_jobs = 0
-        self.command_executors = []
+        self.profiles = {}   # All profiles, indexed by profile name (in manifest order).
+        self.repos = {}      # All repositories, indexed by repository name (in manifest order).
+        self.jobs = []       # Queued jobs (Job instances).
+        self.job_stats = None   # Recorded job durations: {stats key: {job name: [durations]}}.
+        self.dirty_state = None   # Recorded dirty checks: {local path: state}, see check_dirty.
+        self.dirty_state_changed = False
+        self.exit_code = None   # Set if a command failed and grit shall exit (when not in force mode).
         self.log_file_stream = None
+        self.log_headed_commands = set()   # Streamed commands whose log header is written (see write_log_header).
         self.args = None
+        self.resolved_profiles = {}   # Flattened settings (incl. inherited ones) per profile name.
+        self.resolved_repos = {}      # Flattened settings (incl. all profile settings) per repo name.
+        self.group_index = None       # Set of repo names per group name (lazily built, see get_group_index).
+        self.repo_positions = None    # Manifest order position per repo name (built together with group index).
 
     def load(self, manifest_path: str):
         """ Load a new manifest file (JSON format). The manifest_path argument is the path within GRIT_DIRECTORY,
@@ -263,61 +1580,190 @@ class Manifest(object):
         path_parts = (manifest_path + ".json").split("/")
         file_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, *path_parts)
         logger.debug("Loading manifest file " + file_path)
-        with open(file_path, "r") as file_stream:
-            try:
-                self.manifest = json.load(file_stream,
-                                          object_hook=json_manifest_object_hook)
-            except json.JSONDecodeError as err:
-                raise JSONDecodeError(str(err) + " in file " + file_path)
+        with open(file_path, "rb") as file_stream:
+            data = file_stream.read()
+        self.load_data(data, file_path)
+
+    def load_data(self, data: bytes, file_path: str):
+        """ Load a manifest from the (JSON formatted) content of the provided file path. """
+        try:
+            import json
+            self.manifest = json.loads(data, object_hook=json_manifest_object_hook)
+        except json.JSONDecodeError as err:
+            raise JSONDecodeError(str(err) + " in file " + file_path)
+        self.index_manifest(file_path)
+
+    def index_manifest(self, source: str):
+        """ Move the loaded lists of profiles and repositories into the name indexes (keeping the manifest order).
+        Duplicate names are detected in the same pass. Raises ValueError if a name is defined more than once.
+        source is only used in the error message (e.g. the file path).
+        """
+        self.profiles = {}
+        for profile in self.manifest.pop("profiles", []):
+            profile_name = profile.get_profile_name()
+            if profile_name in self.profiles:
+                raise ValueError("Profile " + profile_name + " is defined more than once in " + source + "!")
+            self.profiles[profile_name] = profile
+            profile.set_change_handler(self.invalidate_resolved_settings)
+        self.repos = {}
+        for repo in self.manifest.pop("repositories", []):
+            repo_name = repo.get_repo()
+            if repo_name in self.repos:
+                raise ValueError("Repository " + repo_name + " is defined more than once in " + source + "!")
+            self.repos[repo_name] = repo
+            repo.set_change_handler(self.invalidate_resolved_settings)
+        self.invalidate_resolved_settings()
+
+    def todict(self):
+        """ Returns the manifest as a dict, in the same layout as the manifest file. """
+        dct = dict(self.manifest)
+        if len(self.profiles) > 0:
+            dct["profiles"] = self.get_profiles()
+        if len(self.repos) > 0:
+            dct["repositories"] = self.get_repos()
+        return dct
 
     def save(self, manifest_path: str):
         """ Save to a manifest file (JSON format). The manifest_path argument is the path within GRIT_DIRECTORY,
         except that the .json file extension is to be omitted.
         Note that manifest_path must use "/" as directory separator, regardless of native OS separator.
+        The file is not rewritten if the content is unchanged (so its modification time is kept).
+        Returns True if the file was written.
         """
+        import json
         path_parts = (manifest_path + ".json").split("/")
         file_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, *path_parts)
+        # Add a new line for a pretty ending.
+        content = json.dumps(self.todict(), indent=4, sort_keys=True, default=json_manifest_encoder) + "\n"
+        try:
+            with open(file_path, "r") as file_stream:
+                if file_stream.read() == content:
+                    logger.debug("Manifest file " + file_path + " is unchanged.")
+                    return False
+        except OSError:
+            pass   # New file.
         logger.debug("Saving manifest file " + file_path)
-        with open(file_path, "w") as file_stream:
-            json.dump(self.manifest, file_stream, indent=4, sort_keys=True, default=json_manifest_encoder)
-            # Add a new line for a pretty ending.
-            file_stream.write("\n")
+        # Write to a temporary file first, so a concurrent grit command never reads a partially written file.
+        with open(file_path + ".tmp", "w") as file_stream:
+            file_stream.write(content)
+        os.replace(file_path + ".tmp", file_path)
+        return True
 
     @staticmethod
     def get_root_path():
         """ Get the full path to the project root directory.
         Assumes that the current working directory is at, or below, project root.
+        The result is remembered per working directory, since it's needed many times per command.
         """
-        found_dir = False
-        path = os.getcwd()
-        while not found_dir:
-            if os.path.exists(GRIT_DIRECTORY):
-                found_dir = True
-            else:
-                # Go up one step
-                parent_path = os.path.dirname(path)
-                if parent_path != path:
-                    path = parent_path
-                else:
-                    break
-        if found_dir:
-            logger.debug("Project root path is " + path)
-            return path
-        else:
-            raise RuntimeError("Cannot find the " + GRIT_DIRECTORY + " directory!")
-
-    def load_active_manifest(self):
+        cwd = os.getcwd()
+        if cwd in root_paths:
+            return root_paths[cwd]
+        path = cwd
+        while not os.path.isdir(os.path.join(path, GRIT_DIRECTORY)):
+            # Go up one step
+            parent_path = os.path.dirname(path)
+            if parent_path == path:
+                raise RuntimeError("Cannot find the " + GRIT_DIRECTORY + " directory!")
+            path = parent_path
+        logger.debug("Project root path is " + path)
+        root_paths[cwd] = path
+        return path
+
+    def load_active_manifest(self, use_cache=True, rebuild_cache=False):
         """ Load the active manifest from the file system. Automatically finds the active
-        manifest file, even if current working directory is below project root. """
-        self.load(ACTIVE_MANIFEST_FILE)
+        manifest file, even if current working directory is below project root.
+        If use_cache is True, the precompiled active manifest is used if it is up-to-date with the active
+        manifest file; otherwise, the active manifest file is loaded and the precompiled one is (re)built.
+        If rebuild_cache is True, the precompiled active manifest is always rebuilt.
+        """
+        self.manifest_path = ACTIVE_MANIFEST_FILE
+        file_path, data, cache_key = self.read_active_manifest()
+        if use_cache and not rebuild_cache and self.load_cache(cache_key):
+            return
+        self.load_data(data, file_path)
+        if use_cache:
+            self.save_cache(cache_key)
 
     def save_active_manifest(self):
-        """ Save the manifest as new active manifest to the file system. """
+        """ Save the manifest as new active manifest to the file system, together with a precompiled copy.
+        An identical active manifest is not rewritten, so e.g. a grit daemon doesn't need to reload it.
+        """
         self.save(ACTIVE_MANIFEST_FILE)
+        _, _, cache_key = self.read_active_manifest()
+        self.save_cache(cache_key)
+
+    def read_active_manifest(self):
+        """ Read the raw content of the active manifest file.
+        Returns a tuple of the file path, the content (bytes) and the key of a matching precompiled active manifest.
+        The key is based on the modification time, size and checksum of the content.
+        """
+        file_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, ACTIVE_MANIFEST_FILE + ".json")
+        with open(file_path, "rb") as file_stream:
+            stat = os.fstat(file_stream.fileno())
+            data = file_stream.read()
+        import zlib   # Much faster to import than hashlib; a checksum is enough here.
+        return file_path, data, (stat.st_mtime_ns, stat.st_size, zlib.crc32(data))
+
+    def load_cache(self, cache_key):
+        """ Load the precompiled active manifest, if it matches the cache key (see read_active_manifest).
+        Returns True if loaded. If not, False is returned and the manifest is left untouched.
+        """
+        cache_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, ACTIVE_MANIFEST_CACHE_FILE)
+        try:
+            with open(cache_path, "rb") as file_stream:
+                state = load_manifest_cache(file_stream)
+            if state["version"] != ACTIVE_MANIFEST_CACHE_VERSION or state["key"] != cache_key:
+                logger.debug("Precompiled active manifest is outdated.")
+                return False
+        except FileNotFoundError:
+            logger.debug("No precompiled active manifest.")
+            return False
+        except Exception as err:
+            # Any problem with the precompiled manifest just means that the manifest file is used instead.
+            logger.debug("Ignoring invalid precompiled active manifest: " + repr(err))
+            return False
+        logger.debug("Loaded precompiled active manifest " + cache_path)
+        self.manifest = state["manifest"]
+        self.profiles = state["profiles"]
+        self.repos = state["repos"]
+        self.resolved_profiles = state["resolved_profiles"]
+        self.resolved_repos = {}   # Resolved on demand, only for the target repos.
+        self.group_index = state["group_index"]
+        self.repo_positions = state["repo_positions"]
+        for settings in list(self.profiles.values()) + list(self.repos.values()):
+            settings.set_change_handler(self.invalidate_resolved_settings)
+        return True
+
+    def save_cache(self, cache_key):
+        """ Save the manifest as precompiled active manifest, including the resolved profile settings and the
+        group index. Failing to save is not an error, since the precompiled active manifest is only used to speed
+        up loading.
+        """
+        try:
+            for profile_name in self.profiles:
+                self.get_resolved_profile_settings(profile_name)
+        except ValueError as err:
+            # Errors are reported when (if) the settings are used, just like when there is no precompiled manifest.
+            logger.debug("Cannot resolve all profile settings: " + str(err))
+        self.get_group_index()
+        state = {"version": ACTIVE_MANIFEST_CACHE_VERSION, "key": cache_key, "manifest": self.manifest,
+                 "profiles": self.profiles, "repos": self.repos, "resolved_profiles": self.resolved_profiles,
+                 "group_index": self.group_index, "repo_positions": self.repo_positions}
+        cache_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, ACTIVE_MANIFEST_CACHE_FILE)
+        logger.debug("Saving precompiled active manifest " + cache_path)
+        try:
+            # Write to a temporary file first, so a concurrent grit command never reads a partially written file.
+            import pickle
+            with open(cache_path + ".tmp", "wb") as file_stream:
+                pickle.dump(state, file_stream, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as err:
+            logger.debug("Failed to save precompiled active manifest: " + str(err))
 
     def validate_profiles(self):
-        """ Do some sanity checking of the profiles. The final checking is done when performing an operation. """
-        """ TODO: check that multiple profiles with same name doesn't exist!"""
+        """ Do some sanity checking of the profiles. The final checking is done when performing an operation.
+        Note that multiple profiles with same name are already rejected when the manifest is loaded.
+        """
         logger.debug("Validating profiles.")
         default_profile = self.manifest.get("default-profile", None)
         if default_profile is not None:
@@ -327,22 +1773,20 @@ class Manifest(object):
                 raise ValueError("The default profile " + default_profile + " is not defined!")
 
     def validate_repos(self):
-        """ Do some sanity checking of the repos. The final checking is done when performing an operation. """
-        """ TODO: check that multiple repos with same name doesn't exist!"""
-        logger.debug("Validating profiles.")
-        try:
-            if len(self.manifest["repositories"]) == 0:
-                raise ValueError("No repositories are specified!")
-            for repo in self.manifest["repositories"]:
-                # get_profile raises ValueError if invalid profile is referenced.
-                profile = self.get_profile(repo.get_optional_setting("use-profile"))
-        except KeyError:
+        """ Do some sanity checking of the repos. The final checking is done when performing an operation.
+        Note that multiple repos with same name are already rejected when the manifest is loaded.
+        """
+        logger.debug("Validating repositories.")
+        if len(self.repos) == 0:
             raise ValueError("No repositories are specified!")
+        for repo in self.repos.values():
+            # Raises ValueError if invalid profile is referenced or if there is an inheritance cycle.
+            self.get_resolved_profile_settings(repo.get_optional_setting("use-profile"))
 
     def get_profiles(self):
-        """ Get all profiles in a list. Each item is an instance of Profile.
+        """ Get all profiles in a list (in manifest order). Each item is an instance of Profile.
         Return an empty list if not defined. """
-        return self.manifest.get("profiles", list())
+        return list(self.profiles.values())
 
     def get_remove_profiles(self):
         """ Get all remove profiles in a list. Each item is a str (containing the profile name).
@@ -358,11 +1802,7 @@ class Manifest(object):
         """ Get the default profile, if defined. If not, None is returned.
         The default profile is used if a repo has no explicit use-profile setting.
         """
-        for profile in self.get_profiles():
-            if profile.get_profile_name() == self.manifest.get("default-profile", None):
-                return profile
-        else:
-            return None
+        return self.profiles.get(self.manifest.get("default-profile", None))
 
     def get_profile(self, profile_name: str):
         """ Get a profile, given its name. If profile name is None, the default profile is returned.
@@ -372,41 +1812,31 @@ class Manifest(object):
             profile_name = self.manifest.get("default-profile", None)
             if profile_name is None:
                 raise ValueError("Default profile is implicitly referenced, but is undefined!")
-        for profile in self.get_profiles():
-            if profile.get_profile_name() == profile_name:
-                return profile
-        else:
+        try:
+            return self.profiles[profile_name]
+        except KeyError:
             raise ValueError("Profile " + profile_name + " is referenced, but is undefined!")
 
     def add_profile(self, profile):
         """ Add a new profile. Raises ValueError if a profile with same name already exist. """
         profile_name = profile.get_profile_name()
         logger.debug("Adding profile " + profile_name)
-        try:
-            existing_profile = self.get_profile(profile_name)
-        except ValueError:
-            # Doesn't already exist. Add it.
-            if "profiles" not in self.manifest:
-                # First profile in manifest, create empty list first.
-                self.manifest["profiles"] = []
-            self.manifest["profiles"].append(profile)
-        else:
+        if profile_name in self.profiles:
             raise ValueError("Profile " + profile_name + " already exist!")
+        self.profiles[profile_name] = profile
+        profile.set_change_handler(self.invalidate_resolved_settings)
+        self.invalidate_resolved_settings()
 
     def remove_profile(self, profile_name: str):
         """ Remove a profile, given its name. If the name doesn't exist, this method is a no-op. """
         logger.debug("Removing profile " + profile_name)
-        try:
-            profile = self.get_profile(profile_name)
-            index = self.get_profiles().index(profile)
-            del self.get_profiles()[index]
-        except ValueError:
-            pass
+        if self.profiles.pop(profile_name, None) is not None:
+            self.invalidate_resolved_settings()
 
     def get_repos(self):
-        """ Get all repos in a list. Each item is in instance of Repository.
+        """ Get all repos in a list (in manifest order). Each item is in instance of Repository.
         Return an empty list if not defined. """
-        return self.manifest.get("repositories", list())
+        return list(self.repos.values())
 
     def get_remove_repos(self):
         """ Get all remove repositories in a list. Each item is a str (containing the repo name).
@@ -417,60 +1847,125 @@ class Manifest(object):
         """ Get a repo, given its name.
         Raises ValueError if a matching repo cannot be found.
         """
-        for repo in self.get_repos():
-            if repo.get_repo() == repo_name:
-                return repo
-        else:
+        try:
+            return self.repos[repo_name]
+        except KeyError:
             raise ValueError("Repository " + repo_name + " is referenced, but is undefined!")
 
     def add_repo(self, repo):
         """ Add a new repository. Raises ValueError if a repository with same name already exist. """
         repo_name = repo.get_repo()
         logger.debug("Adding repository " + repo_name)
-        try:
-            existing_repo = self.get_repo(repo_name)
-        except ValueError:
-            # Doesn't already exist. Add it.
-            if "repositories" not in self.manifest:
-                # First repository in manifest, create empty list first.
-                self.manifest["repositories"] = []
-            self.manifest["repositories"].append(repo)
-        else:
+        if repo_name in self.repos:
             raise ValueError("Repository " + repo_name + " already exist!")
+        self.repos[repo_name] = repo
+        repo.set_change_handler(self.invalidate_resolved_settings)
+        self.invalidate_resolved_settings()
 
     def remove_repo(self, repo_name: str):
         """ Remove a repo, given its name. If the name doesn't exist, this method is a no-op. """
         logger.debug("Removing repository " + repo_name)
+        if self.repos.pop(repo_name, None) is not None:
+            self.invalidate_resolved_settings()
+
+    def invalidate_resolved_settings(self):
+        """ Invalidate all resolved (flattened) settings and the group index.
+        Must be called whenever the manifest is changed.
+        """
+        if len(self.resolved_profiles) > 0 or len(self.resolved_repos) > 0 or self.group_index is not None:
+            logger.debug("Invalidating resolved settings.")
+            self.resolved_profiles = {}
+            self.resolved_repos = {}
+            self.group_index = None
+            self.repo_positions = None
+
+    def get_group_index(self):
+        """ Get the inverted group index, i.e. a dict where each key is a group name and the value is the set
+        of names of all repos belonging to that group. The index is cached until the manifest is changed.
+        """
+        if self.group_index is None:
+            logger.debug("Building group index.")
+            self.group_index = {}
+            self.repo_positions = {}
+            for position, (repo_name, repo) in enumerate(self.repos.items()):
+                self.repo_positions[repo_name] = position
+                repo_groups = repo.get_optional_setting("groups")   # This is a list of strings.
+                if repo_groups is not None:
+                    if isinstance(repo_groups, str):   # Allow a string instead of a list for a single group.
+                        repo_groups = [repo_groups]    # Convert to a list.
+                    for group in repo_groups:
+                        self.group_index.setdefault(group, set()).add(repo_name)
+        return self.group_index
+
+    @staticmethod
+    def merge_settings(settings: dict, overlay_settings: dict):
+        """ Returns a new dict, where the overlay settings take precedence over the settings.
+        Settings set to None are treated as missing, i.e. they don't hide a lower priority setting.
+        """
+        merged_settings = dict(settings)
+        for key, value in overlay_settings.items():
+            if value is not None:
+                merged_settings[key] = value
+        return merged_settings
+
+    def get_resolved_profile_settings(self, profile_name: str):
+        """ Get the flattened settings of a profile, i.e. including all settings inherited from parent profiles.
+        If profile name is None, the default profile is used.
+        Raises ValueError if an undefined profile is referenced or if the inheritance chain contains a cycle.
+        """
+        if profile_name is None:
+            profile_name = self.manifest.get("default-profile", None)
+            if profile_name is None:
+                raise ValueError("Default profile is implicitly referenced, but is undefined!")
         try:
-            repo = self.get_repo(repo_name)
-            index = self.get_repos().index(repo)
-            del self.get_repos()[index]
-        except ValueError:
+            return self.resolved_profiles[profile_name]
+        except KeyError:
             pass
+        # Walk the inheritance chain, until the root profile or an already resolved profile is reached.
+        chain = []
+        chain_names = []
+        parent_name = profile_name
+        while parent_name is not None and parent_name not in self.resolved_profiles:
+            if parent_name in chain_names:
+                raise ValueError("Profile inheritance cycle detected: " + " -> ".join(chain_names + [parent_name]))
+            profile = self.get_profile(parent_name)
+            chain.append(profile)
+            chain_names.append(parent_name)
+            parent_name = profile.get_optional_setting("inherit")
+        settings = {} if parent_name is None else self.resolved_profiles[parent_name]
+        # Flatten the chain, starting from the root, and store each intermediate result for later lookups.
+        for profile in reversed(chain):
+            settings = self.merge_settings(settings, profile.get_settings())
+            self.resolved_profiles[profile.get_profile_name()] = settings
+        return settings
+
+    def get_resolved_settings(self, repo):
+        """ Get the flattened settings of a repo, i.e. the repo settings on top of the referenced profile settings
+        (including all inherited settings). The result is cached until the manifest is changed.
+        A repo without use-profile in a manifest without default-profile has only its own settings.
+        NOTE: Do not modify returned dict!
+        """
+        repo_name = repo.get_repo()
+        try:
+            return self.resolved_repos[repo_name]
+        except KeyError:
+            profile_name = repo.get_optional_setting("use-profile")
+            if profile_name is None and self.manifest.get("default-profile", None) is None:
+                profile_settings = {}
+            else:
+                profile_settings = self.get_resolved_profile_settings(profile_name)
+            settings = self.merge_settings(profile_settings, repo.get_settings())
+            self.resolved_repos[repo_name] = settings
+            return settings
 
     def get_optional_setting(self, repo, key: str, default=None):
         """ Get an optional setting value based on priority order for a specific repo.
         The search order is: 1. repo, 2. referenced profile, 3. parent profile, 4. grandparent profile etc.
         If a setting is not found, the default value is returned.
         """
-        # Repo settings have highest priority.
-        value = repo.get_optional_setting(key)
+        value = self.get_resolved_settings(repo).get(key)
         if value is None:
-            # Next comes the referenced profile settings.
-            profile = self.get_profile(repo.get_optional_setting("use-profile"))
-            value = profile.get_optional_setting(key)
-            if value is None:
-                # Check parent profile settings (and then grandparent etc.)
-                profile_name = profile.get_optional_setting("inherit")
-                while profile_name is not None:
-                    profile = self.get_profile(profile_name)
-                    value = profile.get_optional_setting(key)
-                    if value is not None:
-                        break
-                    else:
-                        profile_name = profile.get_optional_setting("inherit")
-                else:
-                    value = default
+            value = default
         return value
 
     def get_mandatory_setting(self, repo, key: str):
@@ -487,6 +1982,7 @@ class Manifest(object):
     def overlay(self, overlay_manifest):
         """ Overlays the provided manifest on top of existing one. """
         logger.debug("Overlaying manifest.")
+        self.invalidate_resolved_settings()
         # First, remove all profiles and repos.
         for profile_name in overlay_manifest.get_remove_profiles():
             self.remove_profile(profile_name)
@@ -507,21 +2003,19 @@ class Manifest(object):
                 logger.debug("Creating run after clone with " + ",".join(run_after_clone_commands))
                 self.manifest["run-after-clone"] = run_after_clone_commands
         # Next, overlay the profiles.
-        for profile in overlay_manifest.get_profiles():
-            profile_name = profile.get_profile_name()
-            try:
-                existing_profile = self.get_profile(profile_name)
+        for profile_name, profile in overlay_manifest.profiles.items():
+            existing_profile = self.profiles.get(profile_name)
+            if existing_profile is not None:
                 existing_profile.overlay(profile)
-            except ValueError:
+            else:
                 # Existing profile doesn't exist. Add as new profile.
                 self.add_profile(profile)
         # Next, overlay the repos.
-        for repo in overlay_manifest.get_repos():
-            repo_name = repo.get_repo()
-            try:
-                existing_repo = self.get_repo(repo_name)
+        for repo_name, repo in overlay_manifest.repos.items():
+            existing_repo = self.repos.get(repo_name)
+            if existing_repo is not None:
                 existing_repo.overlay(repo)
-            except ValueError:
+            else:
                 # Existing repo doesn't exist. Add as new repo.
                 self.add_repo(repo)
 
@@ -529,140 +2023,531 @@ class Manifest(object):
         """ Store the provided command arguments. Used by other methods. """
         self.args = args
 
-    def prepare_for_commands(self):
-        """ Prepare for executing commands. """
+    def prepare_for_commands(self, journal: bool=True):
+        """ Prepare for executing commands. Unless journal is False, the state of each job is recorded in the
+        journal (see --resume).
+        """
         # Open log file.
-        if not self.args.no_log:
+        if self.args.no_log:
+            pass
+        elif self.args.log_format == "jsonl":
+            self.log_file_stream = open(os.path.join(self.get_root_path(), GRIT_DIRECTORY, JSONL_LOG_FILE_NAME),
+                                        "a+t")
+        else:
             self.log_file_stream = open(os.path.join(self.get_root_path(), GRIT_DIRECTORY, LOG_FILE_NAME), "a+t")
             self.log_file_stream.write("*" * 80 + "\n")
             self.log_file_stream.write("* " + time.strftime("%Y%m%d %H:%M:%S") + "\n")
             self.log_file_stream.write("*" * 80 + "\n")
-        if self.args.parallel_jobs > 1:
-            # Setup all command executors. Each item in request and result queue is a list of Command instances.
-            self.request_queue = queue.Queue(self.args.parallel_jobs + COMMAND_QUEUE_EXTRA_SIZE)
-            self.result_queue = queue.Queue()   # Result queue is unlimited.
-            self.pending_jobs = 0
-            for i in range(self.args.parallel_jobs):
-                # Create new executor (thread).
-                logger.debug("Creating new command executor.")
-                command_executor = CommandExecutor(self.request_queue, self.result_queue)
-                command_executor.start()
-                self.command_executors.append(command_executor)
-        else:
-            # If no parallel jobs, we don't spawn command executors. Instead, we run directly in the main thread.
-            logger.debug("No parallel jobs; will run all jobs in same process.")
-            pass
+        self.jobs = []
+        self.exit_code = None
+        self.job_stats = None   # Loaded when needed (see load_job_stats).
+        self.dirty_state = None   # Loaded when needed (see load_dirty_state).
+        self.dirty_state_changed = False
+        self.journal_stream = None
+        if journal:
+            self.open_journal()
 
     def finish_commands(self):
-        # First, finish remaining completed jobs. Will block until everything is done or error occurs.
+        """ Execute all queued jobs. Will block until everything is done or error occurs. """
         logger.debug("Finishing command execution.")
-        if self.args.parallel_jobs > 1:
-            while self.pending_jobs > 0:
-                job = self.result_queue.get(block=True)   # We can block now.
-                self.pending_jobs -= 1
-                self.handle_job_result(job)   # If error, exit is called (unless force mode).
-            if self.log_file_stream is not None:
-                logger.debug("Closing log file.")
-                self.log_file_stream.close()
+        self.schedule_jobs()
+        job_limit_controller = None
+        if self.args.dynamic_jobs:
+            job_limit_controller = JobLimitController(self.args.initial_jobs, self.args.parallel_jobs,
+                                                      self.args.max_load, self.args.max_memory_use,
+                                                      self.handle_job_limit_change)
+        command_engine = CommandEngine(self.args.parallel_jobs, self.handle_job_result, self.args.output_memory_limit,
+                                       os.path.join(self.get_root_path(), GRIT_DIRECTORY), job_limit_controller,
+                                       self.record_job if self.journal_stream is not None else None)
+        try:
+            command_engine.run(self.jobs)
+            timing.mark("commands completed")
+            if command_engine.cancelled is not None:
+                self.remove_partial_paths()
+                print("Interrupted.")
+                self.exit_code = 128 + command_engine.cancelled   # Same as a shell reports a process killed by it.
+            else:
+                # All jobs were handled (i.e. executed), unless stopped at the first error.
+                self.write_journal_record({"event": "end", "time": round(time.time(), 3),
+                                           "stopped": command_engine.stopped})
+        finally:
+            if self.journal_stream is not None:
+                self.journal_stream.close()
+                self.journal_stream = None
+            # Keep the durations of the completed jobs, even if the execution was stopped by an exception.
+            self.save_job_stats()
+            if self.dirty_state_changed:
+                self.save_dirty_state()
+            if self.args.trace_file is not None:
+                self.save_trace(self.args.trace_file, command_engine.max_jobs)
+        self.jobs = []
+        if self.log_file_stream is not None:
+            logger.debug("Closing log file.")
+            self.log_file_stream.close()
+            self.log_file_stream = None
         # Last, exit command execution.
         self.exit_commands()
 
+    def remove_partial_paths(self):
+        """ Remove what was created by the jobs that were interrupted (e.g. partial clones), so they are redone by
+        the next run.
+        """
+        for job in self.jobs:
+            if job.interrupted:
+                job.remove_partial_path("interrupted")
+
     def exit_commands(self):
-        """ Exit from executing commands. Ongoing commands will be completed, but no new ones
-        will be started.
+        """ Exit from executing commands. If a command failed (and not in force mode), grit exits with the
+        result code of that command.
         """
         logger.debug("Exiting command execution.")
-        if self.args.parallel_jobs > 1:
-            # First, signal stop to all command executors (threads).
-            for command_executor in self.command_executors:
-                command_executor.signal_stop()
-            # Next, join them all.
-            for command_executor in self.command_executors:
-                command_executor.join()
+        if self.exit_code is not None:
+            exit(self.exit_code)
 
     def queue_job(self, job):
-        """ Queue up a new job and process any completed jobs. If request queue is full, this method
-        block until space is made (=a command executor grab one).
-        """
-        if self.args.parallel_jobs > 1:
-            # First, handle any completed job. If we catch an error here, we shouldn't queue a new job.
-            while not self.result_queue.empty():
-                job = self.result_queue.get(block=False)
-                self.pending_jobs -= 1
-                self.handle_job_result(job)
-            self.request_queue.put(job, block=True)   # Will block if queue is full.
-            self.pending_jobs += 1
+        """ Queue up a new job. The queued jobs are executed (in parallel, if so specified) by finish_commands.
+        When resuming (see --resume), jobs completed by the resumed run are skipped.
+        """
+        if job.name in self.args.completed_jobs:
+            logger.debug("Skipping " + job.name + ", which is completed by the resumed run.")
+            return
+        for command in job.commands:
+            command.timeout = job.timeout
+        job.queued_time = time.time()
+        self.jobs.append(job)
+
+    def save_trace(self, file_path: str, max_jobs: int):
+        """ Save the timeline of the executed jobs in Chrome trace event format (JSON), which can be viewed in
+        e.g. chrome://tracing or Perfetto. Each job slot of the command engine is shown as a thread, with the jobs
+        and their commands as (nested) slices. The job result handling (in the main thread) is shown as thread 0,
+        the time each job was queued (waiting for a slot) as async slices, and the number of running jobs as a
+        counter. The file is written even if no jobs were queued (e.g. if everything was done in-process), so it
+        always reflects the last run.
+        """
+        import json
+        base_time = min((job.queued_time for job in self.jobs), default=time.time())
+
+        def get_timestamp(timestamp):
+            return round((timestamp - base_time) * 1000000)   # Microseconds.
+
+        events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0,
+                   "args": {"name": "grit " + self.args.command}},
+                  {"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "result handling"}}]
+        for slot in range(max_jobs):
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": slot + 1,
+                           "args": {"name": "job slot " + str(slot)}})
+        running_changes = []   # (time, +1/-1)
+        for job_id, job in enumerate(self.jobs):
+            name = job.name if job.name is not None else "job " + str(job_id)
+            if job.start_time is None:
+                continue   # Never started.
+            # Time waiting for a job slot (or host slot).
+            events.append({"name": name, "cat": "queued", "ph": "b", "id": job_id, "pid": 1,
+                           "ts": get_timestamp(job.queued_time)})
+            events.append({"name": name, "cat": "queued", "ph": "e", "id": job_id, "pid": 1,
+                           "ts": get_timestamp(job.start_time)})
+            events.append({"name": name, "cat": "job", "ph": "X", "pid": 1, "tid": job.slot + 1,
+                           "ts": get_timestamp(job.start_time), "dur": get_timestamp(job.end_time)
+                           - get_timestamp(job.start_time),
+                           "args": {"host": job.host, "queued-us": get_timestamp(job.start_time)
+                                    - get_timestamp(job.queued_time)}})
+            running_changes += [(job.start_time, 1), (job.end_time, -1)]
+            for command in job.commands:
+                if command.start_time is None or command.end_time is None:
+                    continue   # Not executed.
+                events.append({"name": command.get_name(), "cat": "command", "ph": "X", "pid": 1,
+                               "tid": job.slot + 1, "ts": get_timestamp(command.start_time),
+                               "dur": get_timestamp(command.end_time) - get_timestamp(command.start_time),
+                               "args": {"command-line": command.command_line, "exit-code": command.result_code,
+                                        "output-bytes": command.output_size}})
+            if job.handler_start_time is not None and job.handler_end_time is not None:
+                events.append({"name": name, "cat": "handler", "ph": "X", "pid": 1, "tid": 0,
+                               "ts": get_timestamp(job.handler_start_time),
+                               "dur": get_timestamp(job.handler_end_time) - get_timestamp(job.handler_start_time)})
+        running = 0
+        for change_time, change in sorted(running_changes):
+            running += change
+            events.append({"name": "running jobs", "ph": "C", "pid": 1, "ts": get_timestamp(change_time),
+                           "args": {"running": running}})
+        with open(file_path, "w") as file_stream:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file_stream)
+        logger.debug("Saved trace to " + file_path)
+
+    def new_job(self, repo, stats_key: str=None, remote_url: str=None):
+        """ Returns a new (empty) job for commands on the repo. The duration of the job is recorded under
+        stats_key (if set), which is used to schedule the jobs (see schedule_jobs).
+        If the commands access the remote URL of the repo, the number of concurrent jobs per remote host is limited
+        by the jobs-per-host setting (if any), else by the --jobs-per-host option, and commands failing with a
+        transient error are retried according to the --retries and --retry-delay options.
+        Each command is killed if not completed within the timeout setting (if any), else the --timeout option.
+        """
+        max_jobs_per_host = None
+        if remote_url is not None:
+            max_jobs_per_host = self.get_optional_setting(repo, "jobs-per-host", self.args.jobs_per_host)
+        if max_jobs_per_host is None:
+            job = Job()
         else:
-            # Run the commands directly.
-            for command in job:
-                command.execute()
-                if command.result_code != 0:
-                    # If an error occurred, no point to continue within the job (next commands likely depend on
-                    # previous ones).
-                    break
-            self.handle_job_result(job)
+            job = Job(get_url_host(remote_url), int(max_jobs_per_host))
+        job.name = repo.get_repo()
+        job.stats_key = stats_key
+        timeout = self.get_optional_setting(repo, "timeout", self.args.timeout)
+        if timeout is not None:
+            job.timeout = float(timeout)
+        if remote_url is not None:
+            job.retries = self.args.retries
+            job.retry_delay = self.args.retry_delay
+        return job
+
+    def open_journal(self):
+        """ Start a new journal for this run. The journal starts with the command line, followed by the jobs
+        completed by the resumed run (if resuming), so the run can be resumed in turn.
+        """
+        self.journal_stream = open(os.path.join(self.get_root_path(), GRIT_DIRECTORY, JOURNAL_FILE), "w")
+        self.write_journal_record({"event": "start", "time": round(time.time(), 3),
+                                   "command-args": self.args.command_args})
+        for job_name in self.args.completed_jobs:
+            self.write_journal_record({"job": job_name, "state": "succeeded", "resumed": True})
+
+    def write_journal_record(self, record: dict):
+        """ Append the record to the journal (if any). Flushed at once, so it's kept even if grit is killed. """
+        import json
+        if self.journal_stream is not None:
+            self.journal_stream.write(json.dumps(record) + "\n")
+            self.journal_stream.flush()
+
+    def record_job(self, job):
+        """ Job completion handler (see CommandEngine); records the state of the executed job in the journal. """
+        record = {"job": job.name, "state": "succeeded" if job.is_successful() else "failed"}
+        if not job.is_successful():
+            record["exit-code"] = next(command.result_code for command in job.commands if command.result_code != 0)
+            if job.is_timed_out():
+                record["timed-out"] = True
+        self.write_journal_record(record)
+
+    def load_job_stats(self):
+        """ Load the recorded job durations (if any), unless already loaded. """
+        import json
+        if self.job_stats is not None:
+            return
+        self.job_stats = {}
+        try:
+            with open(os.path.join(self.get_root_path(), GRIT_DIRECTORY, JOB_STATS_FILE), "r") as file_stream:
+                self.job_stats = json.load(file_stream)
+        except (OSError, ValueError) as err:
+            # Missing on first use. If corrupt, the stats are simply recorded from scratch.
+            logger.debug("No job stats loaded: " + str(err))
+
+    def save_job_stats(self):
+        """ Record the durations of all successful jobs (with a stats key) and save the job stats, if changed.
+        Only jobs accessing a remote host (clone, fetch, pull, push and cache update) have a stats key, so e.g. a
+        status doesn't read and rewrite the job stats.
+        """
+        import json
+        completed_jobs = [job for job in self.jobs if job.stats_key is not None and job.is_successful()]
+        if len(completed_jobs) == 0:
+            return
+        self.load_job_stats()
+        changed = False
+        for job in completed_jobs:
+            durations = self.job_stats.setdefault(job.stats_key, {}).setdefault(job.name, [])
+            # Keep the latest ones only.
+            new_durations = (durations + [round(job.end_time - job.start_time, 3)])[-JOB_STATS_HISTORY:]
+            if new_durations != durations:
+                durations[:] = new_durations
+                changed = True
+        if not changed:
+            return
+        file_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, JOB_STATS_FILE)
+        # Write to a temporary file first, so the stats are never partially written.
+        with open(file_path + ".tmp", "w") as file_stream:
+            json.dump(self.job_stats, file_stream)
+        os.replace(file_path + ".tmp", file_path)
+
+    def load_dirty_state(self):
+        """ Load the recorded dirty checks (if any), unless already loaded. """
+        import json
+        if self.dirty_state is not None:
+            return
+        self.dirty_state = {}
+        try:
+            with open(os.path.join(self.get_root_path(), GRIT_DIRECTORY, DIRTY_STATE_FILE), "r") as file_stream:
+                self.dirty_state = json.load(file_stream)
+        except (OSError, ValueError) as err:
+            # Missing on first use. If corrupt, all repos are simply checked again.
+            logger.debug("No dirty state loaded: " + str(err))
+
+    def save_dirty_state(self):
+        """ Save the recorded dirty checks. """
+        import json
+        file_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, DIRTY_STATE_FILE)
+        # Write to a temporary file first, so the state is never partially written.
+        with open(file_path + ".tmp", "w") as file_stream:
+            json.dump(self.dirty_state, file_stream)
+        os.replace(file_path + ".tmp", file_path)
+        self.dirty_state_changed = False
+
+    def check_dirty(self, job: Job, local_path: str, skip_clean: bool=False, status_args: list=None):
+        """ Make the job check if the repo is dirty (has local changes), recording the result. When the job is
+        started (see Job.prepare), the work tree fingerprint (see get_worktree_fingerprint) is taken, so the
+        fingerprints of the repos are taken in parallel. If it's the same as when the repo was last checked, the
+        recorded result is kept; if clean and skip_clean, all commands of the job are also removed. Otherwise a
+        command to check it is added first in the job. If status_args is set, the first command of the job is git
+        status with these arguments (see CHECK_DIRTY_STATUS_ARGS), which the check replaces instead, so checking a
+        changed repo costs no extra git process (see handle_changed_status_result).
+        The check also lists the directories matching an ignore pattern (e.g. build output), which are skipped by
+        the following fingerprints. The recorded state of each repo is {"fingerprint": ..., "skipped": ignored
+        directories skipped by the fingerprint, "ignored": ignored directories found by the last check, "dirty": ...}.
+        """
+        self.load_dirty_state()
+
+        def prepare_dirty_check(job):
+            state = self.dirty_state.get(local_path)
+            skipped = [] if state is None else state.get("skipped", [])
+            ignored = [] if state is None else state.get("ignored", [])
+            # Skipping more is only valid if nothing changed until after it was taken, so it's taken first.
+            skip_more = set(ignored) > set(skipped)
+            if skip_more:
+                ignored_fingerprint = get_worktree_fingerprint(local_path, ignored)
+            fingerprint = get_worktree_fingerprint(local_path, skipped)
+            if fingerprint is not None and state is not None and state["fingerprint"] == fingerprint:
+                if skip_more:
+                    # Assigning a key is atomic, and the state is only saved when all jobs are completed.
+                    self.dirty_state[local_path] = dict(state, fingerprint=ignored_fingerprint, skipped=ignored)
+                    self.dirty_state_changed = True
+                if skip_clean and not state["dirty"]:
+                    logger.debug("Skipping " + local_path + ", which is unchanged since it was found clean.")
+                    job.commands = []
+                return
+            if ignored != skipped:
+                fingerprint = get_worktree_fingerprint(local_path, ignored)
+            # No optional locks, so git doesn't refresh (rewrite) the index, which would change the fingerprint.
+            if status_args is None:
+                command = Command(["git", "--no-optional-locks", "status", "--porcelain", "-z", "--ignored=matching"],
+                                  cwd=local_path, result_handler=self.handle_dirty_check_result,
+                                  client_data=(local_path, fingerprint, ignored, True))
+                job.commands.insert(0, command)
+            else:
+                # No colors, which would hide the status codes of the entries from the check.
+                status_command = job.commands[0]
+                command = Command(["git", "--no-optional-locks", "-c", "color.status=false", "status"] + status_args
+                                  + ["--ignored=matching"], print_errors=False, verbose=status_command.verbose,
+                                  result_handler=self.handle_changed_status_result, cwd=local_path,
+                                  client_data=(local_path, fingerprint, ignored, "-z" in status_args,
+                                               status_command.client_data))
+                command.output_prefix = status_command.output_prefix
+                job.commands[0] = command
+            command.timeout = job.timeout
+
+        job.prepare = prepare_dirty_check
+
+    @staticmethod
+    def get_status_entries(output: str, null_terminated: bool):
+        """ Returns the entries of git status output in short or porcelain (v1) format, one string per entry. The
+        original path of a renamed or copied entry is included in the entry (after a NUL if null_terminated).
+        """
+        if not null_terminated:
+            return output.splitlines()
+        entries = []
+        fields = iter(output.split("\0"))
+        for entry in fields:
+            if "R" in entry[:2] or "C" in entry[:2]:
+                entry += "\0" + next(fields, "")   # The original path follows in a field of its own.
+            if entry != "":
+                entries.append(entry)
+        return entries
+
+    def handle_dirty_check_result(self, command):
+        """ Handler for the dirty check command (see check_dirty); records the result. """
+        local_path, fingerprint, skipped, null_terminated = command.client_data[:4]
+        if command.result_code != 0 or fingerprint is None:
+            return
+        dirty = False
+        ignored = []
+        output = "".join(command.result_output.read_chunks()) if command.result_output is not None else ""
+        for entry in self.get_status_entries(output, null_terminated):
+            if entry.startswith("!! "):
+                # A directory matching an ignore pattern. A quoted path (with unusual characters) is not skipped.
+                if entry.endswith("/"):
+                    ignored.append(entry[3:])
+            elif not entry.startswith("## "):   # Not branch information (-b).
+                dirty = True
+        # The fingerprint was taken before the check, so any change during the check is detected next time.
+        self.dirty_state[local_path] = {"fingerprint": fingerprint, "skipped": skipped, "ignored": ignored,
+                                        "dirty": dirty}
+        self.dirty_state_changed = True
+
+    def handle_changed_status_result(self, command):
+        """ Handler for a dirty check that is also the git status of a changed repo (see check_dirty). Records the
+        result, and prints the status (as a generic command result) without the ignored entries, which were only
+        requested for the check.
+        """
+        import locale
+        self.handle_dirty_check_result(command)
+        null_terminated, command.client_data = command.client_data[3:]
+        output = command.result_output.getvalue() if command.result_output is not None else ""
+        terminator = "\n"
+        if command.result_code == 0:
+            terminator = "\0" if null_terminated else "\n"
+            output = "".join(entry + terminator for entry in self.get_status_entries(output, null_terminated)
+                             if not entry.startswith("!! "))
+        # Otherwise unexpected output, e.g. errors, which is kept as is.
+        if command.result_output is not None:
+            command.result_output.close()
+            command.result_output = None
+        if self.args.stream_output:
+            # Each entry is streamed as a line of its own (NUL-terminated with -z, like the entries of git status).
+            lines = output.split(terminator)
+            if lines[-1] == "":
+                lines.pop()
+            for line in lines:
+                self.handle_command_output(command, line + terminator)
+            return
+        command.result_output = CommandOutput()
+        command.result_output.write(output.encode(locale.getpreferredencoding(False), errors="replace"))
+        self.handle_generic_command_result(command)
+
+    def get_estimated_durations(self, stats_key: str):
+        """ Returns the estimated duration of each job (by name) with the stats key, based on the median of the
+        recorded durations. Returns an empty dict if there is no history at all.
+        """
+        import statistics
+        return {name: statistics.median(durations)
+                for name, durations in self.job_stats.get(stats_key, {}).items() if len(durations) > 0}
+
+    def schedule_jobs(self):
+        """ Order the queued jobs according to the --schedule option:
+        manifest: Manifest order (i.e. queued order).
+        longest-first: Jobs with the longest estimated duration (see get_estimated_durations) first. This minimizes
+            the total time when executing jobs in parallel; a long job is not started last. Jobs without history
+            are estimated to take the median of the estimated durations (of other jobs with the same stats key).
+        auto: longest-first when executing jobs in parallel, else manifest.
+        With --dynamic-jobs, the estimated duration of each job with history is also set (see JobLimitController).
+        With --straggler-factor (not 0), the straggler time of each job with history is also set, see
+        Job.report_straggler.
+        """
+        schedule = self.args.schedule
+        if schedule == "auto":
+            schedule = "longest-first" if self.args.parallel_jobs > 1 else "manifest"
+        longest_first = schedule == "longest-first" and len(self.jobs) > 1
+        if (not longest_first and not self.args.dynamic_jobs and self.args.straggler_factor == 0) or \
+                len(self.jobs) == 0:
+            return
+        import statistics
+        self.load_job_stats()
+        estimates = {}   # Per stats key.
+        default_estimates = {}
+        for stats_key in set(job.stats_key for job in self.jobs if job.stats_key is not None):
+            estimates[stats_key] = self.get_estimated_durations(stats_key)
+            if len(estimates[stats_key]) > 0:
+                default_estimates[stats_key] = statistics.median(estimates[stats_key].values())
+        for job in self.jobs:
+            if job.stats_key is not None:
+                job.estimated_duration = estimates[job.stats_key].get(job.name)
+            if job.estimated_duration is not None and self.args.straggler_factor > 0:
+                job.straggler_time = max(job.estimated_duration * self.args.straggler_factor,
+                                         job.estimated_duration + STRAGGLER_MIN_EXCESS)
+        if not longest_first:
+            return
+
+        def get_estimated_duration(job):
+            if job.stats_key is None:
+                return 0.0
+            return estimates[job.stats_key].get(job.name, default_estimates.get(job.stats_key, 0.0))
+
+        # The sort is stable, so jobs with the same estimate (e.g. without any history) keep manifest order.
+        self.jobs.sort(key=get_estimated_duration, reverse=True)
+        logger.debug("Scheduled jobs longest-first.")
+
+    def handle_job_limit_change(self, old_limit: int, new_limit: int, reason: str):
+        """ Handler for changes of the number of parallel jobs (--dynamic-jobs); logs the change. """
+        import json
+        message = "Parallel jobs changed from " + str(old_limit) + " to " + str(new_limit) + ": " + reason
+        if self.args.verbose > 0:
+            print(message)
+        if self.log_file_stream is not None and self.args.log_format == "jsonl":
+            record = {"event": "job-limit", "time": round(time.time(), 3), "from": old_limit, "to": new_limit,
+                      "reason": reason}
+            self.log_file_stream.write(json.dumps(record) + "\n")
+        elif self.log_file_stream is not None:
+            self.log_file_stream.write(time.strftime("%Y%m%d %H:%M:%S") + " " + message + "\n")
+
+    def write_log_header(self, command):
+        """ Write the header of the output of a command to the log file (text format). """
+        self.log_file_stream.write("-" * 80 + "\n")
+        self.log_file_stream.write("- " + command.command_line + "\n")
+        self.log_file_stream.write("-" * 80 + "\n")
 
     def handle_job_result(self, job):
         """ Handles the command result. This consists of logging the details in the log file.
+        Returns False if no further jobs shall be started, i.e. if an error occurred and not in force mode.
         """
+        import json
         logger.debug("Handle job result.")
-        for command in job:
+        for command in job.commands:
             if command.result_handler is not None:
                 # First, call dedicated result handler for additional processing.
                 command.result_handler(command)
-            if self.log_file_stream is not None:
-                self.log_file_stream.write("-" * 80 + "\n")
-                self.log_file_stream.write("- " + command.command_line + "\n")
-                self.log_file_stream.write("-" * 80 + "\n")
+            if self.log_file_stream is not None and self.args.log_format == "jsonl":
+                if command.start_time is None:
+                    continue   # Not executed, since a previous command in the job failed.
+                record = {"repo": job.name}
+                record.update(command.todict())
+                self.log_file_stream.write(json.dumps(record) + "\n")
+            elif self.log_file_stream is not None:
+                if command not in self.log_headed_commands:
+                    self.write_log_header(command)
+                self.log_headed_commands.discard(command)
                 if command.result_output is not None:
-                    self.log_file_stream.write(command.result_output)
+                    command.result_output.write_to(self.log_file_stream)
+                if command.timed_out:
+                    self.log_file_stream.write("Timed out after " + str(command.timeout) + " s.\n")
             if command.result_code != 0 and not self.args.force_mode:
                 # When not in force mode, exit at first error.
-                # NOTE: There might be other successfully completed commands (or entire jobs) which are
-                # still in the result queue and consequently will not be logged.
-                # However, each error when running any command is always printed (by the command executor).
-                self.exit_commands()
-                exit(command.result_code)
+                # NOTE: There might be other jobs which are still running and consequently will not be logged.
+                # However, each error when running any command is always printed (by the command itself).
+                self.exit_code = command.result_code
+                return False
+        return True
 
     def get_target_repos(self, groups=None):
-        """ Get all repos in a list, which is the target of the command. Each item is an instance of Repository.
-        groups is a string of comma-separated list of groups (as specified by the --group option.)
+        """ Get all repos in a list (in manifest order), which is the target of the command.
+        Each item is an instance of Repository.
+        groups is a group expression string (as specified by the --groups option), see GroupExpression.
+        In its simplest form, this is a comma-separated list of groups.
+        Raises ValueError if the group expression is invalid.
         """
         if groups is None:
             target_repos = self.get_repos()
         else:
-            target_repos = []
-            args_groups = groups.split(",")
-            for repo in self.get_repos():
-                repo_groups = repo.get_optional_setting("groups")  # This is a list of strings.
-                if repo_groups is not None:
-                    if isinstance(repo_groups, str):   # Allow a string instead of a list for a single group.
-                        repo_groups = [repo_groups]    # Convert to a list.
-                    for group in args_groups:
-                        if group in repo_groups:
-                            target_repos.append(repo)
-                            break    # Must break to avoid adding same repo more than once.
+            group_index = self.get_group_index()
+            repo_names = GroupExpression(groups).evaluate(group_index, self.repos.keys())
+            target_repos = [self.repos[repo_name]
+                            for repo_name in sorted(repo_names, key=self.repo_positions.__getitem__)]
         return target_repos
 
     def do_clone(self, args):
         """ Performs git clone on all repos. """
+        import argparse
         clone_parser = argparse.ArgumentParser()
         # Mirror options can only be specified as clone command options (not in manifest).
         clone_parser.add_argument("--reference", action="store", dest="reference", default=None)
+        clone_parser.add_argument("--cache", action="store", dest="cache", default=None)
         clone_parser.add_argument("--dissociate", action="store_true", dest="dissociate")
         clone_parser.add_argument("--bare", action="store_true", dest="bare")
         clone_parser.add_argument("--mirror", action="store_true", dest="mirror")
         # Some default settings if not specified in the manifest.
         clone_parser.add_argument("--single-branch", action="store", dest="single_branch", default=None)
         clone_parser.add_argument("--depth", action="store", dest="depth", type=int, default=None)
+        clone_parser.add_argument("--filter", action="store", dest="filter", default=None)
+        clone_parser.add_argument("--sparse-paths", nargs="+", dest="sparse_paths", default=None)
         # No post run is used to disable executing the "run-after-clone" commands in the manifest.
         clone_parser.add_argument("--no-post-run", action="store_true", dest="no_post_run")
         # Parse the clone args.
         clone_args = clone_parser.parse_args(args.args)   # Parse args after clone.
         self.set_args(args)
         self.prepare_for_commands()
+        missing_references = []   # Names of the repos cloned without (some) reference.
         for repo in self.get_target_repos(args.groups):
-            job = []
             # Determine the local path first, since it is needed for additional commands in the git.
             local_path = repo.get_local_path()
             if os.path.exists(local_path):
@@ -671,13 +2556,12 @@ class Manifest(object):
                 if args.verbose > 0:
                     print("Skipping " + repo.get_repo() + " since directory already exist.")
                 continue
-            cd_cmd_line = "cd " + local_path + " && "
             # First, clone the repository.
-            cmd_line = "git clone"   # Add --progress to include progress info in the log file (note: one line each!)
+            cmd_args = ["git", "clone"]   # Add --progress to include progress info in the log file (one line each!)
             remote_name = self.get_optional_setting(repo, "remote-name", "origin")
             if remote_name != "origin" and not clone_args.bare and not clone_args.mirror:
                 # bare/mirror and origin are incompatible.
-                cmd_line += " --origin " + remote_name
+                cmd_args += ["--origin", remote_name]
             tag = repo.get_optional_setting("tag")   # Tag can only be in repo.
             if tag is None:
                 # Branch.
@@ -685,96 +2569,253 @@ class Manifest(object):
                 if remote_branch is None:
                     # If a different remote branch is not specified, checkout branch directly in clone command.
                     # Remote branch is also tracked.
-                    cmd_line += " --branch " + self.get_mandatory_setting(repo, "branch")
+                    cmd_args += ["--branch", self.get_mandatory_setting(repo, "branch")]
                 single_branch = self.get_optional_setting(repo, "single-branch", clone_args.single_branch)
                 if single_branch == "yes":
-                    cmd_line += " --single-branch"
+                    cmd_args.append("--single-branch")
                 elif single_branch == "no":
-                    cmd_line += " --no-single-branch"
+                    cmd_args.append("--no-single-branch")
             depth = self.get_optional_setting(repo, "depth", clone_args.depth)
             if depth is not None:
-                cmd_line += " --depth " + str(depth)
+                cmd_args += ["--depth", str(depth)]
+            # Partial clone, e.g. blob:none (blobs are fetched on demand) or tree:0.
+            clone_filter = self.get_optional_setting(repo, "filter", clone_args.filter)
+            if clone_filter is not None:
+                cmd_args.append("--filter=" + clone_filter)
+            sparse_paths = None
+            if not clone_args.bare and not clone_args.mirror:
+                sparse_paths = self.get_optional_setting(repo, "sparse-paths", clone_args.sparse_paths)
+                if isinstance(sparse_paths, str):   # Allow a string instead of a list for a single path.
+                    sparse_paths = [sparse_paths]
+                if sparse_paths is not None:
+                    # Initially, only the files in the root directory are checked out.
+                    cmd_args.append("--sparse")
+            remote_url = self.get_mandatory_setting(repo, "remote-url")
+            reference_paths = []
             if clone_args.reference is not None:
                 # The reference argument must refer to the root of the other project.
-                # TODO: Later git versions support --reference-if-able. This is better, if available.
-                cmd_line += " --reference " + os.path.join(clone_args.reference, local_path)
+                reference_paths.append(os.path.join(clone_args.reference, local_path))
+            if clone_args.cache is not None:
+                # Borrow objects from the mirror in the cache (see do_cache).
+                reference_paths.append(get_mirror_path(clone_args.cache, remote_url, repo.get_repo()))
+            for reference_path in reference_paths:
+                # Repos missing in the other project or cache are cloned without reference (instead of failing).
+                if not os.path.isdir(reference_path):
+                    missing_references.append(repo.get_repo())
+                cmd_args += ["--reference-if-able", reference_path]
             if clone_args.dissociate:
-                cmd_line += " --dissociate"
+                cmd_args.append("--dissociate")
             if clone_args.bare:
-                cmd_line += " --bare"
+                cmd_args.append("--bare")
             if clone_args.mirror:
-                cmd_line += " --mirror"
-            cmd_line += " " + self.get_mandatory_setting(repo, "remote-url") + "/" + repo.get_repo() + ".git"
-            cmd_line += " " + local_path
+                cmd_args.append("--mirror")
+            cmd_args.append(remote_url + "/" + repo.get_repo() + ".git")
+            cmd_args.append(local_path)
+            job = self.new_job(repo, "clone", remote_url)
+            job.partial_path = local_path   # Didn't exist, see above.
+            command = Command(cmd_args, None, "Completed " + repo.get_repo())
             if args.verbose > 0:
-                init_display_line = "Started to clone " + repo.get_repo() + " (" + cmd_line + ")"
+                command.init_display_line = "Started to clone " + repo.get_repo() + " (" + command.command_line + ")"
             else:
-                init_display_line = "Started to clone " + repo.get_repo()
-            job.append(Command(cmd_line,
-                               init_display_line,
-                               "Completed " + repo.get_repo()))
+                command.init_display_line = "Started to clone " + repo.get_repo()
+            job.commands.append(command)
+            if sparse_paths is not None:
+                # Check out the directories (cone patterns) before any other branch or tag is checked out below.
+                job.commands.append(Command(["git", "sparse-checkout", "set", "--cone", "--"] + sparse_paths,
+                                            cwd=local_path))
             if not clone_args.bare and not clone_args.mirror:
                 # Next, configure the git, if needed.
                 remote_push_url = self.get_optional_setting(repo, "remote-push-url")
                 if remote_push_url is not None:
                     # Add a different push URL.
-                    cmd_line = cd_cmd_line + "git remote set-url --add --push " + remote_name\
-                               + " " + remote_push_url + "/" + repo.get_repo() + ".git"
-                    job.append(Command(cmd_line))
+                    cmd_args = ["git", "remote", "set-url", "--add", "--push", remote_name,
+                                remote_push_url + "/" + repo.get_repo() + ".git"]
+                    job.commands.append(Command(cmd_args, cwd=local_path))
                     # Finally, checkout the branch, if needed.
                 if tag is not None:
                     # Tag name or commit (SHA-1). Just check it out; create no branch.
-                    cmd_line = cd_cmd_line + "git checkout " + tag
-                    job.append(Command(cmd_line))
+                    job.commands.append(Command(["git", "checkout", tag], cwd=local_path))
                 elif remote_branch is not None:
                     # Must use capital -B to force create the branch; needed for example for master,
                     # which is already created by clone above.
-                    cmd_line = cd_cmd_line + "git checkout -B " + self.get_mandatory_setting(repo, "branch")\
-                               + " " + remote_name + "/" + remote_branch
-                    job.append(Command(cmd_line))
+                    cmd_args = ["git", "checkout", "-B", self.get_mandatory_setting(repo, "branch"),
+                                remote_name + "/" + remote_branch]
+                    job.commands.append(Command(cmd_args, cwd=local_path))
+            self.stream_job_output(job, local_path)
             self.queue_job(job)
+        if len(missing_references) > 0:
+            print("Warning: " + str(len(missing_references)) + " repositories are missing in the reference project or "
+                  "cache, and are cloned without reference: " + ", ".join(sorted(set(missing_references))))
         # All commands queued up. Gather all remaining results and then cleanup and exit.
         self.finish_commands()
         if not clone_args.no_post_run:
             # Last, execute any bash commands - always in sequence.
             for cmd_line in self.get_run_after_clone_commands():
-                # The command line may include single-quotes, but not double-quotes.
-                command = Command('bash -c "' + cmd_line + '"')
+                command = Command(["bash", "-c", cmd_line])
                 command.execute()
                 if command.result_output is not None:
-                    print(command.result_output, end="")   # NL already included in result output.
+                    command.result_output.write_to(sys.stdout)   # NL already included in result output.
+
+    def do_cache(self, args):
+        """ Manages a mirror cache: a directory with one bare mirror per remote repository, which can be shared
+        by any number of projects (see --cache option of clone). The update sub-command clones any missing
+        mirrors and fetches the latest changes into existing ones.
+        A missing mirror is cloned into a partial path, which is renamed to the mirror path when completed, so an
+        interrupted or failed clone never leaves an incomplete mirror (see handle_mirror_clone_result).
+        """
+        import shutil
+        import argparse
+        cache_parser = argparse.ArgumentParser(prog="grit cache")
+        cache_parser.add_argument("subcommand", choices=["update"])
+        cache_parser.add_argument("cache_directory")
+        cache_args = cache_parser.parse_args(args.args)   # Parse args after cache.
+        self.set_args(args)
+        self.prepare_for_commands()
+        mirror_paths = set()
+        for repo in self.get_target_repos(args.groups):
+            remote_url = self.get_mandatory_setting(repo, "remote-url")
+            mirror_path = get_mirror_path(cache_args.cache_directory, remote_url, repo.get_repo())
+            if mirror_path in mirror_paths:
+                continue   # Same remote repository as a previous one (e.g. checked out twice).
+            mirror_paths.add(mirror_path)
+            job = self.new_job(repo, "cache update", remote_url)
+            if os.path.exists(mirror_path):
+                command = Command(["git", "remote", "update", "--prune"], "Started to update mirror of "
+                                  + repo.get_repo(), "Completed " + repo.get_repo(), cwd=mirror_path)
+            else:
+                partial_path = mirror_path + MIRROR_PARTIAL_SUFFIX
+                if os.path.lexists(partial_path):
+                    # Left by a previous update that was killed before it could clean up.
+                    shutil.rmtree(partial_path, ignore_errors=True)
+                command = Command(["git", "clone", "--mirror", remote_url + "/" + repo.get_repo() + ".git",
+                                   partial_path], "Started to mirror " + repo.get_repo(),
+                                  "Completed " + repo.get_repo(), result_handler=self.handle_mirror_clone_result,
+                                  client_data=mirror_path)
+                job.partial_path = partial_path
+            if args.verbose > 0:
+                command.init_display_line += " (" + command.command_line + ")"
+            job.commands.append(command)
+            self.stream_job_output(job, mirror_path)
+            self.queue_job(job)
+        # All commands queued up. Gather all remaining results and then cleanup and exit.
+        self.finish_commands()
+
+    @staticmethod
+    def handle_mirror_clone_result(command):
+        """ Move a successfully cloned mirror from its partial path to the mirror path (command.client_data). """
+        if command.result_code == 0:
+            partial_path = command.command_args[-1]
+            try:
+                os.rename(partial_path, command.client_data)
+            except OSError as err:
+                # E.g. a concurrent update completed the same mirror first. That mirror is kept.
+                print("Failed to move mirror " + partial_path + " into place: " + str(err))
+
+    def stream_job_output(self, job: Job, output_prefix: str):
+        """ If streaming output is enabled (--stream), make all commands in the job stream their output lines,
+        prefixed by output_prefix (typically the local path).
+        """
+        if self.args.stream_output:
+            for command in job.commands:
+                command.output_handler = self.handle_command_output
+                command.output_prefix = output_prefix
+
+    def handle_command_output(self, command, line: str):
+        """ Handler for streamed command output lines (see stream_job_output).
+        All lines are written by the same thread, so lines from different commands never interleave.
+        """
+        line = command.output_prefix + ": " + line
+        sys.stdout.write(line)
+        sys.stdout.flush()
+        if self.log_file_stream is not None and self.args.log_format != "jsonl":
+            # The header is written before the first line, so the log has the same order as without streaming.
+            if command not in self.log_headed_commands:
+                self.write_log_header(command)
+                self.log_headed_commands.add(command)
+            self.log_file_stream.write(line)
 
     def handle_generic_command_result(self, command):
         """ Handler for generic command results. """
+        if command.output_handler is not None:
+            # The output has already been printed line by line (each one with the local path as prefix).
+            return
         print("-" * 80)
         print("- " + command.client_data)   # Contains repo name.
         if self.args.verbose > 0:
             print("- Command: " + command.command_line)
         print("-" * 80)
         if command.result_output is not None:
-            print(command.result_output, end="")    # NL already included in result output.
+            command.result_output.write_to(sys.stdout)   # NL already included in result output.
 
     def do_generic(self, args):
-        """ Performs a generic git command. Prints the output as is for each target repository. """
+        """ Performs a generic git command. Prints the output as is for each target repository.
+        "status --changed-only" skips the repos that are known to be clean, see check_dirty.
+        """
+        changed_only = args.command == "status" and "--changed-only" in args.args
+        if changed_only:
+            args.args = [arg for arg in args.args if arg != "--changed-only"]
         self.set_args(args)
-        self.prepare_for_commands()
+        # A read-only command has nothing to resume, so it keeps the journal of the last (e.g. failed) run.
+        self.prepare_for_commands(journal=args.command not in READ_ONLY_GIT_COMMANDS)
         for repo in self.get_target_repos(args.groups):
-            job = []
             # Determine the local path first, since it is needed for additional commands in the git.
             local_path = repo.get_local_path()
             client_data = local_path
             if args.verbose > 0:
                 client_data += " (remote repo: " + repo.get_repo() + ")"
-            cd_cmd_line = "cd " + local_path + " && "
+            remote_url = None
+            if args.command in REMOTE_GIT_COMMANDS:
+                # Accesses the remote host (normally). A push may use a different URL. If neither is set, the remote
+                # is configured in the git itself, so the host is unknown.
+                if args.command == "push":
+                    remote_url = self.get_optional_setting(repo, "remote-push-url")
+                if remote_url is None:
+                    remote_url = self.get_optional_setting(repo, "remote-url")
+            if remote_url is not None:
+                job = self.new_job(repo, args.command, remote_url)
+            else:
+                # No stats; local commands are typically fast, so there is little to gain from scheduling them.
+                job = self.new_job(repo)
             # Execute the git command with the specified arguments.
-            cmd_line = cd_cmd_line + "git " + args.command
-            cmd_line += " " + " ".join(args.args)
-            job.append(Command(cmd_line, None, None, False, args.verbose,
-                               self.handle_generic_command_result, client_data))
+            job.commands.append(Command(["git", args.command] + args.args, print_errors=False, verbose=args.verbose,
+                               result_handler=self.handle_generic_command_result, client_data=client_data,
+                               cwd=local_path))
+            self.stream_job_output(job, local_path)
+            if changed_only:
+                status_args = None
+                if set(args.args) <= set(CHECK_DIRTY_STATUS_ARGS) and not set(args.args) <= {"-b", "--branch"}:
+                    status_args = args.args   # Short or porcelain format; the check is also the status.
+                self.check_dirty(job, local_path, skip_clean=True, status_args=status_args)
             self.queue_job(job)
         # All commands queued up. Gather all remaining results and then cleanup and exit.
         self.finish_commands()
 
+    def do_dirty(self, args):
+        """ Prints the local path of each target repository that is dirty (has local changes). Only the repos that
+        may have changed since they were last checked are checked again (see check_dirty).
+        """
+        self.set_args(args)
+        self.prepare_for_commands(journal=False)   # Read-only, see do_generic.
+        local_paths = []
+        for repo in self.get_target_repos(args.groups):
+            local_path = repo.get_local_path()
+            local_paths.append(local_path)
+            job = self.new_job(repo)   # No stats, see do_generic.
+            self.check_dirty(job, local_path)
+            self.queue_job(job)
+        jobs = self.jobs
+        self.finish_commands()
+        checked_count = sum(1 for job in jobs if len(job.commands) > 0)
+        dirty_count = 0
+        for local_path in local_paths:
+            state = self.dirty_state.get(local_path)
+            if state is not None and state["dirty"]:
+                print(local_path)
+                dirty_count += 1
+        if args.verbose > 0:
+            print(str(dirty_count) + " of " + str(len(local_paths)) + " repositories are dirty ("
+                  + str(checked_count) + " checked by git).")
+
     def do_foreach(self, args):
         """ Performs a generic shell command for each target repository.
         Below environment variables are available to the shell/bash command:
@@ -786,38 +2827,116 @@ class Manifest(object):
         self.set_args(args)
         self.prepare_for_commands()
         for repo in self.get_target_repos(args.groups):
-            job = []
+            job = self.new_job(repo)   # No stats; the shell command may be anything.
             # Determine the local path first, since it is needed for additional commands in the git.
             local_path = repo.get_local_path()
             client_data = local_path
             if args.verbose > 0:
                 client_data += " (remote repo: " + repo.get_repo() + ")"
-            cd_cmd_line = "cd " + local_path + " && "
+            env = {"LOCAL_PATH": local_path,
+                   "REMOTE_REPO": repo.get_repo(),
+                   "REMOTE_NAME": self.get_optional_setting(repo, "remote-name", "origin"),
+                   "REMOTE_URL": self.get_mandatory_setting(repo, "remote-url")}
             # Execute the bash command with the specified arguments.
             # NOTE: The argument(s) much be quoted, otherwise environment variable expansion
             # happens before this script is invoked. Optimally, only a single quoted argument is provided.
-            cmd_line = cd_cmd_line + "LOCAL_PATH=" + local_path + " REMOTE_REPO=" + repo.get_repo()
-            cmd_line += " REMOTE_NAME=" + self.get_optional_setting(repo, "remote-name", "origin")
-            cmd_line += " REMOTE_URL=" + self.get_mandatory_setting(repo, "remote-url")
-            # By using bash -c, the environment variables are valid even if ;, |, && etc. are used.
-            cmd_line += " bash -c '" + " ".join(args.args) + "'"
-            job.append(Command(cmd_line, None, None, args.verbose,
-                               self.handle_generic_command_result, client_data))
+            job.commands.append(Command(["bash", "-c", " ".join(args.args)], verbose=args.verbose,
+                               result_handler=self.handle_generic_command_result, client_data=client_data,
+                               cwd=local_path, env=env))
+            self.stream_job_output(job, local_path)
             self.queue_job(job)
         # All commands queued up. Gather all remaining results and then cleanup and exit.
         self.finish_commands()
 
+    def do_stats(self, args):
+        """ Prints statistics based on the structured command log (--log-format jsonl): the slowest repositories,
+        the repositories with the highest failure rates, and the latency (p50/p95) per command.
+        """
+        import json
+        import argparse
+        stats_parser = argparse.ArgumentParser(prog="grit stats")
+        stats_parser.add_argument("--top", action="store", dest="top", type=int, default=10)
+        stats_parser.add_argument("--command", action="store", dest="command", default=None)
+        stats_args = stats_parser.parse_args(args.args)   # Parse args after stats.
+        target_repo_names = set(repo.get_repo() for repo in self.get_target_repos(args.groups))
+        repo_durations = {}   # Total duration per repo.
+        repo_runs = {}        # Number of commands per repo.
+        repo_failures = {}    # Number of failed commands per repo.
+        command_durations = {}   # All durations per command.
+        command_failures = {}    # Number of failed commands per command.
+        file_path = os.path.join(self.get_root_path(), GRIT_DIRECTORY, JSONL_LOG_FILE_NAME)
+        try:
+            file_stream = open(file_path, "r")
+        except FileNotFoundError:
+            print("No structured command log found (" + file_path + "); use --log-format jsonl to create it.")
+            return
+        with file_stream:
+            for line in file_stream:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.debug("Ignoring invalid record: " + line)   # E.g. partially written record.
+                    continue
+                repo_name = record.get("repo")
+                command = record.get("command")
+                duration = record.get("duration")
+                if repo_name not in target_repo_names or duration is None:
+                    continue
+                if stats_args.command is not None and command != stats_args.command:
+                    continue
+                failed = record.get("exit-code") != 0
+                repo_durations[repo_name] = repo_durations.get(repo_name, 0.0) + duration
+                repo_runs[repo_name] = repo_runs.get(repo_name, 0) + 1
+                repo_failures[repo_name] = repo_failures.get(repo_name, 0) + failed
+                command_durations.setdefault(command, []).append(duration)
+                command_failures[command] = command_failures.get(command, 0) + failed
+        if len(repo_runs) == 0:
+            print("No matching commands in the structured command log.")
+            return
+        print("Slowest repositories (total duration):")
+        print("{:>10}  {:>6}  {:>10}  {}".format("total [s]", "runs", "mean [s]", "repository"))
+        for repo_name in sorted(repo_durations, key=repo_durations.get, reverse=True)[:stats_args.top]:
+            print("{:>10.2f}  {:>6}  {:>10.3f}  {}".format(repo_durations[repo_name], repo_runs[repo_name],
+                                                           repo_durations[repo_name] / repo_runs[repo_name],
+                                                           repo_name))
+        failed_repo_names = [repo_name for repo_name in repo_failures if repo_failures[repo_name] > 0]
+        print()
+        if len(failed_repo_names) == 0:
+            print("No failed commands.")
+        else:
+            print("Highest failure rates:")
+            print("{:>10}  {:>6}  {:>10}  {}".format("failures", "runs", "rate", "repository"))
+            failed_repo_names.sort(key=lambda name: (repo_failures[name] / repo_runs[name], repo_failures[name]),
+                                   reverse=True)
+            for repo_name in failed_repo_names[:stats_args.top]:
+                print("{:>10}  {:>6}  {:>9.1f}%  {}".format(repo_failures[repo_name], repo_runs[repo_name],
+                                                            100.0 * repo_failures[repo_name] / repo_runs[repo_name],
+                                                            repo_name))
+        print()
+        print("Latency per command:")
+        print("{:>10}  {:>6}  {:>10}  {:>10}  {:>10}  {}".format("runs", "failed", "p50 [s]", "p95 [s]", "max [s]",
+                                                               "command"))
+        for command in sorted(command_durations):
+            durations = sorted(command_durations[command])
+            print("{:>10}  {:>6}  {:>10.3f}  {:>10.3f}  {:>10.3f}  {}".format(len(durations), command_failures[command],
+                                                                          get_percentile(durations, 50),
+                                                                          get_percentile(durations, 95),
+                                                                          durations[-1], command))
+
+    @staticmethod
+    def set_snapshot_ref(repo, head_ref: str):
+        """ Set the HEAD ref as tag in the repo (of the snapshot manifest). """
+        logger.debug("Snapshot for " + repo.get_repo() + ": " + head_ref)
+        repo.set_setting("tag", head_ref)
+        repo.remove_setting("branch")
+
     def handle_snapshot_command_result(self, command):
         """ Handler for snapshot command results. """
         repo = command.client_data
-        if command.result_output is not None:
-            head_ref = command.result_output[:-1]   # Remove trailing newline character.
-            logger.debug("Snapshot for " + repo.get_repo() + ": " + head_ref)
-            # Set the HEAD ref as tag in the repo.
-            repo.set_setting("tag", head_ref)
-            repo.remove_setting("branch")
-        # If result_output is None due to error, the error is handled by handle_job_result,
-        # so no action here.
+        if command.result_code == 0 and command.result_output is not None:
+            head_ref = command.result_output.getvalue()[:-1]   # Remove trailing newline character.
+            self.set_snapshot_ref(repo, head_ref)
+        # If the command failed, the error is handled by handle_job_result, so no action here.
 
     def do_snapshot(self, args):
         """ Creates a new snapshot manifest.
@@ -835,23 +2954,36 @@ class Manifest(object):
             snapshot_file = args.args[0]
         # Base the snapshot manifest on the active manifest.
         snapshot_manifest = Manifest()
-        snapshot_manifest.load_active_manifest()
+        snapshot_manifest.load_active_manifest(not args.no_cache)
         # Next, fill in the exact ref/commit for each repo.
         self.set_args(args)
-        self.prepare_for_commands()
+        # No journal, since the snapshot manifest always needs all repos (i.e. the snapshot can't be resumed).
+        self.prepare_for_commands(journal=False)
         for repo in snapshot_manifest.get_target_repos(groups=None):
-            job = []
-            # Determine the local path first, since it is needed for additional commands in the git.
-            cd_cmd_line = "cd " + repo.get_local_path() + " && "
-            cmd_line = cd_cmd_line + "git rev-parse HEAD"
-            job.append(Command(cmd_line, None, None, args.verbose,
-                               self.handle_snapshot_command_result, repo))   # repo as client data.
+            local_path = repo.get_local_path()
+            # Normally, HEAD is resolved by reading the refs directly (much faster than starting git).
+            head_ref = read_head_commit(local_path)
+            if head_ref is not None:
+                self.set_snapshot_ref(repo, head_ref)
+                continue
+            # Unusual layout (or an error); let git resolve HEAD.
+            logger.debug("Cannot read HEAD of " + local_path + " directly, using git rev-parse.")
+            job = self.new_job(repo)
+            job.commands.append(Command(["git", "rev-parse", "HEAD"], verbose=args.verbose,
+                                        result_handler=self.handle_snapshot_command_result,
+                                        client_data=repo, cwd=local_path))   # repo as client data.
             self.queue_job(job)
         # All commands queued up. Gather all remaining results and then cleanup and exit.
         self.finish_commands()
         snapshot_manifest.save(snapshot_file)
 
 
+def get_percentile(sorted_values: list, percent: float):
+    """ Returns the percentile of the (sorted, non-empty) values, using the nearest-rank method. """
+    rank = max(int(-(-len(sorted_values) * percent // 100)), 1)   # Rounded up.
+    return sorted_values[rank - 1]
+
+
 def json_config_object_hook(dct):
     if "method" in dct:
         fetch_manifest = FetchManifest()
@@ -862,11 +2994,16 @@ def json_config_object_hook(dct):
 
 class FetchManifest(Settings):
     """ Stores all settings related to a fetch of additional manifest(s). """
-    valid_keys = ["method", "remote-url", "repository", "directory", "branch"]
+    valid_keys = ["method", "remote-url", "repository", "directory", "branch", "tag"]
 
     def __init__(self):
         super().__init__(FetchManifest.valid_keys)
 
+    def get_local_path(self):
+        """ Returns the local path (relative to GRIT_DIRECTORY). """
+        directory = self.get_optional_setting("directory", self.get_mandatory_setting("repository"))
+        return os.path.join(*directory.split("/"))   # Convert to OS specific path.
+
 
 class Config(object):
     """ Store all settings related to a specific configuration. """
@@ -881,6 +3018,7 @@ class Config(object):
         that the .json file extension is to be omitted.
         Assumes that current working directory is the project root path.
         """
+        import json
         self.config_path = config_path
         path_parts = (config_path + ".json").split("/")
         file_path = os.path.join(GRIT_DIRECTORY, *path_parts)
@@ -895,33 +3033,129 @@ class Config(object):
         #     file_stream.write(config)
 
     def fetch_additional(self):
-        """ Fetch any additional manifests. """
+        """ Fetch any additional manifests, i.e. clone the ones that don't exist yet (in parallel). Existing ones are
+        left as is (see update). A manifest with a tag (or commit) is checked out as such, i.e. pinned.
+        """
+        jobs = []
         for fetch_manifest in self.get_fetch_manifests():
             if fetch_manifest.get_mandatory_setting("method") == "git":
                 repo = fetch_manifest.get_mandatory_setting("repository")
-                directory = fetch_manifest.get_optional_setting("directory", repo)   # Default to repo name.
-                directory_parts = directory.split("/")
-                local_path = os.path.join(*directory_parts)   # Convert to OS specific path.
+                local_path = fetch_manifest.get_local_path()
                 if os.path.exists(os.path.join(GRIT_DIRECTORY, local_path)):
                     # Local repo already exist, skip this one silently. For instance, if you update a config file,
                     # only new ones should be cloned.
                     logger.debug("Fetching additional manifests; ignoring " + local_path)
                     continue
-                cmd_line = "cd " + GRIT_DIRECTORY + " && git clone"
+                job = Job()
+                cmd_args = ["git", "clone"]
                 branch = fetch_manifest.get_optional_setting("branch")   # Optional.
-                if branch is not None:
-                    cmd_line += " --branch " + branch
-                cmd_line += " " + fetch_manifest.get_mandatory_setting("remote-url") + "/" + repo + ".git"
-                cmd_line += " " + local_path
-                command = Command(cmd_line, "Fetching additional manifest and config file(s) from " + repo + "...")
-                command.execute()
+                tag = fetch_manifest.get_optional_setting("tag")   # Optional; takes precedence over branch.
+                if branch is not None and tag is None:
+                    cmd_args += ["--branch", branch]
+                cmd_args.append(fetch_manifest.get_mandatory_setting("remote-url") + "/" + repo + ".git")
+                cmd_args.append(local_path)
+                job.commands.append(Command(cmd_args, "Fetching additional manifest and config file(s) from " + repo
+                                            + "...", cwd=GRIT_DIRECTORY))
+                if tag is not None:
+                    job.commands.append(Command(["git", "checkout", tag], cwd=os.path.join(GRIT_DIRECTORY,
+                                                                                            local_path)))
+                jobs.append(job)
             else:
-                raise ValueError("Method " + fetch_manifest["method"] + " is not supported.")
+                raise ValueError("Method " + fetch_manifest.get_mandatory_setting("method") + " is not supported.")
+        self.run_jobs(jobs)
 
-    def update(self):
-        """ Update all manifest gits. """
-        # TODO: fetch and rebase for branches, but skip for tags/commits, and re-download for ftp/http URLs.
-        pass
+    @staticmethod
+    def run_jobs(jobs: list, job_result_handler=None):
+        """ Execute the jobs (on manifest gits) in parallel. Errors are printed, but don't stop other jobs.
+        If a job result handler is provided, it's called for each completed job (see CommandEngine).
+        Returns the number of failed jobs.
+        """
+        def handle_job_result(job):
+            if job_result_handler is not None:
+                job_result_handler(job)
+            return True
+
+        command_engine = CommandEngine(MANIFEST_JOBS, handle_job_result)
+        command_engine.run(jobs)
+        if command_engine.cancelled is not None:
+            print("Interrupted.")
+            exit(128 + command_engine.cancelled)
+        return sum(1 for job in jobs if not job.is_successful())
+
+    @staticmethod
+    def get_manifest_gits():
+        """ Returns the local paths (relative to project root) of all manifest gits in GRIT_DIRECTORY, i.e. the ones
+        cloned by init (manifest URL) or as additional manifests.
+        """
+        local_paths = []
+        directories = [GRIT_DIRECTORY]
+        while len(directories) > 0:
+            directory = directories.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False) or entry.name == ".git":
+                        continue
+                    if os.path.lexists(os.path.join(entry.path, ".git")):
+                        local_paths.append(entry.path)
+                    else:
+                        directories.append(entry.path)
+        return sorted(local_paths)
+
+    def update(self, force_mode: bool=False):
+        """ Update all manifest gits, with as few round-trips as possible: first, the remote branch of each manifest
+        git is checked (ls-remote, in parallel). Then, only the ones that have moved are fetched and fast-forwarded
+        (in parallel). Manifest gits with a detached HEAD (i.e. a tag or commit is checked out) are pinned and
+        therefore skipped. Local changes are never overwritten; an update that is not a fast-forward fails.
+        If any manifest git could not be checked or updated, grit exits with 1 (after all are done), unless in
+        force mode.
+        """
+        check_jobs = []
+        for local_path in self.get_manifest_gits():
+            branch = read_head_branch(local_path)
+            if branch is None:
+                logger.debug("Skipping pinned manifest " + local_path)
+                continue
+            job = Job()
+            job.name = local_path
+            job.commands.append(Command(["git", "ls-remote", "origin", "refs/heads/" + branch], cwd=local_path,
+                                        client_data=branch))
+            check_jobs.append(job)
+        update_jobs = []
+        missing_branches = []
+
+        def handle_check_result(job):
+            command = job.commands[0]
+            if command.result_code != 0:
+                return   # Already printed.
+            local_path = job.name
+            branch = command.client_data
+            output = command.result_output.getvalue().split()
+            if len(output) == 0:
+                print("Remote branch " + branch + " of manifest " + local_path + " not found.")
+                missing_branches.append(local_path)
+                return
+            remote_commit = output[0]
+            git_dir = get_git_dir(local_path)
+            if read_git_ref(git_dir, "refs/remotes/origin/" + branch) != remote_commit:
+                cmd_args = ["git", "pull", "--ff-only", "origin", branch]
+            elif read_git_ref(git_dir, "HEAD") != remote_commit:
+                cmd_args = ["git", "merge", "--ff-only", "origin/" + branch]   # Fetched, but not merged.
+            else:
+                logger.debug("Manifest " + local_path + " is up-to-date.")
+                return
+            update_job = Job()
+            update_job.commands.append(Command(cmd_args, "Updating manifest " + local_path + "...",
+                                               "Updated manifest " + local_path, cwd=local_path))
+            update_jobs.append(update_job)
+
+        failed_count = self.run_jobs(check_jobs, handle_check_result) + len(missing_branches)
+        failed_count += self.run_jobs(update_jobs)
+        if failed_count > 0:
+            print(str(failed_count) + " manifest(s) could not be updated.")
+            if not force_mode:
+                exit(1)
+        elif len(update_jobs) == 0:
+            print("All manifests are up-to-date.")
 
     def get_manifest_layers(self):
         """ Returns a list of all manifest layers. """
@@ -931,23 +3165,117 @@ class Config(object):
         """ Returns a list of all fetch manifests instructions. """
         return self.config.get("fetch-manifests", [])   # Default to empty list.
 
-    def make_active_manifest(self):
-        """ Overlays the specified manifests. """
-        # First, create the final manifest.
-        self.active_manifest = None
+    def get_manifest_layer_paths(self):
+        """ Returns the path of each manifest layer within GRIT_DIRECTORY (without .json, see Manifest.load). """
+        layer_paths = []
         for manifest_path in self.get_manifest_layers():
-            manifest = Manifest()
             # The manifest path is always using "/", regardless of underlying OS.
             if manifest_path.startswith("/"):
                 # Path is from root of GRIT_DIRECTORY.
-                manifest.load(manifest_path[1:])   # Skip initial "/" since load assumes root of GRIT_DIRECTORY.
+                layer_paths.append(manifest_path[1:])   # Skip initial "/" since load assumes root of GRIT_DIRECTORY.
             else:
                 # Manifest path is relative from directory of config path.
                 last_separator_pos = self.config_path.rfind("/")
                 if last_separator_pos > 0:
-                    manifest.load(self.config_path[:last_separator_pos] + "/" + manifest_path)
+                    layer_paths.append(self.config_path[:last_separator_pos] + "/" + manifest_path)
                 else:
-                    manifest.load(manifest_path)
+                    layer_paths.append(manifest_path)
+        return layer_paths
+
+    def get_stamp(self):
+        """ Returns the stamp of the loaded config, which identifies everything the active manifest is generated from:
+        the config path, a content hash of the config file and each manifest layer (None if missing), and the HEAD
+        commit of each fetched manifest git.
+        """
+        import hashlib
+        stamp = {"version": ACTIVE_MANIFEST_STAMP_VERSION, "config": self.config_path, "files": {},
+                 "fetch-manifests": {}}
+        for path in [self.config_path] + self.get_manifest_layer_paths():
+            try:
+                with open(os.path.join(GRIT_DIRECTORY, *(path + ".json").split("/")), "rb") as file_stream:
+                    stamp["files"][path] = hashlib.sha1(file_stream.read()).hexdigest()
+            except OSError:
+                stamp["files"][path] = None
+        for fetch_manifest in self.get_fetch_manifests():
+            local_path = fetch_manifest.get_local_path()
+            stamp["fetch-manifests"][local_path] = read_head_commit(os.path.join(GRIT_DIRECTORY, local_path))
+        return stamp
+
+    @staticmethod
+    def get_active_manifest_hash():
+        """ Returns a content hash of the active manifest file, or None if missing. """
+        import hashlib
+        try:
+            with open(os.path.join(GRIT_DIRECTORY, ACTIVE_MANIFEST_FILE + ".json"), "rb") as file_stream:
+                return hashlib.sha1(file_stream.read()).hexdigest()
+        except OSError:
+            return None
+
+    @staticmethod
+    def load_stamp():
+        """ Returns the stamp saved when the active manifest was generated (see get_stamp), or None if missing. """
+        import json
+        try:
+            with open(os.path.join(GRIT_DIRECTORY, ACTIVE_MANIFEST_STAMP_FILE), "r") as file_stream:
+                return json.load(file_stream)
+        except (OSError, ValueError) as err:
+            logger.debug("No active manifest stamp loaded: " + str(err))
+            return None
+
+    def save_stamp(self, stamp: dict):
+        """ Save the stamp, together with a content hash of the (just generated) active manifest. """
+        import json
+        stamp["active-manifest"] = self.get_active_manifest_hash()
+        file_path = os.path.join(GRIT_DIRECTORY, ACTIVE_MANIFEST_STAMP_FILE)
+        with open(file_path + ".tmp", "w") as file_stream:
+            json.dump(stamp, file_stream, indent=4, sort_keys=True)
+        os.replace(file_path + ".tmp", file_path)
+
+    @staticmethod
+    def remove_stamp():
+        """ Remove the stamp, e.g. when the active manifest is not generated from a config. """
+        try:
+            os.remove(os.path.join(GRIT_DIRECTORY, ACTIVE_MANIFEST_STAMP_FILE))
+        except FileNotFoundError:
+            pass
+
+    def get_stale_reasons(self, stamp: dict):
+        """ Compares the stamp of the loaded config (see get_stamp) with the saved one. Returns a list of reasons why
+        the active manifest is stale (i.e. needs to be generated), or an empty list if it's up-to-date.
+        """
+        saved_stamp = self.load_stamp()
+        if saved_stamp is None:
+            return ["no stamp of a generated active manifest"]
+        reasons = []
+        if saved_stamp.get("version") != stamp["version"]:
+            reasons.append("generated by another grit version")
+        if saved_stamp.get("config") != stamp["config"]:
+            reasons.append("generated from another config (" + str(saved_stamp.get("config")) + ")")
+        else:
+            saved_files = saved_stamp.get("files", {})
+            for path, file_hash in stamp["files"].items():
+                if file_hash is None:
+                    reasons.append(path + ".json is missing")
+                elif saved_files.get(path) != file_hash:
+                    reasons.append(path + ".json is " + ("changed" if path in saved_files else "added"))
+            for path in saved_files:
+                if path not in stamp["files"]:
+                    reasons.append(path + ".json is removed")
+            saved_fetch_manifests = saved_stamp.get("fetch-manifests", {})
+            for local_path, commit in stamp["fetch-manifests"].items():
+                if commit is None or saved_fetch_manifests.get(local_path) != commit:
+                    reasons.append("fetched manifest " + local_path + " is changed")
+        if saved_stamp.get("active-manifest") != self.get_active_manifest_hash():
+            reasons.append("the active manifest is modified or missing")
+        return reasons
+
+    def make_active_manifest(self):
+        """ Overlays the specified manifests. """
+        # First, create the final manifest.
+        self.active_manifest = None
+        for manifest_path in self.get_manifest_layer_paths():
+            manifest = Manifest()
+            manifest.load(manifest_path)
             if self.active_manifest is None:
                 self.active_manifest = manifest
             else:
@@ -962,9 +3290,10 @@ class Config(object):
 
     def save_active_manifest(self):
         """ Save the final manifest to the file system. """
-        self.active_manifest.save(ACTIVE_MANIFEST_FILE)
+        self.active_manifest.save_active_manifest()
 
     def do_init(self, args):
+        import argparse
         init_parser = argparse.ArgumentParser()
         init_parser.add_argument("manifest_url", nargs="?", action="store", default=None)
         init_parser.add_argument("--branch", "-b", action="store", dest="branch", default=None)
@@ -972,53 +3301,367 @@ class Config(object):
         init_parser.add_argument("--config", "-c", action="store", dest="config", default=None)
         init_parser.add_argument("--manifest", "-m", action="store", dest="manifest", default=None)
         init_parser.add_argument("--update", "-u", action="store_true", dest="update", default=None)
+        init_parser.add_argument("--check", action="store_true", dest="check")
         init_args = init_parser.parse_args(args.args)   # Parse args after init.
+        config_path = init_args.config
+        if config_path is None and init_args.manifest is None and (init_args.update or init_args.check):
+            # Use the same config as last time (if any).
+            stamp = self.load_stamp()
+            if stamp is not None:
+                config_path = stamp.get("config")
+        if init_args.check:
+            self.check(config_path)
+            return
         if init_args.update:
             # Update all manifest gits first.
             print("Updating all manifest and config file(s)...")
-            self.update()
+            self.update(args.force_mode)
         # Fetch initial/additional manifest and config file(s), if specified.
         if init_args.manifest_url is not None:
-            if not os.path.exists(GRIT_DIRECTORY):
-                # Create grit directory if it doesn't exist (=first time).
-                cmd_line = "mkdir " + GRIT_DIRECTORY
-                command = Command(cmd_line)
-                command.execute()
-            cmd_line = "cd " + GRIT_DIRECTORY + " && git clone"
+            # Create grit directory if it doesn't exist (=first time).
+            os.makedirs(GRIT_DIRECTORY, exist_ok=True)
+            cmd_args = ["git", "clone"]
             if init_args.branch is not None:
-                cmd_line += " --branch " + init_args.branch
-            cmd_line += " " + init_args.manifest_url   # Remote URL and repository (including .git).
+                cmd_args += ["--branch", init_args.branch]
+            cmd_args.append(init_args.manifest_url)   # Remote URL and repository (including .git).
             if init_args.directory is not None:
-                cmd_line += " " + init_args.directory   # TODO: Convert to OS specific path?
-            command = Command(cmd_line, "Fetching specified manifest and config file(s)...")
+                cmd_args.append(init_args.directory)   # TODO: Convert to OS specific path?
+            command = Command(cmd_args, "Fetching specified manifest and config file(s)...", cwd=GRIT_DIRECTORY)
             command.execute()
         # Load and activate a config if specified.
-        if init_args.config is not None:
-            print("Loading config " + init_args.config + ".")
-            self.load(init_args.config)
+        if config_path is not None:
+            print("Loading config " + config_path + ".")
+            self.load(config_path)
             self.fetch_additional()
+            stamp = self.get_stamp()
+            reasons = self.get_stale_reasons(stamp)
+            if len(reasons) == 0:
+                print("Active manifest is up-to-date.")
+                return
+            logger.debug("Active manifest is stale: " + ", ".join(reasons))
             self.make_active_manifest()
             self.save_active_manifest()
+            self.save_stamp(stamp)
             print("Generated active manifest.")
         elif init_args.manifest is not None:
             print("Loading manifest " + init_args.manifest + ".")
             manifest = Manifest()
             manifest.load(init_args.manifest)
+            self.remove_stamp()
             manifest.save_active_manifest()
             print("Saved as active manifest.")
 
+    def check(self, config_path: str):
+        """ Check if the active manifest is up-to-date with the config (and its manifest layers), without fetching
+        or generating anything. Exits with 1 if stale.
+        """
+        if config_path is None:
+            print("The active manifest is not generated from a config; specify one with --config.")
+            exit(1)
+        self.load(config_path)
+        reasons = self.get_stale_reasons(self.get_stamp())
+        if len(reasons) > 0:
+            print("Active manifest is stale (config " + config_path + "):")
+            for reason in reasons:
+                print("  " + reason)
+            exit(1)
+        print("Active manifest is up-to-date (config " + config_path + ").")
+
+
+def encode_frame(kind: bytes, data: bytes=b""):
+    """ Encode a frame sent over the socket of a grit daemon: kind (1 byte), length of data (4 bytes) and data.
+    Client to daemon: b"d" working directory, b"a" argument, b"v" environment variable (key=value), b"r" run and
+    (while running) b"c" cancel, with the number of the signal that interrupted the client.
+    Daemon to client: b"o" stdout output, b"e" stderr output and b"x" exit code (last frame).
+    """
+    return kind + len(data).to_bytes(4, "big") + data
+
+
+def receive_frame(stream):
+    """ Receive a frame (see encode_frame) from a (buffered) socket stream.
+    Returns a tuple of the kind and data, or (None, None) if the connection is closed.
+    """
+    header = stream.read(5)
+    if len(header) < 5:
+        return None, None
+    length = int.from_bytes(header[1:], "big")
+    data = stream.read(length)
+    if len(data) < length:
+        return None, None
+    return header[:1], data
+
+
+class DaemonOutput(io.TextIOBase):
+    """ Text stream that sends everything written to it to a grit daemon client, as frames of the given kind.
+    Replaces sys.stdout and sys.stderr while the daemon executes a command.
+    """
+    encoding = "utf-8"
+
+    def __init__(self, connection, kind: bytes):
+        self.connection = connection
+        self.kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, text: str):
+        if text != "":
+            self.connection.sendall(encode_frame(self.kind, text.encode(errors="surrogateescape")))
+        return len(text)
+
+
+def run_in_daemon(command_args: list):
+    """ Run the command in the grit daemon of the project, if one is running (see GritDaemon).
+    The working directory and environment are passed to the daemon, and the output is printed as it arrives.
+    On SIGINT or SIGTERM, the daemon is requested to cancel the command, like the signal would when executing it
+    in this process (and the exit code is the same).
+    Returns the exit code, or None if no daemon is running.
+    """
+    try:
+        socket_path = os.path.join(Manifest.get_root_path(), GRIT_DIRECTORY, DAEMON_SOCKET_FILE)
+    except RuntimeError:
+        return None
+    if not os.path.exists(socket_path):
+        return None
+    import socket
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError as err:
+        # The daemon was killed, leaving the socket file behind. It's removed when a daemon is started again.
+        logger.debug("No grit daemon running: " + str(err))
+        connection.close()
+        return None
+    import signal
+
+    def forward_signal(signal_number, frame):
+        try:
+            connection.sendall(encode_frame(b"c", str(signal_number).encode()))
+        except OSError:
+            pass   # The daemon has gone, which is detected when receiving.
+
+    previous_handlers = {}
+    with connection:
+        request = [encode_frame(b"d", os.fsencode(os.getcwd()))]
+        request += [encode_frame(b"a", os.fsencode(arg)) for arg in command_args]
+        request += [encode_frame(b"v", key + b"=" + value) for key, value in os.environb.items()]
+        request.append(encode_frame(b"r"))
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            previous_handlers[signal_number] = signal.signal(signal_number, forward_signal)
+        try:
+            connection.sendall(b"".join(request))
+            stream = connection.makefile("rb")
+            while True:
+                kind, data = receive_frame(stream)
+                if kind == b"o" or kind == b"e":
+                    output_stream = sys.stdout if kind == b"o" else sys.stderr
+                    output_stream.flush()
+                    output_stream.buffer.write(data)
+                    output_stream.buffer.flush()
+                elif kind == b"x":
+                    return int(data)
+                elif kind is None:
+                    print("Lost connection to the grit daemon.", file=sys.stderr)
+                    return 1
+        finally:
+            for signal_number, handler in previous_handlers.items():
+                signal.signal(signal_number, handler)
+
+
+class GritDaemon(object):
+    """ Executes grit commands received over a Unix domain socket in GRIT_DIRECTORY (see run_in_daemon), one at a
+    time. Between the commands, the active manifest (incl. resolved settings), all imported modules and an event
+    loop for parallel jobs are kept, so a command starts almost as fast as its git commands.
+    The active manifest is reloaded automatically when it is changed (e.g. by grit init).
+    If the client is interrupted (or has gone), the command is cancelled (see CommandEngine.cancel_current).
+    The commands have no terminal, so git is not allowed to prompt for credentials (unless the client environment
+    sets GIT_TERMINAL_PROMPT), and they are executed in their own process groups.
+    """
+
+    def __init__(self, grit):
+        self.grit = grit
+        self.root_path = Manifest.get_root_path()
+        self.socket_path = os.path.join(self.root_path, GRIT_DIRECTORY, DAEMON_SOCKET_FILE)
+        self.stopped = False
+
+    def serve(self):
+        """ Serve commands until stopped (by grit daemon stop, or Ctrl-C). """
+        import asyncio
+        import socket
+        import threading
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise RuntimeError("A grit daemon is already running (" + self.socket_path + ").")
+            except OSError:
+                os.remove(self.socket_path)   # Left by a daemon that was killed.
+            finally:
+                probe.close()
+        event_loop = asyncio.new_event_loop()
+        threading.Thread(target=event_loop.run_forever, name="grit-event-loop", daemon=True).start()
+        event_loop.call_soon_threadsafe(use_pidfd_child_watcher)
+        CommandEngine.event_loop = event_loop
+        CommandEngine.cancel_lock = threading.Lock()
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # Only the owner may connect, since the daemon executes any command (e.g. foreach) as the owner.
+            previous_umask = os.umask(0o077)
+            try:
+                server.bind(self.socket_path)
+            finally:
+                os.umask(previous_umask)
+            os.chmod(self.socket_path, 0o600)
+            server.listen()
+            print("grit daemon listening on " + self.socket_path)
+            sys.stdout.flush()
+            while not self.stopped:
+                connection, _ = server.accept()
+                with connection:
+                    if self.is_owner(connection):
+                        self.handle_connection(connection)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            CommandEngine.event_loop = None
+            CommandEngine.cancel_lock = None
+            event_loop.call_soon_threadsafe(event_loop.stop)
+        print("grit daemon stopped.")
+
+    @staticmethod
+    def is_owner(connection):
+        """ Returns True if the client (peer) process of the connection is run by the same user as the daemon. """
+        import socket
+        import struct
+        if not hasattr(socket, "SO_PEERCRED"):
+            return True   # Not supported by the OS (e.g. macOS), so only the permissions of the socket file apply.
+        credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", credentials)
+        if uid != os.getuid():
+            print("Rejected a connection from user " + str(uid) + ".")
+            sys.stdout.flush()
+            return False
+        return True
+
+    def handle_connection(self, connection):
+        """ Receive a command from the client, execute it and send the output and exit code back. """
+        stream = connection.makefile("rb")
+        cwd = self.root_path
+        command_args = []
+        env = {}
+        while True:
+            kind, data = receive_frame(stream)
+            if kind is None:
+                return   # The client has gone.
+            if kind == b"d":
+                cwd = os.fsdecode(data)
+            elif kind == b"a":
+                command_args.append(os.fsdecode(data))
+            elif kind == b"v":
+                key, _, value = data.partition(b"=")
+                env[key] = value
+            elif kind == b"r":
+                break
+        import threading
+        done = threading.Event()
+        threading.Thread(target=self.receive_cancel, args=(stream, done), name="grit-cancel", daemon=True).start()
+        exit_code = self.execute(connection, cwd, command_args, env)
+        done.set()
+        try:
+            connection.sendall(encode_frame(b"x", str(exit_code).encode()))
+        except OSError:
+            pass   # The client has gone.
+
+    def receive_cancel(self, stream, done):
+        """ Receive cancel frames from the client while its command is executed (until done is set). """
+        import signal
+        while True:
+            try:
+                kind, data = receive_frame(stream)
+            except OSError:
+                kind, data = None, None
+            if done.is_set():
+                return
+            if kind is None:
+                # The client has gone (e.g. killed), so there is no one to complete the command for.
+                CommandEngine.cancel_current(signal.SIGTERM)
+                return
+            if kind == b"c":
+                logger.debug("Client interrupted by signal " + data.decode() + ".")
+                CommandEngine.cancel_current(int(data))
+
+    def execute(self, connection, cwd: str, command_args: list, env: dict):
+        """ Execute the command in the working directory and environment of the client, with stdout and stderr
+        redirected to the client. Returns the exit code.
+        """
+        saved_env = dict(os.environb)
+        saved_stdin = sys.stdin
+        saved_stdout = sys.stdout
+        saved_stderr = sys.stderr
+        sys.stdin = None   # Not the terminal of the client, so each command gets its own session (see Command).
+        sys.stdout = DaemonOutput(connection, b"o")
+        sys.stderr = DaemonOutput(connection, b"e")
+        timing.reset("request received")
+        logger.disable_debug()
+        exit_code = 0
+        try:
+            os.environb.clear()
+            os.environb.update(env)
+            os.environb.setdefault(b"GIT_TERMINAL_PROMPT", b"0")
+            os.chdir(cwd)
+            self.grit.run_command(command_args)
+        except SystemExit as err:
+            if isinstance(err.code, int):
+                exit_code = err.code
+            elif err.code is not None:
+                print(err.code, file=sys.stderr)
+                exit_code = 1
+        except Exception:
+            import traceback
+            exit_code = 1
+            try:
+                traceback.print_exc()
+            except OSError:
+                pass   # The client has gone.
+        finally:
+            try:
+                if timing.enabled:
+                    timing.print_report()
+            except OSError:
+                pass
+            sys.stdin = saved_stdin
+            sys.stdout = saved_stdout
+            sys.stderr = saved_stderr
+            with CommandEngine.cancel_lock:
+                CommandEngine.cancel_requested = None
+            os.chdir(self.root_path)
+            os.environb.clear()
+            os.environb.update(saved_env)
+        return exit_code
+
 
 class Grit(object):
     """ Main grit class for executing commands. """
 
     def __init__(self):
         self.aliases = None
-        self.load_aliases()
+        self.aliases_loaded = False   # Aliases are loaded when first needed.
+        self.aliases_stat = None   # Identifies the version of the aliases file that was loaded (None if missing).
+        self.daemon = None         # Set when running as a grit daemon.
+        self.manifest = None       # Active manifest kept by a grit daemon (see load_manifest).
+        self.manifest_stat = None  # Identifies the version of the active manifest file that was loaded.
 
     def load_aliases(self):
         """ Load any aliases from user's home directory.
         NOTE: debug mode is enabled after this method is called, so no point in calling logger.debug here.
         """
+        import json
+        self.aliases_loaded = True
+        self.aliases = None
+        self.aliases_stat = self.get_aliases_stat()
         file_path = os.path.join(os.path.expanduser("~"), GRIT_ALIASES_FILE)
         try:
             with open(file_path, "r") as file_stream:
@@ -1030,56 +3673,330 @@ class Grit(object):
             # It is optional to have a grit aliases file.
             pass
 
-    def substitute_aliases(self, string):
-        """ Substitutes aliases in the provided string. This is performed using simple text replacements. """
-        if self.aliases is not None:
+    @staticmethod
+    def get_aliases_stat():
+        """ Returns the modification time and size of the aliases file, or None if it doesn't exist. """
+        try:
+            stat = os.stat(os.path.join(os.path.expanduser("~"), GRIT_ALIASES_FILE))
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    @staticmethod
+    def get_command_name(parser, command_args: list):
+        """ Returns the first argument that is not an option (or the value of an option), i.e. the command (which
+        may be an alias). Returns None if there is none.
+        """
+        value_options = set(option for action in parser._actions if action.nargs != 0
+                            for option in action.option_strings)
+        args = iter(command_args)
+        for arg in args:
+            if arg in value_options:
+                next(args, None)   # The value of the option.
+            elif not arg.startswith("-"):
+                return arg
+        return None
+
+    def substitute_aliases(self, command_args: list):
+        """ Substitutes aliases in the provided arguments. This is performed using simple text replacements in
+        each argument. An argument that is changed by an alias is split into several arguments (at spaces), so an
+        alias can expand to several arguments. Other arguments are kept as is (e.g. with spaces).
+        An alias containing a space (i.e. matching several arguments) is substituted in the whole command line
+        instead, as done by earlier versions of grit, and all arguments are then split at spaces.
+        """
+        if not self.aliases_loaded or (self.daemon is not None and self.get_aliases_stat() != self.aliases_stat):
+            # A grit daemon reloads the aliases when the aliases file is changed.
+            self.load_aliases()
+        if self.aliases is None:
+            return command_args
+        command_line = " ".join(command_args)
+        if any(" " in alias and alias in command_line for alias in self.aliases):
+            if any(" " in arg for arg in command_args):
+                print("Warning: An alias containing spaces is used, so the arguments containing spaces are split.",
+                      file=sys.stderr)
+            for alias in self.aliases:
+                command_line = command_line.replace(alias, self.aliases[alias])
+            return command_line.split(" ")
+        substituted_args = []
+        for arg in command_args:
+            substituted_arg = arg
             for alias in self.aliases:
-                string = string.replace(alias, self.aliases[alias])
-        return string
+                substituted_arg = substituted_arg.replace(alias, self.aliases[alias])
+            if substituted_arg != arg:
+                substituted_args += substituted_arg.split(" ")
+            else:
+                substituted_args.append(arg)
+        return substituted_args
+
+    @staticmethod
+    def load_journal():
+        """ Load the journal of the last run. Returns the command arguments of the run, the names of the completed
+        (succeeded) jobs, the names of the failed jobs, and whether the run was completed (i.e. not stopped by an
+        error or interrupted, so no jobs are left that never ran).
+        Raises RuntimeError if there is no journal.
+        """
+        import json
+        file_path = os.path.join(Manifest.get_root_path(), GRIT_DIRECTORY, JOURNAL_FILE)
+        command_args = None
+        job_states = {}
+        completed = False
+        try:
+            with open(file_path, "r") as file_stream:
+                for line in file_stream:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue   # E.g. a partially written last line, if grit was killed.
+                    if record.get("event") == "start":
+                        command_args = record["command-args"]
+                    elif record.get("event") == "end":
+                        completed = not record["stopped"]
+                    elif "job" in record:
+                        job_states[record["job"]] = record["state"]
+        except OSError as err:
+            raise RuntimeError("No run to resume: " + str(err))
+        if command_args is None:
+            raise RuntimeError("No run to resume: " + file_path + " is empty or corrupt.")
+        completed_jobs = set(job for job, state in job_states.items() if state == "succeeded")
+        failed_jobs = set(job for job, state in job_states.items() if state != "succeeded")
+        return command_args, completed_jobs, failed_jobs, completed
+
+    def load_manifest(self, args):
+        """ Load the active manifest. A grit daemon keeps it in memory between commands, until the active manifest
+        file is changed.
+        """
+        if self.daemon is None:
+            manifest = Manifest()
+            manifest.load_active_manifest(not args.no_cache, args.rebuild_cache)
+            return manifest
+        # Stat before loading, so a change while loading is detected next time.
+        stat = os.stat(os.path.join(self.daemon.root_path, GRIT_DIRECTORY, ACTIVE_MANIFEST_FILE + ".json"))
+        manifest_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self.manifest is None or manifest_stat != self.manifest_stat or args.no_cache or args.rebuild_cache:
+            logger.debug("Loading the active manifest in the daemon.")
+            self.manifest = Manifest()
+            self.manifest.load_active_manifest(not args.no_cache, args.rebuild_cache)
+            self.manifest_stat = manifest_stat
+        return self.manifest
+
+    def do_daemon(self, args):
+        """ Start a grit daemon (in the foreground), or stop the running one. See GritDaemon. """
+        import argparse
+        daemon_parser = argparse.ArgumentParser(prog="grit daemon")
+        daemon_parser.add_argument("action", nargs="?", choices=["start", "stop"], default="start",
+                                   help="start (default) or stop the daemon.")
+        daemon_args = daemon_parser.parse_args(args.args)   # Parse args after daemon.
+        if daemon_args.action == "start":
+            if self.daemon is not None:
+                raise RuntimeError("A grit daemon is already running (" + self.daemon.socket_path + ").")
+            self.daemon = GritDaemon(self)
+            try:
+                self.daemon.serve()
+            finally:
+                self.daemon = None
+                self.manifest = None
+        elif self.daemon is None:
+            raise RuntimeError("No grit daemon is running.")
+        else:
+            print("Stopping grit daemon.")
+            self.daemon.stopped = True
+
+    @staticmethod
+    def resolve_job_limits(args):
+        """ Resolve --jobs, --dynamic-jobs and --max-load into the number of parallel jobs (parallel_jobs, the max
+        if dynamic), the initial number of parallel jobs (initial_jobs) and max_load.
+        """
+        cpu_count = os.cpu_count() or 1
+        if args.parallel_jobs == "auto" or (args.parallel_jobs is None and args.dynamic_jobs):
+            args.dynamic_jobs = True
+            args.initial_jobs = cpu_count
+            args.parallel_jobs = 2 * cpu_count
+        else:
+            if args.parallel_jobs is None:
+                args.parallel_jobs = 1
+            args.initial_jobs = args.parallel_jobs
+        if args.max_load is None:
+            args.max_load = float(cpu_count)
 
-    def run_command(self, command_line: str):
-        """ Runs the grit command with its options and parameters, all provided as a string. """
+    @staticmethod
+    def create_parser():
+        """ Returns the argument parser of the grit command line. """
+        import argparse
         parser = argparse.ArgumentParser(prog="grit",
                                          description="grit is a tool to manage many git repositories efficiently"
                                                      " in a project.")
-        parser.add_argument("--version", action="version", version="%(prog)s 1.0")
+        parser.add_argument("--version", action="version", version="%(prog)s " + VERSION)
         parser.add_argument("--verbose", "-v", action="count", default=0)
         parser.add_argument("--debug", action="store_true", dest="debug_mode", help="enable debug mode.")
         parser.add_argument("--force", "-f", action="store_true", dest="force_mode",
                             help="continue even if an error occurred.")
-        parser.add_argument("--jobs", "-j", type=int, default=1, dest="parallel_jobs",
-                            help="number of parallel jobs to perform. Default is 1.")
+        parser.add_argument("--resume", action="store_true", dest="resume",
+                            help="run the command of the last run again (instead of a command), but only for the"
+                                 " repositories that failed or never ran. Any options are added to the options of"
+                                 " the last run.")
+        parser.add_argument("--timeout", type=float, default=None, dest="timeout",
+                            help="kill each command (incl. all processes started by it) not completed within this"
+                                 " many seconds; reported as exit code " + str(TIMEOUT_EXIT_CODE) + ". The timeout"
+                                 " setting in the manifest takes precedence. Default is no timeout.")
+        parser.add_argument("--straggler-factor", type=float, default=STRAGGLER_FACTOR, dest="straggler_factor",
+                            help="warn when a repository takes this many times longer than its recorded median"
+                                 " duration (and at least " + str(int(STRAGGLER_MIN_EXCESS)) + " s longer), 0 to"
+                                 " disable. Default is " + str(STRAGGLER_FACTOR) + ".")
+        parser.add_argument("--retries", type=int, default=0, dest="retries",
+                            help="max number of times to retry a clone, fetch, pull or push that failed due to a"
+                                 " transient (network) error. Default is 0.")
+        parser.add_argument("--retry-delay", type=float, default=DEFAULT_RETRY_DELAY, dest="retry_delay",
+                            help="seconds to wait before the first retry; doubled for each retry. Default is "
+                                 + str(DEFAULT_RETRY_DELAY) + ".")
+        parser.add_argument("--jobs", "-j", type=parse_jobs, default=None, dest="parallel_jobs",
+                            help="number of parallel jobs to perform, or auto: start from the number of CPUs and"
+                                 " adjust at runtime (see --dynamic-jobs), up to twice the number of CPUs."
+                                 " Default is 1 (auto with --dynamic-jobs).")
+        parser.add_argument("--dynamic-jobs", action="store_true", dest="dynamic_jobs",
+                            help="adjust the number of parallel jobs at runtime (up to --jobs), based on the load"
+                                 " average, memory use and job durations compared to previous runs.")
+        parser.add_argument("--max-load", type=float, default=None, dest="max_load",
+                            help="with dynamic jobs, lower the number of parallel jobs when the load average is"
+                                 " above this. Default is the number of CPUs.")
+        parser.add_argument("--max-mem", type=parse_percent, default=DEFAULT_MAX_MEMORY_USE, dest="max_memory_use",
+                            help="with dynamic jobs, lower the number of parallel jobs when the memory use (percent"
+                                 " of total) is above this. Default is " + str(int(DEFAULT_MAX_MEMORY_USE)) + "%%.")
+        parser.add_argument("--jobs-per-host", type=int, default=None, dest="jobs_per_host",
+                            help="max number of parallel jobs per remote host, for clone, fetch, pull and push."
+                                 " The jobs-per-host setting in the manifest takes precedence. Default is no limit"
+                                 " (except --jobs).")
+        parser.add_argument("--schedule", choices=["auto", "longest-first", "manifest"], default="auto",
+                            dest="schedule",
+                            help="order in which the jobs are started: longest-first (based on recorded durations),"
+                                 " manifest (manifest order) or auto (longest-first if more than one parallel job,"
+                                 " else manifest). Default is auto.")
         parser.add_argument("--no-log", action="store_true", dest="no_log",
                             help="do not add command details to log file.")
-        parser.add_argument("--groups", "-g", action="store", dest="groups", default=None,
-                            help="a repository must belong to at least one of the listed groups.\n"
-                                 "Multiple groups must be comma separated with no space between.")
-        parser.add_argument("command", help="command to perform: init, clone, foreach, snapshot, or any git command.")
+        parser.add_argument("--output-memory-limit", type=parse_size, default=OUTPUT_MEMORY_LIMIT,
+                            dest="output_memory_limit",
+                            help="max size of the output of each command to keep in memory (k, M and G suffixes"
+                                 " are allowed). Any output above this is stored in a temporary file in "
+                                 + GRIT_DIRECTORY + ". Default is 1M.")
+        parser.add_argument("--stream", action="store_true", dest="stream_output",
+                            help="print output lines as soon as they are available, prefixed with the local path.")
+        parser.add_argument("--log-format", choices=["text", "jsonl"], default="text", dest="log_format",
+                            help="format of the command log: text (" + LOG_FILE_NAME + ", incl. all output) or jsonl ("
+                                 + JSONL_LOG_FILE_NAME + ", one JSON record per command with timing, exit code and"
+                                 " output size). Default is text.")
+        parser.add_argument("--trace", action="store", dest="trace_file", default=None,
+                            help="save a timeline of the executed jobs to the file, in Chrome trace event format.")
+        parser.add_argument("--timing", action="store_true", dest="timing",
+                            help="print the time spent in each startup phase (and in total) on stderr.")
+        parser.add_argument("--daemon", action="store_true", dest="daemon",
+                            help="execute the command by the grit daemon of the project, if one is running.")
+        parser.add_argument("--no-daemon", action="store_true", dest="no_daemon",
+                            help="execute the command in this process, even if " + DAEMON_ENV_VARIABLE + " is set.")
+        parser.add_argument("--no-cache", action="store_true", dest="no_cache",
+                            help="do not use the precompiled active manifest; always load the JSON file.")
+        parser.add_argument("--rebuild-cache", action="store_true", dest="rebuild_cache",
+                            help="rebuild the precompiled active manifest.")
+        parser.add_argument("--groups", "-g", type=parse_groups, default=None, dest="groups",
+                            help="group expression selecting the target repositories. Groups are combined with"
+                                 " ',' or '|' (union), '&' (intersection) and '!' (exclusion), e.g. 'g1,g2' or"
+                                 " 'platform&!legacy'. Group names may contain glob wildcards.")
+        parser.add_argument("command", nargs="?", default=None,
+                            help="command to perform: init, clone, foreach, snapshot, cache, stats, daemon, dirty, or"
+                                 " any git command.")
         parser.add_argument("args", help="arguments to the command (depends on command)", nargs=argparse.REMAINDER)
-        command_line = self.substitute_aliases(command_line)
-        args = parser.parse_args(command_line.split(" "))
+        return parser
+
+    def run_command(self, command_args: list):
+        """ Runs the grit command with its options and parameters, provided as a list of arguments (as sys.argv).
+        """
+        parser = self.create_parser()
+        timing.mark("argument parser created")
+        if self.get_command_name(parser, command_args) not in BUILTIN_COMMANDS:
+            # Aliases are never needed for a built-in command, so the aliases file isn't even read.
+            command_args = self.substitute_aliases(command_args)
+        timing.mark("aliases loaded")
+        args = parser.parse_args(command_args)
+        args.completed_jobs = set()   # Jobs to skip (see --resume).
+        if args.resume:
+            import shlex
+            if args.command is not None:
+                parser.error("a command cannot be specified together with --resume")
+            resumed_args, completed_jobs, failed_jobs, completed = self.load_journal()
+            # The command and its arguments are last (see argparse.REMAINDER).
+            command_position = len(resumed_args) - len(parser.parse_args(resumed_args).args) - 1
+            resumed_command = shlex.join(resumed_args[command_position:])
+            if completed and len(failed_jobs) == 0:
+                print("Nothing to resume; all repositories of the last run (" + resumed_command + ") succeeded.")
+                return
+            print("Resuming " + resumed_command + " (completed: " + str(len(completed_jobs)) + ", failed: "
+                  + str(len(failed_jobs)) + ").")
+            # Add the options of this run in front of the command, so they override the options of the last run.
+            # The journal keeps the command arguments of the last run as is.
+            options = [arg for arg in command_args if arg not in ("--resume", "--daemon", "--no-daemon")]
+            args = parser.parse_args(resumed_args[:command_position] + options + resumed_args[command_position:])
+            args.completed_jobs = completed_jobs
+            command_args = resumed_args
+        elif args.command is None:
+            parser.error("the following arguments are required: command")
+        args.command_args = command_args   # Recorded in the journal.
+        self.resolve_job_limits(args)
+        timing.enabled = args.timing
+        timing.mark("arguments parsed")
         if args.debug_mode:
-            logging.basicConfig(level=logging.DEBUG)
+            import shlex
+            logger.enable_debug()
             logger.debug("Enabled debug mode.")
-            logger.debug("Running command " + command_line)
-        else:
-            logger.setLevel(logging.ERROR)
+            logger.debug("Running command " + shlex.join(command_args))
         if args.command == "init":   # init must be called from the project root directory (=parent of GRIT_DIRECTORY).
             config = Config()
             config.do_init(args)
+        elif args.command == "daemon":
+            self.do_daemon(args)
         else:
-            manifest = Manifest()
-            manifest.load_active_manifest()
+            manifest = self.load_manifest(args)
+            timing.mark("active manifest loaded")
             if args.command == "clone":
                 manifest.do_clone(args)
             elif args.command == "foreach":
                 manifest.do_foreach(args)
             elif args.command == "snapshot":
                 manifest.do_snapshot(args)
+            elif args.command == "cache":
+                manifest.do_cache(args)
+            elif args.command == "stats":
+                manifest.do_stats(args)
+            elif args.command == "dirty":
+                manifest.do_dirty(args)
             else:
                 # Assume a git command. Note that local git aliases also will work.
                 manifest.do_generic(args)
+        timing.mark("done")
+
+
+def main(argv: list=None):
+    """ Entry point of grit. Returns the exit code. """
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv == ["--version"]:
+        # Fast path; no need to set up the argument parser.
+        print("grit " + VERSION)
+        return 0
+    if argv in (["-h"], ["--help"], ["help"]):
+        # Fast path; no aliases, daemon or manifest needed.
+        Grit.create_parser().print_help()
+        return 0
+    # A grit daemon is only used if requested (or to stop it).
+    use_daemon = "--daemon" in argv or os.environ.get(DAEMON_ENV_VARIABLE, "") != "" or argv[-2:] == ["daemon", "stop"]
+    if use_daemon and "--no-daemon" not in argv:
+        exit_code = run_in_daemon(argv)
+        if exit_code is not None:
+            return exit_code
+    try:
+        Grit().run_command(argv)
+    finally:
+        if timing.enabled:
+            timing.print_report()
+    return 0
 
 
 if __name__ == "__main__":
-    Grit().run_command(" ".join(sys.argv[1:]))
+    sys.exit(main())
@@ -0,0 +1,73 @@
+""" Shared fixtures of the grit tests. """
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+GRIT_PATH = os.path.join(os.path.dirname(TESTS_DIRECTORY), "grit.py")
+GIT_ENV = {"GIT_AUTHOR_NAME": "test", "GIT_AUTHOR_EMAIL": "test@localhost",
+           "GIT_COMMITTER_NAME": "test", "GIT_COMMITTER_EMAIL": "test@localhost"}
+
+sys.path.insert(0, os.path.dirname(TESTS_DIRECTORY))
+
+
+class GritProject(object):
+    """ A grit project in a temporary directory, with bare repositories (remotes) to clone from. """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, "project")
+        self.remotes_path = os.path.join(directory, "remotes")
+        os.makedirs(os.path.join(self.path, ".grit"))
+        os.makedirs(self.remotes_path)
+        self.env = dict(os.environ, **GIT_ENV)
+        self.env.pop("GRIT_DAEMON", None)
+
+    def git(self, args: list, cwd: str=None):
+        subprocess.run(["git"] + args, cwd=cwd or self.path, env=self.env, check=True, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+
+    def create_remote(self, repo_name: str):
+        """ Create a bare repository with one commit on master. Returns its file:// URL. """
+        work_tree = os.path.join(self.directory, "work", repo_name)
+        self.git(["init", "-q", "-b", "master", work_tree])
+        with open(os.path.join(work_tree, "README"), "w") as file_stream:
+            file_stream.write(repo_name + "\n")
+        self.git(["add", "README"], cwd=work_tree)
+        self.git(["commit", "-q", "-m", "Initial commit"], cwd=work_tree)
+        remote_path = os.path.join(self.remotes_path, repo_name + ".git")
+        self.git(["clone", "-q", "--bare", work_tree, remote_path])
+        return "file://" + remote_path
+
+    def clone_remote(self, repo_name: str):
+        """ Clone the remote (without grit) into the local path of the repo. """
+        self.git(["clone", "-q", os.path.join(self.remotes_path, repo_name + ".git"), repo_name])
+
+    def write_active_manifest(self, manifest: dict):
+        with open(os.path.join(self.path, ".grit", "_active_manifest.json"), "w") as file_stream:
+            json.dump(manifest, file_stream)
+
+    def run(self, args: list, check: bool=True):
+        """ Run grit in the project directory. Returns the completed process (output as text). """
+        result = subprocess.run([sys.executable, GRIT_PATH] + args, cwd=self.path, env=self.env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if check:
+            assert result.returncode == 0, result.stdout + result.stderr
+        return result
+
+
+@pytest.fixture
+def project(tmp_path):
+    return GritProject(str(tmp_path))
+
+
+@pytest.fixture
+def in_project(project, monkeypatch):
+    """ The project, with the current working directory set to it (for tests calling grit in-process). """
+    monkeypatch.chdir(project.path)
+    return project
@@ -0,0 +1,80 @@
+""" Tests of the alias substitution (~/.gritaliases). """
+
+import grit
+
+
+def get_grit(aliases: dict):
+    result = grit.Grit()
+    result.aliases = aliases
+    result.aliases_loaded = True
+    return result
+
+
+def test_single_word_alias():
+    aliases = {"init_grit": "init https://host/grit.git -b master"}
+    assert get_grit(aliases).substitute_aliases(["init_grit", "-c", "config"]) == \
+        ["init", "https://host/grit.git", "-b", "master", "-c", "config"]
+    # Arguments not changed by an alias are kept as is.
+    assert get_grit(aliases).substitute_aliases(["foreach", "echo a b"]) == ["foreach", "echo a b"]
+
+
+def test_multi_word_alias(capsys):
+    aliases = {"status -s": "status --short --branch"}
+    assert get_grit(aliases).substitute_aliases(["-j4", "status", "-s"]) == ["-j4", "status", "--short", "--branch"]
+    assert capsys.readouterr().err == ""
+    assert get_grit(aliases).substitute_aliases(["status", "-s", "a b"]) == \
+        ["status", "--short", "--branch", "a", "b"]
+    assert "Warning" in capsys.readouterr().err
+    # Not used, so arguments with spaces are kept.
+    assert get_grit(aliases).substitute_aliases(["foreach", "echo a b"]) == ["foreach", "echo a b"]
+
+
+def test_no_aliases():
+    assert get_grit(None).substitute_aliases(["status", "a b"]) == ["status", "a b"]
+
+
+def test_get_command_name():
+    parser = grit.Grit.create_parser()
+    assert grit.Grit.get_command_name(parser, ["-j", "4", "-g", "a", "status"]) == "status"
+    assert grit.Grit.get_command_name(parser, ["--verbose", "-j4", "init_grit", "-c", "config"]) == "init_grit"
+    assert grit.Grit.get_command_name(parser, ["--force"]) is None
+
+
+def test_builtin_command_skips_aliases(monkeypatch):
+    def fail():
+        raise AssertionError("aliases loaded")
+    result = grit.Grit()
+    monkeypatch.setattr(result, "load_aliases", fail)
+    stats_args = []
+
+    class FakeManifest:
+        def do_stats(self, args):
+            stats_args.append(args)
+    monkeypatch.setattr(result, "load_manifest", lambda args: FakeManifest())
+    result.run_command(["-j", "2", "stats"])
+    assert len(stats_args) == 1
+
+
+def test_help_fast_path(monkeypatch, capsys):
+    def fail(*args):
+        raise AssertionError("grit command run")
+    monkeypatch.setattr(grit.Grit, "run_command", fail)
+    for argv in (["-h"], ["--help"], ["help"]):
+        assert grit.main(argv) == 0
+        assert capsys.readouterr().out.startswith("usage: grit")
+
+
+def test_daemon_reloads_changed_aliases(tmp_path, monkeypatch):
+    import json
+    import os
+    monkeypatch.setenv("HOME", str(tmp_path))
+    aliases_path = tmp_path / grit.GRIT_ALIASES_FILE
+    aliases_path.write_text(json.dumps({"st": "status"}))
+    result = grit.Grit()
+    result.daemon = object()   # Only checked for None.
+    assert result.substitute_aliases(["st"]) == ["status"]
+    aliases_path.write_text(json.dumps({"st": "status --short"}))
+    os.utime(aliases_path, ns=(0, 0))   # Make sure the modification time changes.
+    assert result.substitute_aliases(["st"]) == ["status", "--short"]
+    aliases_path.unlink()
+    assert result.substitute_aliases(["st"]) == ["st"]
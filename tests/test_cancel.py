@@ -0,0 +1,70 @@
+""" Tests of cancelling grit (SIGTERM): running commands are terminated, and partial clones are removed. """
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import GRIT_PATH
+
+
+def get_processes_in(path: str):
+    """ Returns the PIDs of all processes with the working directory in path (i.e. started for a repo). """
+    pids = []
+    for pid in os.listdir("/proc"):
+        try:
+            cwd = os.readlink(os.path.join("/proc", pid, "cwd"))
+        except (OSError, ValueError):
+            continue
+        if pid.isdigit() and (cwd == path or cwd.startswith(path + os.sep)):
+            pids.append(int(pid))
+    return pids
+
+
+def run_and_terminate(project, args: list, started):
+    """ Run grit in the project, and send SIGTERM to it when started() returns True. Returns the completed process.
+    """
+    process = subprocess.Popen([sys.executable, GRIT_PATH] + args, cwd=project.path, env=project.env,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    deadline = time.time() + 10
+    while not started() and time.time() < deadline:
+        time.sleep(0.05)
+    assert started(), "grit didn't start the commands"
+    process.send_signal(signal.SIGTERM)
+    output = process.communicate(timeout=20)[0]
+    return process.returncode, output
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="requires /proc")
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_sigterm_foreach(project, jobs):
+    repos = []
+    for repo_name in ["r1", "r2"]:
+        project.create_remote(repo_name)
+        project.clone_remote(repo_name)
+        repos.append({"repository": repo_name, "branch": "master", "remote-url": "file://" + project.remotes_path})
+    project.write_active_manifest({"repositories": repos})
+    repo_path = os.path.join(project.path, "r1")
+    start = time.time()
+    returncode, output = run_and_terminate(project, ["-j", jobs, "foreach", "sleep 30"],
+                                           lambda: len(get_processes_in(repo_path)) > 0)
+    assert time.time() - start < 20
+    assert returncode == 128 + signal.SIGTERM, output
+    assert get_processes_in(project.path) == []
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="requires /proc")
+def test_sigterm_clone_leaves_no_partial_directory(project):
+    project.create_remote("r1")
+    # The clone hangs in the "ssh" command (the rest of the ssh command line is commented out).
+    project.env["GIT_SSH_COMMAND"] = "sleep 30 #"
+    project.env["GIT_SSH_VARIANT"] = "simple"
+    project.write_active_manifest({"repositories": [
+        {"repository": "r1", "branch": "master", "remote-url": "ssh://localhost" + project.remotes_path}]})
+    clone_path = os.path.join(project.path, "r1")
+    returncode, output = run_and_terminate(project, ["clone"], lambda: os.path.isdir(clone_path))
+    assert returncode == 128 + signal.SIGTERM, output
+    assert not os.path.exists(clone_path)
@@ -0,0 +1,59 @@
+""" Tests of grit clone settings (partial clone and sparse checkout). """
+
+import os
+import subprocess
+
+
+def add_directories(project, repo_name: str, directories: list):
+    """ Add a file in each directory to the remote of the repo. """
+    work_tree = os.path.join(project.directory, "work", repo_name)
+    for directory in directories:
+        os.makedirs(os.path.join(work_tree, directory))
+        with open(os.path.join(work_tree, directory, "file"), "w") as file_stream:
+            file_stream.write(directory + "\n")
+    project.git(["add", "."], cwd=work_tree)
+    project.git(["commit", "-q", "-m", "Add directories"], cwd=work_tree)
+    remote_path = os.path.join(project.remotes_path, repo_name + ".git")
+    project.git(["push", "-q", remote_path, "master"], cwd=work_tree)
+    project.git(["config", "uploadpack.allowFilter", "true"], cwd=remote_path)
+
+
+def get_config(project, repo_name: str, key: str):
+    result = subprocess.run(["git", "config", "--get", key], cwd=os.path.join(project.path, repo_name),
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    return result.stdout.strip() or None
+
+
+def test_clone_filter_and_sparse_paths(project):
+    for repo_name in ["r1", "r2"]:
+        project.create_remote(repo_name)
+        add_directories(project, repo_name, ["src", "docs"])
+    project.write_active_manifest({
+        "default-profile": "p",
+        "profiles": [{"profile": "p", "remote-url": "file://" + project.remotes_path, "branch": "master"}],
+        "repositories": [{"repository": "r1", "filter": "blob:none", "sparse-paths": ["src"]},
+                         {"repository": "r2"}]})
+    project.run(["clone"])
+    r1_path = os.path.join(project.path, "r1")
+    assert get_config(project, "r1", "remote.origin.partialclonefilter") == "blob:none"
+    with open(os.path.join(r1_path, ".git", "info", "sparse-checkout")) as file_stream:
+        assert "/src/" in file_stream.read().split()
+    assert os.path.isfile(os.path.join(r1_path, "src", "file"))
+    assert not os.path.exists(os.path.join(r1_path, "docs"))
+    # A repo without the settings is a full clone with all files checked out.
+    r2_path = os.path.join(project.path, "r2")
+    assert get_config(project, "r2", "remote.origin.partialclonefilter") is None
+    assert get_config(project, "r2", "core.sparseCheckout") is None
+    assert not os.path.exists(os.path.join(r2_path, ".git", "info", "sparse-checkout"))
+    assert os.path.isfile(os.path.join(r2_path, "docs", "file"))
+
+
+def test_clone_command_line_overrides(project):
+    project.create_remote("r1")
+    add_directories(project, "r1", ["src", "docs"])
+    project.write_active_manifest({"repositories": [
+        {"repository": "r1", "branch": "master", "remote-url": "file://" + project.remotes_path}]})
+    project.run(["clone", "--filter", "tree:0", "--sparse-paths", "docs"])
+    assert get_config(project, "r1", "remote.origin.partialclonefilter") == "tree:0"
+    assert os.path.isfile(os.path.join(project.path, "r1", "docs", "file"))
+    assert not os.path.exists(os.path.join(project.path, "r1", "src"))
@@ -0,0 +1,69 @@
+""" Tests of the grit daemon: the framing of its protocol, and commands executed by it. """
+
+import io
+import os
+import stat
+import subprocess
+import sys
+
+import grit
+from conftest import GRIT_PATH
+
+
+def test_frame_round_trip():
+    stream = io.BytesIO(grit.encode_frame(b"d", b"/some/path") + grit.encode_frame(b"r")
+                        + grit.encode_frame(b"o", "åäö\n".encode()) + grit.encode_frame(b"x", b"0"))
+    assert grit.receive_frame(stream) == (b"d", b"/some/path")
+    assert grit.receive_frame(stream) == (b"r", b"")
+    assert grit.receive_frame(stream) == (b"o", "åäö\n".encode())
+    assert grit.receive_frame(stream) == (b"x", b"0")
+    assert grit.receive_frame(stream) == (None, None)   # Closed.
+
+
+def test_frame_encoding():
+    assert grit.encode_frame(b"a", b"status") == b"a\x00\x00\x00\x06status"
+    data = bytes(70000)
+    assert grit.receive_frame(io.BytesIO(grit.encode_frame(b"o", data))) == (b"o", data)
+
+
+def test_truncated_frame():
+    frame = grit.encode_frame(b"a", b"status")
+    assert grit.receive_frame(io.BytesIO(frame[:3])) == (None, None)
+    assert grit.receive_frame(io.BytesIO(frame[:-1])) == (None, None)
+
+
+def test_daemon_end_to_end(project):
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    with open(os.path.join(project.path, "r1", "new_file"), "w") as file_stream:
+        file_stream.write("untracked\n")
+    project.write_active_manifest({"repositories": [
+        {"repository": "r1", "branch": "master", "remote-url": "file://" + project.remotes_path}]})
+    daemon = subprocess.Popen([sys.executable, GRIT_PATH, "daemon"], cwd=project.path, env=project.env,
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    try:
+        assert daemon.stdout.readline().startswith("grit daemon listening on ")
+        socket_path = os.path.join(project.path, ".grit", grit.DAEMON_SOCKET_FILE)
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        results = {}
+        for command, args in (("status", ["status", "--short"]), ("foreach", ["foreach", "exit 3"]),
+                              ("invalid", ["-g", "a&", "status"])):
+            direct = project.run(args, check=False)
+            via_daemon = project.run(["--daemon"] + args, check=False)
+            assert (via_daemon.returncode, via_daemon.stdout, via_daemon.stderr) == \
+                (direct.returncode, direct.stdout, direct.stderr)
+            results[command] = direct
+        assert results["status"].returncode == 0
+        assert "?? new_file" in results["status"].stdout
+        assert results["foreach"].returncode != 0
+        # Invalid arguments are reported like in a direct run (usage, exit code 2), not as a traceback.
+        assert results["invalid"].returncode == 2
+        assert results["invalid"].stderr.startswith("usage: grit")
+        project.run(["--daemon", "daemon", "stop"])
+        assert daemon.wait(timeout=10) == 0
+        assert not os.path.exists(socket_path)
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+            daemon.wait()
+        daemon.stdout.close()
@@ -0,0 +1,96 @@
+""" Tests of the work tree fingerprints and dirty tracking (grit dirty, grit status --changed-only). """
+
+import os
+import json
+import shutil
+
+import grit
+
+
+def setup_project(project, repo_names=("r1", "r2")):
+    for repo_name in repo_names:
+        project.create_remote(repo_name)
+        project.clone_remote(repo_name)
+    project.write_active_manifest({"repositories": [{"repository": repo_name, "branch": "master"}
+                                                    for repo_name in repo_names]})
+
+
+def count_commands(project, command_line: str):
+    with open(os.path.join(project.path, ".grit", "_commands.log")) as file_stream:
+        return file_stream.read().count(command_line)
+
+
+def test_worktree_fingerprint(project):
+    setup_project(project, ["r1"])
+    work_tree = os.path.join(project.path, "r1")
+    fingerprint = grit.get_worktree_fingerprint(work_tree)
+    assert fingerprint == grit.get_worktree_fingerprint(work_tree)
+    os.makedirs(os.path.join(work_tree, "build"))
+    changed_fingerprint = grit.get_worktree_fingerprint(work_tree)
+    assert changed_fingerprint != fingerprint
+    # Anything in a skipped (ignored) directory doesn't change the fingerprint.
+    with open(os.path.join(work_tree, "build", "output"), "w") as file_stream:
+        file_stream.write("x")
+    assert grit.get_worktree_fingerprint(work_tree, ["build/"]) == grit.get_worktree_fingerprint(work_tree, ["build/"])
+    assert grit.get_worktree_fingerprint(work_tree, ["build/"]) != changed_fingerprint
+    assert grit.get_worktree_fingerprint(os.path.join(project.path, "missing")) is None
+
+
+def test_get_status_entries():
+    output = "## master\0R  new\0old\0?? a b\0!! build/\0"
+    assert grit.Manifest.get_status_entries(output, True) == ["## master", "R  new\0old", "?? a b", "!! build/"]
+    assert grit.Manifest.get_status_entries("R  old -> new\n M x\n", False) == ["R  old -> new", " M x"]
+
+
+def test_dirty(project):
+    setup_project(project)
+    assert project.run(["dirty"]).stdout == ""
+    with open(os.path.join(project.path, "r2", "new.txt"), "w") as file_stream:
+        file_stream.write("x")
+    assert project.run(["dirty"]).stdout == "r2\n"
+    assert project.run(["-v", "dirty"]).stdout.endswith("1 of 2 repositories are dirty (0 checked by git).\n")
+
+
+def test_status_changed_only(project):
+    setup_project(project)
+    with open(os.path.join(project.path, "r2", ".gitignore"), "w") as file_stream:
+        file_stream.write("build/\n")
+    os.makedirs(os.path.join(project.path, "r2", "build"))
+    with open(os.path.join(project.path, "r2", "build", "output"), "w") as file_stream:
+        file_stream.write("x")
+    result = project.run(["status", "--changed-only", "-s"])
+    # The check is also the status; the ignored entries are not printed.
+    assert "?? .gitignore" in result.stdout
+    assert "!!" not in result.stdout
+    assert count_commands(project, "git status") == 0
+    with open(os.path.join(project.path, ".grit", "_dirty_state.json")) as file_stream:
+        dirty_state = json.load(file_stream)
+    assert dirty_state["r1"]["dirty"] is False
+    assert dirty_state["r2"]["dirty"] is True
+    assert dirty_state["r2"]["ignored"] == ["build/"]
+    # The clean repo is skipped, and the unchanged dirty repo is not checked again.
+    result = project.run(["status", "--changed-only", "-s"])
+    assert "r1" not in result.stdout
+    assert "?? .gitignore" in result.stdout
+    assert count_commands(project, "cd r2 && git status -s") == 1
+    # Other formats are checked first, and then executed as requested.
+    os.remove(os.path.join(project.path, "r2", ".gitignore"))
+    shutil.rmtree(os.path.join(project.path, "r2", "build"))
+    result = project.run(["status", "--changed-only"])
+    assert "r1" not in result.stdout
+    assert "nothing to commit" in result.stdout
+    assert count_commands(project, "cd r2 && git status\n") == 1
+
+
+def test_status_changed_only_stream(project):
+    setup_project(project, ["r1"])
+    for file_name in ("a.txt", "b.txt"):
+        with open(os.path.join(project.path, "r1", file_name), "w") as file_stream:
+            file_stream.write("x")
+    assert project.run(["--stream", "status", "--changed-only", "-s"]).stdout == "r1: ?? a.txt\nr1: ?? b.txt\n"
+    project.run(["dirty"])   # The new file below changes the recorded fingerprint, so the repo is checked again.
+    with open(os.path.join(project.path, "r1", "c.txt"), "w") as file_stream:
+        file_stream.write("x")
+    # Each NUL-terminated entry is streamed on its own, prefixed by the local path.
+    result = project.run(["--stream", "status", "--changed-only", "--porcelain", "-z"])
+    assert result.stdout == "r1: ?? a.txt\0r1: ?? b.txt\0r1: ?? c.txt\0"
@@ -0,0 +1,78 @@
+""" Tests of group expressions (--groups) and the group index. """
+
+import json
+
+import pytest
+
+import grit
+
+
+GROUP_INDEX = {"platform": {"a", "b", "c"}, "legacy": {"b"}, "tools-x": {"d"}, "tools-y": {"e"}, "docs": {"a", "e"}}
+ALL_REPO_NAMES = {"a", "b", "c", "d", "e", "f"}
+
+
+def evaluate(expression: str):
+    return grit.GroupExpression(expression).evaluate(GROUP_INDEX, ALL_REPO_NAMES)
+
+
+def test_tokenize():
+    assert grit.GroupExpression.tokenize(" a ,b|(c & !d) ") == ["a", ",", "b", "|", "(", "c", "&", "!", "d", ")"]
+    assert grit.GroupExpression.tokenize("") == []
+
+
+@pytest.mark.parametrize("expression, repo_names", [
+    ("platform", {"a", "b", "c"}),
+    ("platform,docs", {"a", "b", "c", "e"}),
+    ("platform|docs", {"a", "b", "c", "e"}),
+    ("platform&docs", {"a"}),
+    ("platform&!legacy", {"a", "c"}),
+    ("!platform", {"d", "e", "f"}),
+    ("!platform&!docs", {"d", "f"}),
+    ("platform&!legacy,tools*", {"a", "c", "d", "e"}),   # ! before &, & before ,
+    ("platform&(legacy,docs)", {"a", "b"}),
+    ("!(platform,docs)", {"d", "f"}),
+    ("tools-[x]", {"d"}),
+    ("tools-?", {"d", "e"}),
+    ("missing", set()),
+    ("missing*", set()),
+    ("platform,", {"a", "b", "c"}),   # Empty union terms are ignored.
+    ("platform,,docs", {"a", "b", "c", "e"}),
+    (",", set()),
+    ("", set()),
+])
+def test_evaluate(expression, repo_names):
+    assert evaluate(expression) == repo_names
+
+
+@pytest.mark.parametrize("expression", ["a&", "&a", "!", "(a", "a)", "a&&b", "a!b", "(a))"])
+def test_invalid_expression(expression):
+    with pytest.raises(ValueError, match="Invalid group expression"):
+        grit.GroupExpression(expression)
+
+
+def test_invalid_expression_option(capsys):
+    with pytest.raises(SystemExit) as exc_info:
+        grit.Grit().run_command(["-g", "a&", "status"])
+    assert exc_info.value.code == 2
+    err = capsys.readouterr().err
+    assert err.startswith("usage: grit")
+    assert "error: argument --groups/-g: Invalid group expression 'a&'!" in err
+
+
+def test_evaluate_does_not_modify_group_index():
+    evaluate("platform&docs")
+    evaluate("platform&!legacy")
+    assert GROUP_INDEX["platform"] == {"a", "b", "c"}
+
+
+def test_get_target_repos_in_manifest_order():
+    manifest = grit.Manifest()
+    manifest.load_data(json.dumps({"repositories": [
+        {"repository": "r3", "groups": ["g1", "g2"]}, {"repository": "r1", "groups": "g1"},
+        {"repository": "r2", "groups": ["g2"]}, {"repository": "r4"}]}).encode(), "test.json")
+    assert [repo.get_repo() for repo in manifest.get_target_repos("g2,g1")] == ["r3", "r1", "r2"]
+    assert [repo.get_repo() for repo in manifest.get_target_repos("!g1")] == ["r2", "r4"]
+    assert len(manifest.get_target_repos()) == 4
+    # The group index is rebuilt when the manifest is changed.
+    manifest.get_repo("r4").set_setting("groups", ["g1"])
+    assert [repo.get_repo() for repo in manifest.get_target_repos("g1")] == ["r3", "r1", "r4"]
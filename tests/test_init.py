@@ -0,0 +1,125 @@
+""" Tests of grit init: updating the manifest gits (-u) and the stamp of the generated active manifest. """
+
+import os
+import json
+import subprocess
+
+
+def commit_file(project, work_tree: str, file_name: str, content: str):
+    with open(os.path.join(work_tree, file_name), "w") as file_stream:
+        file_stream.write(content)
+    project.git(["add", file_name], cwd=work_tree)
+    project.git(["commit", "-q", "-m", "Change " + file_name], cwd=work_tree)
+
+
+def push_remote_change(project, repo_name: str, content: str):
+    """ Commit a change to the remote of the repo (via the work tree it was created from). """
+    work_tree = os.path.join(project.directory, "work", repo_name)
+    commit_file(project, work_tree, "README", content)
+    project.git(["push", "-q", os.path.join(project.remotes_path, repo_name + ".git"), "master"], cwd=work_tree)
+
+
+def get_head(path: str):
+    return subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, stdout=subprocess.PIPE,
+                          universal_newlines=True, check=True).stdout.strip()
+
+
+def clone_manifest_git(project, repo_name: str):
+    """ Create a manifest git and clone it into the grit directory (like grit init does). Returns its path. """
+    project.create_remote(repo_name)
+    project.git(["clone", "-q", os.path.join(project.remotes_path, repo_name + ".git"),
+                 os.path.join(".grit", repo_name)])
+    return os.path.join(project.path, ".grit", repo_name)
+
+
+def test_update_skips_unchanged_manifests(project):
+    manifests_path = clone_manifest_git(project, "manifests")
+    head = get_head(manifests_path)
+    result = project.run(["init", "-u"])
+    assert "All manifests are up-to-date." in result.stdout
+    # Only the remote refs were checked; nothing was fetched.
+    assert not os.path.exists(os.path.join(manifests_path, ".git", "FETCH_HEAD"))
+    assert get_head(manifests_path) == head
+
+
+def test_update_fast_forwards_moved_manifests(project):
+    manifests_path = clone_manifest_git(project, "manifests")
+    pinned_path = clone_manifest_git(project, "pinned")
+    project.git(["checkout", "-q", "--detach"], cwd=pinned_path)
+    pinned_head = get_head(pinned_path)
+    push_remote_change(project, "manifests", "changed\n")
+    push_remote_change(project, "pinned", "changed\n")
+    result = project.run(["init", "-u"])
+    assert "Updated manifest .grit/manifests" in result.stdout
+    assert get_head(manifests_path) == get_head(os.path.join(project.remotes_path, "manifests.git"))
+    # A manifest git with a detached HEAD is pinned, so it's not updated.
+    assert get_head(pinned_path) == pinned_head
+
+
+def test_update_refuses_non_fast_forward(project):
+    manifests_path = clone_manifest_git(project, "manifests")
+    commit_file(project, manifests_path, "local", "local change\n")
+    local_head = get_head(manifests_path)
+    push_remote_change(project, "manifests", "changed\n")
+    result = project.run(["init", "-u"], check=False)
+    assert result.returncode == 1
+    assert "1 manifest(s) could not be updated." in result.stdout
+    # The local change is kept as is.
+    assert get_head(manifests_path) == local_head
+    # In force mode, the failure doesn't fail grit.
+    assert project.run(["--force", "init", "-u"]).returncode == 0
+
+
+def write_config(project, layer_branch: str="master"):
+    """ Write a config (.grit/config.json) with two manifest layers. """
+    files = {"config": {"manifest-layers": ["base", "top"]},
+             "base": {"default-profile": "p",
+                      "profiles": [{"profile": "p", "remote-url": "file://" + project.remotes_path,
+                                    "branch": "master"}],
+                      "repositories": [{"repository": "r1"}]},
+             "top": {"profiles": [{"profile": "p", "branch": layer_branch}]}}
+    for name, content in files.items():
+        with open(os.path.join(project.path, ".grit", name + ".json"), "w") as file_stream:
+            json.dump(content, file_stream)
+
+
+def get_active_manifest_mtime(project):
+    return os.stat(os.path.join(project.path, ".grit", "_active_manifest.json")).st_mtime_ns
+
+
+def test_init_check_up_to_date(project):
+    write_config(project)
+    assert "Generated active manifest." in project.run(["init", "-c", "config"]).stdout
+    result = project.run(["init", "--check"])
+    assert "Active manifest is up-to-date (config config)." in result.stdout
+    # Generating again is skipped; the active manifest is not rewritten.
+    mtime = get_active_manifest_mtime(project)
+    assert "Active manifest is up-to-date." in project.run(["init", "-c", "config"]).stdout
+    assert get_active_manifest_mtime(project) == mtime
+
+
+def test_init_check_stale_after_config_change(project):
+    write_config(project)
+    project.run(["init", "-c", "config"])
+    write_config(project, layer_branch="develop")
+    result = project.run(["init", "--check"], check=False)
+    assert result.returncode == 1
+    assert "Active manifest is stale (config config):" in result.stdout
+    assert "top.json is changed" in result.stdout
+    assert "Generated active manifest." in project.run(["init", "-c", "config"]).stdout
+    with open(os.path.join(project.path, ".grit", "_active_manifest.json")) as file_stream:
+        assert "develop" in file_stream.read()
+    project.run(["init", "--check"])
+
+
+def test_init_check_missing_stamp(project):
+    write_config(project)
+    project.run(["init", "-c", "config"])
+    os.remove(os.path.join(project.path, ".grit", "_active_manifest.stamp"))
+    result = project.run(["init", "--check", "-c", "config"], check=False)
+    assert result.returncode == 1
+    assert "no stamp of a generated active manifest" in result.stdout
+    # Without a stamp, the config used last time is unknown.
+    result = project.run(["init", "--check"], check=False)
+    assert result.returncode == 1
+    assert "not generated from a config" in result.stdout
@@ -0,0 +1,86 @@
+""" Tests of the number of parallel jobs (-j auto, --dynamic-jobs and the job limit controller). """
+
+import os
+
+import pytest
+
+import grit
+
+
+def resolve_job_limits(args: list):
+    result = grit.Grit.create_parser().parse_args(args + ["status"])
+    grit.Grit.resolve_job_limits(result)
+    return result
+
+
+def test_resolve_job_limits(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 4)
+    args = resolve_job_limits(["-j", "auto"])
+    assert (args.dynamic_jobs, args.initial_jobs, args.parallel_jobs, args.max_load) == (True, 4, 8, 4.0)
+    args = resolve_job_limits(["--dynamic-jobs", "--max-load", "2.5"])
+    assert (args.dynamic_jobs, args.initial_jobs, args.parallel_jobs, args.max_load) == (True, 4, 8, 2.5)
+    # A fixed number of jobs, also as the max with --dynamic-jobs.
+    args = resolve_job_limits(["-j", "3"])
+    assert (args.dynamic_jobs, args.initial_jobs, args.parallel_jobs) == (False, 3, 3)
+    args = resolve_job_limits(["-j", "3", "--dynamic-jobs"])
+    assert (args.dynamic_jobs, args.initial_jobs, args.parallel_jobs) == (True, 3, 3)
+    args = resolve_job_limits([])
+    assert (args.dynamic_jobs, args.initial_jobs, args.parallel_jobs) == (False, 1, 1)
+
+
+class CompletedJob(object):
+    def __init__(self, duration: float, estimated_duration: float):
+        self.start_time = 100.0
+        self.end_time = 100.0 + duration
+        self.estimated_duration = estimated_duration
+
+    def is_successful(self):
+        return True
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    """ A job limit controller (limit 4 of max 8, max load 4.0) with no changes held back, load average 1.0 and
+    unknown memory use. The changes are recorded in changes.
+    """
+    monkeypatch.setattr(grit, "JOB_LIMIT_HOLD_TIME", 0.0)
+    monkeypatch.setattr(os, "getloadavg", lambda: (1.0, 1.0, 1.0))
+    monkeypatch.setattr(grit, "get_memory_use", lambda: None)
+    result = grit.JobLimitController(4, 8, 4.0, 90.0, lambda old, new, reason: result.changes.append((old, new)))
+    result.changes = []
+    return result
+
+
+def test_grows_while_jobs_are_waiting(controller):
+    assert controller.update(10, [CompletedJob(1.0, 1.0)]) == 5
+    assert controller.update(0, []) == 5
+    assert controller.changes == [(4, 5)]
+    for _ in range(10):
+        controller.update(10, [])
+    assert controller.limit == 8
+
+
+def test_shrinks_when_jobs_are_slower_than_recorded(controller):
+    # The median slowdown decides; one slow job is not enough.
+    assert controller.update(10, [CompletedJob(1.0, 1.0), CompletedJob(1.0, 1.0), CompletedJob(10.0, 1.0)]) == 5
+    slowdown = grit.JOB_SLOWDOWN_LIMIT * 2
+    assert controller.update(10, [CompletedJob(slowdown, 1.0), CompletedJob(slowdown, 1.0)]) == 4
+    # Jobs without recorded durations are not considered.
+    assert controller.update(10, [CompletedJob(100.0, None)]) == 5
+    assert controller.changes == [(4, 5), (5, 4), (4, 5)]
+
+
+def test_shrinks_on_high_load_and_memory_use(controller, monkeypatch):
+    monkeypatch.setattr(os, "getloadavg", lambda: (5.0, 5.0, 5.0))
+    assert controller.update(10, []) == 3
+    monkeypatch.setattr(os, "getloadavg", lambda: (1.0, 1.0, 1.0))
+    monkeypatch.setattr(grit, "get_memory_use", lambda: 95.0)
+    assert controller.update(10, []) == 2
+    assert controller.update(10, []) == 1
+    assert controller.update(10, []) == 1   # Never below 1.
+
+
+def test_changes_are_held_back(controller, monkeypatch):
+    monkeypatch.setattr(grit, "JOB_LIMIT_HOLD_TIME", 60.0)
+    assert controller.update(10, []) == 4
+    assert controller.changes == []
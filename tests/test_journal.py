@@ -0,0 +1,90 @@
+""" Tests of the job journal, --resume and retries of transient failures. """
+
+import os
+import json
+
+import grit
+
+
+def setup_project(project, repo_names=("r1", "r2", "r3")):
+    for repo_name in repo_names:
+        project.create_remote(repo_name)
+        project.clone_remote(repo_name)
+    project.write_active_manifest({"repositories": [
+        {"repository": repo_name, "branch": "master", "remote-url": "file://" + project.remotes_path}
+        for repo_name in repo_names]})
+
+
+def read_lines(file_path: str):
+    with open(file_path) as file_stream:
+        return file_stream.read().splitlines()
+
+
+def test_resume(project):
+    setup_project(project)
+    ran_path = os.path.join(project.path, "ran.txt")
+    foreach_args = ["foreach", "echo $REMOTE_REPO >> ../ran.txt; test ! -e fail || exit 3"]
+    open(os.path.join(project.path, "r2", "fail"), "w").close()
+    result = project.run(foreach_args, check=False)
+    assert result.returncode == 3
+    assert read_lines(ran_path) == ["r1", "r2"]   # Stopped at the first error.
+    records = [json.loads(line) for line in read_lines(os.path.join(project.path, ".grit", grit.JOURNAL_FILE))]
+    assert records[0]["event"] == "start"
+    assert records[0]["command-args"] == foreach_args
+    assert [record["job"] for record in records[1:3]] == ["r1", "r2"]
+    assert records[2]["state"] == "failed" and records[2]["exit-code"] == 3
+    assert records[3]["event"] == "end" and records[3]["stopped"]
+    # The failed and the never started repos are run again.
+    os.remove(os.path.join(project.path, "r2", "fail"))
+    result = project.run(["--resume"])
+    assert "Resuming foreach" in result.stdout
+    assert read_lines(ran_path) == ["r1", "r2", "r2", "r3"]
+    records = [json.loads(line) for line in read_lines(os.path.join(project.path, ".grit", grit.JOURNAL_FILE))]
+    assert records[1] == {"job": "r1", "state": "succeeded", "resumed": True}
+    assert records[-1]["event"] == "end" and not records[-1]["stopped"]
+    assert "Nothing to resume" in project.run(["--resume"]).stdout
+    assert read_lines(ran_path) == ["r1", "r2", "r2", "r3"]
+
+
+def test_read_only_commands_keep_the_journal(project):
+    setup_project(project)
+    project.run(["foreach", "true"])
+    journal_path = os.path.join(project.path, ".grit", grit.JOURNAL_FILE)
+    journal = read_lines(journal_path)
+    project.run(["status"])
+    assert read_lines(journal_path) == journal
+
+
+def test_load_journal_ignores_partial_lines(in_project):
+    with open(os.path.join(in_project.path, ".grit", grit.JOURNAL_FILE), "w") as file_stream:
+        file_stream.write(json.dumps({"event": "start", "command-args": ["clone"]}) + "\n")
+        file_stream.write(json.dumps({"job": "r1", "state": "succeeded"}) + "\n")
+        file_stream.write(json.dumps({"job": "r2", "state": "failed", "exit-code": 128}) + "\n")
+        file_stream.write('{"job": "r3", "sta')   # Killed while writing.
+    assert grit.Grit.load_journal() == (["clone"], {"r1"}, {"r2"}, False)
+
+
+def create_failed_command(output: bytes, result_code: int=128, timed_out: bool=False):
+    command = grit.Command(["git", "fetch"])
+    command.result_code = result_code
+    command.output_tail = output
+    command.timed_out = timed_out
+    return command
+
+
+def test_is_transient_failure():
+    assert create_failed_command(b"fatal: unable to access: Could not resolve host: example.com\n") \
+        .is_transient_failure()
+    assert create_failed_command(b"fatal: the remote end hung up unexpectedly\n").is_transient_failure()
+    assert create_failed_command(b"", result_code=grit.TIMEOUT_EXIT_CODE, timed_out=True).is_transient_failure()
+    assert not create_failed_command(b"fatal: repository 'x' not found\n").is_transient_failure()
+    assert not create_failed_command(b"Could not resolve host\n", result_code=0).is_transient_failure()
+
+
+def test_retry_delay_is_doubled():
+    command = create_failed_command(b"connection reset\n")
+    command.attempts = 1
+    assert command.prepare_retry(0.5) == 0.5
+    command.attempts = 3
+    assert command.prepare_retry(0.5) == 2.0
+    assert command.output_tail == b"" and command.result_output is None
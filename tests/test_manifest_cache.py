@@ -0,0 +1,100 @@
+""" Tests of the precompiled active manifest (the manifest cache). """
+
+import os
+import pickle
+
+import grit
+
+
+MANIFEST = {"default-profile": "p",
+            "profiles": [{"profile": "p", "remote-url": "file:///remotes", "branch": "master"}],
+            "repositories": [{"repository": "r1", "groups": ["g1"]}, {"repository": "r2", "groups": ["g2"]}]}
+
+
+def get_cache_path(project):
+    return os.path.join(project.path, ".grit", grit.ACTIVE_MANIFEST_CACHE_FILE)
+
+
+def test_cache_key_changes_with_content(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    _, data, key = grit.Manifest().read_active_manifest()
+    assert grit.Manifest().read_active_manifest()[2] == key
+    in_project.write_active_manifest(dict(MANIFEST, repositories=MANIFEST["repositories"][:1]))
+    _, new_data, new_key = grit.Manifest().read_active_manifest()
+    assert new_data != data
+    assert new_key != key
+
+
+def test_cache_is_used_when_up_to_date(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    grit.Manifest().load_active_manifest()
+    assert os.path.isfile(get_cache_path(in_project))
+    manifest = grit.Manifest()
+    _, _, key = manifest.read_active_manifest()
+    assert manifest.load_cache(key)
+    assert [repo.get_repo() for repo in manifest.get_target_repos("g2")] == ["r2"]
+    assert manifest.get_optional_setting(manifest.get_repo("r1"), "branch") == "master"
+
+
+def test_outdated_cache_is_rebuilt(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    grit.Manifest().load_active_manifest()
+    in_project.write_active_manifest(dict(MANIFEST, repositories=MANIFEST["repositories"][:1]))
+    manifest = grit.Manifest()
+    _, _, key = manifest.read_active_manifest()
+    assert not manifest.load_cache(key)
+    manifest.load_active_manifest()
+    assert list(manifest.repos) == ["r1"]
+    assert grit.Manifest().load_cache(key)
+
+
+def test_cache_of_other_version_is_ignored(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    manifest = grit.Manifest()
+    manifest.load_active_manifest()
+    with open(get_cache_path(in_project), "rb") as file_stream:
+        state = pickle.load(file_stream)
+    state["version"] += 1
+    with open(get_cache_path(in_project), "wb") as file_stream:
+        pickle.dump(state, file_stream)
+    assert not grit.Manifest().load_cache(manifest.read_active_manifest()[2])
+
+
+def test_cache_with_unexpected_classes_is_ignored(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    manifest = grit.Manifest()
+    manifest.load_active_manifest()
+    state = {"version": grit.ACTIVE_MANIFEST_CACHE_VERSION, "key": manifest.read_active_manifest()[2],
+             "manifest": os.system}
+    with open(get_cache_path(in_project), "wb") as file_stream:
+        pickle.dump(state, file_stream)
+    assert not grit.Manifest().load_cache(state["key"])
+
+
+def test_corrupt_cache_falls_back_to_json(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    with open(get_cache_path(in_project), "wb") as file_stream:
+        file_stream.write(b"not a pickle")
+    manifest = grit.Manifest()
+    manifest.load_active_manifest()
+    assert list(manifest.repos) == ["r1", "r2"]
+    assert grit.Manifest().load_cache(manifest.read_active_manifest()[2])
+
+
+def test_no_cache_and_rebuild_cache(in_project):
+    in_project.write_active_manifest(MANIFEST)
+    grit.Manifest().load_active_manifest(use_cache=False)
+    assert not os.path.exists(get_cache_path(in_project))
+    # A precompiled manifest with the right key but other content is only replaced when a rebuild is forced.
+    stale = grit.Manifest()
+    stale.load_data(b'{"repositories": [{"repository": "r3", "remote-url": "file:///remotes"}]}', "stale.json")
+    stale.save_cache(stale.read_active_manifest()[2])
+    manifest = grit.Manifest()
+    manifest.load_active_manifest()
+    assert list(manifest.repos) == ["r3"]
+    manifest = grit.Manifest()
+    manifest.load_active_manifest(rebuild_cache=True)
+    assert list(manifest.repos) == ["r1", "r2"]
+    manifest = grit.Manifest()
+    manifest.load_active_manifest()
+    assert list(manifest.repos) == ["r1", "r2"]
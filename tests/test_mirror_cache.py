@@ -0,0 +1,53 @@
+""" Tests of the mirror cache (grit cache update, grit clone --cache). """
+
+import os
+
+import grit
+
+
+def write_manifest(project, repo_names):
+    project.write_active_manifest({"repositories": [
+        {"repository": repo_name, "branch": "master", "remote-url": "file://" + project.remotes_path}
+        for repo_name in repo_names]})
+
+
+def test_get_mirror_path():
+    assert grit.get_mirror_path("/cache", "ssh://git@github.com:22/org", "repo") == "/cache/github.com/org/repo.git"
+    assert grit.get_mirror_path("/cache", "git@GitHub.com:org", "repo") == "/cache/github.com/org/repo.git"
+    assert grit.get_mirror_path("/cache", "file:///../x", "../repo") == "/cache/x/repo.git"
+
+
+def test_cache_update_and_clone(project):
+    project.create_remote("r1")
+    write_manifest(project, ["r1"])
+    cache_path = os.path.join(project.directory, "cache")
+    project.run(["cache", "update", cache_path])
+    mirror_path = grit.get_mirror_path(cache_path, "file://" + project.remotes_path, "r1")
+    assert os.path.isfile(os.path.join(mirror_path, "HEAD"))
+    assert not os.path.exists(mirror_path + grit.MIRROR_PARTIAL_SUFFIX)
+    # An existing mirror is updated.
+    project.run(["cache", "update", cache_path])
+    result = project.run(["clone", "--cache", cache_path])
+    assert "Warning" not in result.stdout
+    with open(os.path.join(project.path, "r1", ".git", "objects", "info", "alternates")) as file_stream:
+        assert file_stream.read().strip() == os.path.join(mirror_path, "objects")
+
+
+def test_failed_mirror_clone_leaves_no_mirror(project):
+    write_manifest(project, ["missing"])   # No such remote.
+    cache_path = os.path.join(project.directory, "cache")
+    # A partial mirror left by a killed update is removed before cloning again.
+    mirror_path = grit.get_mirror_path(cache_path, "file://" + project.remotes_path, "missing")
+    os.makedirs(mirror_path + grit.MIRROR_PARTIAL_SUFFIX)
+    result = project.run(["cache", "update", cache_path], check=False)
+    assert result.returncode != 0
+    assert not os.path.exists(mirror_path)
+    assert not os.path.exists(mirror_path + grit.MIRROR_PARTIAL_SUFFIX)
+
+
+def test_clone_with_missing_cache_warns(project):
+    project.create_remote("r1")
+    write_manifest(project, ["r1"])
+    result = project.run(["clone", "--cache", os.path.join(project.directory, "cache")])
+    assert "Warning: 1 repositories are missing" in result.stdout
+    assert os.path.isdir(os.path.join(project.path, "r1", ".git"))
@@ -0,0 +1,42 @@
+""" Tests of the bounded-memory command output (CommandOutput). """
+
+import io
+
+import grit
+
+
+def test_output_in_memory(tmp_path):
+    output = grit.CommandOutput(memory_limit=100, spill_directory=str(tmp_path))
+    output.write(b"line 1\r\n")
+    output.write(b"line 2\n")
+    assert output.spill_file is None
+    assert output.getvalue() == "line 1\nline 2\n"   # Universal newlines.
+    output.close()
+
+
+def test_output_spilled_to_file(tmp_path):
+    output = grit.CommandOutput(memory_limit=10, spill_directory=str(tmp_path))
+    output.write(b"0123456789")
+    assert output.spill_file is None
+    output.write(b"abc\n")
+    assert output.spill_file is not None
+    assert len(output.buffer) == 0
+    assert output.getvalue() == "0123456789abc\n"
+    # Reading doesn't prevent further writes.
+    output.write(b"more\n")
+    text_stream = io.StringIO()
+    output.write_to(text_stream)
+    assert text_stream.getvalue() == "0123456789abc\nmore\n"
+    assert output.size == 19
+    output.close()
+    assert output.spill_file is None
+
+
+def test_large_output_in_chunks(tmp_path):
+    output = grit.CommandOutput(memory_limit=1000, spill_directory=str(tmp_path))
+    data = b"x" * (grit.OUTPUT_CHUNK_SIZE * 2 + 1)
+    output.write(data)
+    chunks = list(output.read_chunks())
+    assert len(chunks) == 3
+    assert "".join(chunks) == data.decode()
+    output.close()
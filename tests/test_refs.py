@@ -0,0 +1,49 @@
+""" Tests of reading refs directly from the git directory (used by snapshot). """
+
+import os
+import json
+import subprocess
+
+import grit
+
+
+def rev_parse(project, work_tree: str, rev: str="HEAD"):
+    return subprocess.run(["git", "rev-parse", rev], cwd=work_tree, env=project.env, check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+def test_read_head_commit(project):
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    work_tree = os.path.join(project.path, "r1")
+    head = rev_parse(project, work_tree)
+    assert grit.read_head_commit(work_tree) == head
+    assert grit.read_head_branch(work_tree) == "master"
+    # Packed refs.
+    project.git(["pack-refs", "--all"], cwd=work_tree)
+    assert not os.path.exists(os.path.join(work_tree, ".git", "refs", "heads", "master"))
+    assert grit.read_head_commit(work_tree) == head
+    # Detached HEAD.
+    project.git(["checkout", "-q", "--detach"], cwd=work_tree)
+    assert grit.read_head_commit(work_tree) == head
+    assert grit.read_head_branch(work_tree) is None
+    assert grit.read_head_commit(os.path.join(project.path, "missing")) is None
+
+
+def test_read_head_commit_of_worktree(project):
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    work_tree = os.path.join(project.path, "r1")
+    project.git(["worktree", "add", "-q", "-b", "feature", os.path.join(project.path, "wt")], cwd=work_tree)
+    assert grit.read_head_branch(os.path.join(project.path, "wt")) == "feature"
+    assert grit.read_head_commit(os.path.join(project.path, "wt")) == rev_parse(project, work_tree)
+
+
+def test_snapshot(project):
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    project.write_active_manifest({"repositories": [{"repository": "r1", "branch": "master"}]})
+    project.run(["snapshot", "snap"])
+    with open(os.path.join(project.path, ".grit", "snap.json")) as file_stream:
+        snapshot = json.load(file_stream)
+    assert snapshot["repositories"][0]["tag"] == rev_parse(project, os.path.join(project.path, "r1"))
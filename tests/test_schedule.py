@@ -0,0 +1,46 @@
+""" Tests of the job scheduling (--schedule) based on recorded durations. """
+
+import argparse
+
+import grit
+
+
+def schedule(job_names: list, job_stats: dict, schedule: str="longest-first", parallel_jobs: int=4,
+             straggler_factor: float=0):
+    manifest = grit.Manifest()
+    manifest.set_args(argparse.Namespace(schedule=schedule, parallel_jobs=parallel_jobs, dynamic_jobs=False,
+                                         straggler_factor=straggler_factor))
+    manifest.job_stats = job_stats
+    for job_name in job_names:
+        job = grit.Job()
+        job.name = job_name
+        job.stats_key = "clone"
+        manifest.jobs.append(job)
+    manifest.schedule_jobs()
+    return manifest.jobs
+
+
+def test_longest_first():
+    job_stats = {"clone": {"a": [1.0, 2.0, 30.0], "b": [10.0], "c": [5.0]}, "fetch": {"d": [100.0]}}
+    jobs = schedule(["a", "b", "c", "d"], job_stats)
+    # a is estimated by its median (2 s), d (no clone history) by the median of the others (5 s).
+    assert [job.name for job in jobs] == ["b", "c", "d", "a"]
+    assert [job.estimated_duration for job in jobs] == [10.0, 5.0, None, 2.0]
+
+
+def test_manifest_order():
+    job_stats = {"clone": {"a": [1.0], "b": [10.0]}}
+    assert [job.name for job in schedule(["a", "b"], job_stats, schedule="manifest")] == ["a", "b"]
+    # auto is manifest order when executing one job at a time.
+    assert [job.name for job in schedule(["a", "b"], job_stats, schedule="auto", parallel_jobs=1)] == ["a", "b"]
+    assert [job.name for job in schedule(["a", "b"], job_stats, schedule="auto")] == ["b", "a"]
+
+
+def test_without_history():
+    assert [job.name for job in schedule(["a", "b", "c"], {})] == ["a", "b", "c"]
+
+
+def test_straggler_time():
+    jobs = schedule(["a", "b"], {"clone": {"a": [2.0], "b": [100.0]}}, schedule="manifest", straggler_factor=3.0)
+    assert jobs[0].straggler_time == 2.0 + grit.STRAGGLER_MIN_EXCESS
+    assert jobs[1].straggler_time == 300.0
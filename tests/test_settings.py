@@ -0,0 +1,107 @@
+""" Tests of the settings resolution of manifests (repo settings on top of profile settings). """
+
+import json
+
+import pytest
+
+import grit
+
+
+def load_manifest(manifest: dict):
+    result = grit.Manifest()
+    result.load_data(json.dumps(manifest).encode(), "test.json")
+    return result
+
+
+def test_repo_settings_without_profiles():
+    manifest = load_manifest({"repositories": [{"repository": "r1", "branch": "master", "timeout": 5}]})
+    repo = manifest.get_repo("r1")
+    assert manifest.get_optional_setting(repo, "timeout") == 5
+    assert manifest.get_optional_setting(repo, "remote-url") is None
+    assert manifest.get_optional_setting(repo, "jobs-per-host", 2) == 2
+    with pytest.raises(KeyError):
+        manifest.get_mandatory_setting(repo, "remote-url")
+
+
+def test_undefined_default_profile_is_still_an_error():
+    manifest = load_manifest({"default-profile": "missing", "repositories": [{"repository": "r1"}]})
+    with pytest.raises(ValueError):
+        manifest.get_optional_setting(manifest.get_repo("r1"), "branch")
+
+
+def test_inherited_profile_settings():
+    manifest = load_manifest({
+        "default-profile": "child",
+        "profiles": [{"profile": "base", "remote-url": "file:///base", "branch": "master"},
+                     {"profile": "child", "inherit": "base", "branch": "develop"}],
+        "repositories": [{"repository": "r1"}, {"repository": "r2", "branch": "feature", "remote-url": None}]})
+    r1 = manifest.get_repo("r1")
+    r2 = manifest.get_repo("r2")
+    assert manifest.get_optional_setting(r1, "branch") == "develop"
+    assert manifest.get_optional_setting(r2, "branch") == "feature"
+    # A setting set to None doesn't hide the inherited one.
+    assert manifest.get_optional_setting(r2, "remote-url") == "file:///base"
+    # Resolved settings are invalidated when a setting is changed.
+    manifest.get_profile("child").set_setting("branch", "release")
+    assert manifest.get_optional_setting(r1, "branch") == "release"
+
+
+def test_resolved_settings_are_invalidated():
+    manifest = load_manifest({
+        "default-profile": "base",
+        "profiles": [{"profile": "base", "remote-url": "file:///base", "branch": "master"}],
+        "repositories": [{"repository": "r1", "branch": "feature"}]})
+    r1 = manifest.get_repo("r1")
+    assert manifest.get_optional_setting(r1, "branch") == "feature"
+    r1.remove_setting("branch")
+    assert manifest.get_optional_setting(r1, "branch") == "master"
+    manifest.overlay(load_manifest({
+        "profiles": [{"profile": "base", "branch": "develop"}],
+        "repositories": [{"repository": "r2"}]}))
+    assert manifest.get_optional_setting(r1, "branch") == "develop"
+    assert manifest.get_optional_setting(manifest.get_repo("r2"), "remote-url") == "file:///base"
+
+
+def test_profile_inheritance_cycle():
+    manifest = load_manifest({
+        "profiles": [{"profile": "a", "inherit": "b"}, {"profile": "b", "inherit": "a"}],
+        "repositories": [{"repository": "r1", "use-profile": "a"}]})
+    with pytest.raises(ValueError, match="cycle"):
+        manifest.get_optional_setting(manifest.get_repo("r1"), "branch")
+
+
+@pytest.mark.parametrize("manifest, message", [
+    ({"profiles": [{"profile": "p"}, {"profile": "p"}]}, "Profile p is defined more than once in test.json"),
+    ({"repositories": [{"repository": "r1"}, {"repository": "r1"}]},
+     "Repository r1 is defined more than once in test.json")])
+def test_duplicate_names_are_rejected(manifest, message):
+    with pytest.raises(ValueError, match=message):
+        load_manifest(manifest)
+
+
+def test_added_duplicate_names_are_rejected():
+    manifest = load_manifest({"profiles": [{"profile": "p"}], "repositories": [{"repository": "r1"}]})
+    other = load_manifest({"profiles": [{"profile": "p"}], "repositories": [{"repository": "r1"}]})
+    with pytest.raises(ValueError, match="Profile p already exist"):
+        manifest.add_profile(other.get_profile("p"))
+    with pytest.raises(ValueError, match="Repository r1 already exist"):
+        manifest.add_repo(other.get_repo("r1"))
+
+
+def test_status_without_profiles(project):
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    project.write_active_manifest({"repositories": [{"repository": "r1", "branch": "master"}]})
+    result = project.run(["status"])
+    assert "r1" in result.stdout
+    assert "working tree clean" in result.stdout
+
+
+@pytest.mark.parametrize("command", ["fetch", "pull", "push"])
+def test_remote_commands_without_remote_url_or_profiles(project, command):
+    # The remote is configured in the git itself; grit doesn't need to know it.
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    project.write_active_manifest({"repositories": [{"repository": "r1", "branch": "master"}]})
+    result = project.run([command])
+    assert "r1" in result.stdout
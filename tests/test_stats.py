@@ -0,0 +1,37 @@
+""" Tests of the structured command log (--log-format jsonl) and grit stats. """
+
+import os
+import json
+
+import pytest
+
+import grit
+
+
+@pytest.mark.parametrize("values, percent, expected", [
+    ([1], 50, 1), ([1], 95, 1), ([1, 2], 50, 1), ([1, 2, 3, 4], 50, 2), ([1, 2, 3, 4], 95, 4),
+    (list(range(1, 101)), 95, 95), (list(range(1, 101)), 100, 100), ([1, 2, 3], 0, 1),
+])
+def test_get_percentile(values, percent, expected):
+    assert grit.get_percentile(values, percent) == expected
+
+
+def test_stats(project):
+    for repo_name in ("r1", "r2"):
+        project.create_remote(repo_name)
+        project.clone_remote(repo_name)
+    project.write_active_manifest({"repositories": [
+        {"repository": repo_name, "branch": "master", "remote-url": "file://" + project.remotes_path}
+        for repo_name in ("r1", "r2")]})
+    assert "No structured command log" in project.run(["stats"]).stdout
+    project.run(["--log-format", "jsonl", "status"])
+    project.run(["--log-format", "jsonl", "-f", "foreach", "test $REMOTE_REPO = r1"], check=False)
+    with open(os.path.join(project.path, ".grit", grit.JSONL_LOG_FILE_NAME)) as file_stream:
+        records = [json.loads(line) for line in file_stream]
+    assert [(record["repo"], record["exit-code"]) for record in records] == \
+        [("r1", 0), ("r2", 0), ("r1", 0), ("r2", 1)]
+    assert all(record["duration"] >= 0 for record in records)
+    output = project.run(["stats"]).stdout
+    assert "Highest failure rates:" in output
+    assert "50.0%  r2" in output
+    assert "No matching commands" in project.run(["stats", "--command", "clone"]).stdout
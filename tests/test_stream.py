@@ -0,0 +1,20 @@
+""" Tests of the streamed output (--stream). """
+
+import os
+
+
+def test_stream_log_order(project):
+    for repo_name in ("r1", "r2"):
+        project.create_remote(repo_name)
+        project.clone_remote(repo_name)
+        with open(os.path.join(project.path, repo_name, "new.txt"), "w") as file_stream:
+            file_stream.write("x")
+    project.write_active_manifest({"repositories": [{"repository": "r1", "branch": "master"},
+                                                    {"repository": "r2", "branch": "master"}]})
+    result = project.run(["--stream", "status", "-s"])
+    assert sorted(result.stdout.splitlines()) == ["r1: ?? new.txt", "r2: ?? new.txt"]
+    with open(os.path.join(project.path, ".grit", "_commands.log")) as file_stream:
+        log_lines = file_stream.read().splitlines()[3:]   # After the run header.
+    separator = "-" * 80
+    assert log_lines == [separator, "- cd r1 && git status -s", separator, "r1: ?? new.txt",
+                         separator, "- cd r2 && git status -s", separator, "r2: ?? new.txt"]
@@ -0,0 +1,31 @@
+""" Tests of per-command timeouts (--timeout and the timeout setting). """
+
+import os
+import time
+
+
+def setup_project(project, repo_settings: dict=None):
+    project.create_remote("r1")
+    project.clone_remote("r1")
+    repo = {"repository": "r1", "branch": "master", "remote-url": "file://" + project.remotes_path}
+    repo.update(repo_settings or {})
+    project.write_active_manifest({"repositories": [repo]})
+
+
+def test_timeout_option(project):
+    setup_project(project)
+    start = time.time()
+    result = project.run(["--timeout", "0.5", "foreach", "sleep 30"], check=False)
+    assert time.time() - start < 10
+    assert result.returncode == 124
+    with open(os.path.join(project.path, ".grit", "_commands.log")) as file_stream:
+        assert "Timed out after 0.5 s." in file_stream.read()
+
+
+def test_timeout_setting(project):
+    # A manifest without profiles; the setting is in the repo itself.
+    setup_project(project, {"timeout": 0.5})
+    result = project.run(["foreach", "sleep 30"], check=False)
+    assert result.returncode == 124
+    # Not timed out.
+    project.run(["foreach", "true"])
@@ -0,0 +1,35 @@
+""" Tests of the Chrome trace export (--trace). """
+
+import os
+import json
+
+
+def setup_project(project, repo_names=("r1", "r2")):
+    for repo_name in repo_names:
+        project.create_remote(repo_name)
+        project.clone_remote(repo_name)
+    project.write_active_manifest({"repositories": [{"repository": repo_name, "branch": "master"}
+                                                    for repo_name in repo_names]})
+
+
+def load_trace(project):
+    with open(os.path.join(project.path, "trace.json")) as file_stream:
+        return json.load(file_stream)
+
+
+def test_trace_of_jobs(project):
+    setup_project(project)
+    project.run(["-j", "2", "--trace", "trace.json", "status"])
+    events = load_trace(project)["traceEvents"]
+    assert sorted(event["name"] for event in events if event.get("cat") == "job") == ["r1", "r2"]
+    assert len([event for event in events if event.get("cat") == "command"]) == 2
+    assert events[-1]["name"] == "running jobs" and events[-1]["args"]["running"] == 0
+
+
+def test_trace_without_jobs(project):
+    # The snapshot reads HEAD in-process, so no jobs are queued.
+    setup_project(project)
+    project.run(["--trace", "trace.json", "snapshot", "snap"])
+    trace = load_trace(project)
+    assert trace["displayTimeUnit"] == "ms"
+    assert all(event["ph"] == "M" for event in trace["traceEvents"])